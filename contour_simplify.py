@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def _segment_distance(points, a, b):
+    """
+    Distance of each point to its segment a-b.
+
+    Args:
+        points (np.ndarray): (N, 3) points.
+        a (np.ndarray): (N, 3) segment starts.
+        b (np.ndarray): (N, 3) segment ends.
+
+    Returns:
+        np.ndarray: (N,) distances.
+    """
+    ab = b - a
+    length_sq = np.einsum("ij,ij->i", ab, ab)
+    t = np.einsum("ij,ij->i", points - a, ab)
+    t = np.clip(np.divide(t, length_sq, out=np.zeros_like(t), where=length_sq > 0), 0.0, 1.0)
+    closest = a + t[:, None] * ab
+    return np.linalg.norm(points - closest, axis=1)
+
+
+def simplify_contour(points, tolerance):
+    """
+    Simplify a closed contour with the Douglas-Peucker algorithm.
+
+    The recursion is run level by level: every segment of the current polyline is
+    checked at once, and each segment whose farthest point deviates more than the
+    tolerance is split at that point. Contours that would collapse below three points
+    are returned unchanged.
+
+    Args:
+        points (np.ndarray): (N, 3) contour points; the contour is implicitly closed.
+        tolerance (float): Maximum allowed distance of a removed point to the simplified
+                           contour, in the units of the points.
+
+    Returns:
+        tuple: (simplified (M, 3) points, maximum deviation of the removed points).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) <= 3:
+        return points, 0.0
+
+    # Close the polyline and anchor it at the first point and the point farthest from it
+    closed = np.vstack([points, points[:1]])
+    n = len(closed)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, int(np.argmax(np.linalg.norm(points - points[0], axis=1))), n - 1]] = True
+
+    while True:
+        anchors = np.flatnonzero(keep)
+        segment = np.minimum(np.searchsorted(anchors, np.arange(n), side="right") - 1, len(anchors) - 2)
+        distance = _segment_distance(closed, closed[anchors[segment]], closed[anchors[segment + 1]])
+        distance[keep] = 0.0
+
+        # Farthest point of every segment
+        order = np.lexsort((distance, segment))
+        farthest = order[np.r_[np.flatnonzero(np.diff(segment[order])), n - 1]]
+        split = farthest[distance[farthest] > tolerance]
+        if len(split) == 0:
+            break
+        keep[split] = True
+
+    keep[n - 1] = False
+    if np.count_nonzero(keep) < 3:
+        return points, 0.0
+    return points[keep[:-1]], float(distance.max())
+
+
+def decimate_structures(structures, tolerance):
+    """
+    Simplify the contours of every structure and report the reduction per ROI.
+
+    The input structures are not modified; the returned structures are shallow copies
+    with simplified "points". Archive contour points are in cm, so the tolerance is
+    converted from mm before simplifying and the deviation is reported in mm.
+
+    Args:
+        structures (list): Structures from LoadStructures.load_structures.
+        tolerance (float): Maximum contour deviation in mm (see simplify_contour).
+
+    Returns:
+        tuple: (simplified structures, report) where report is a list of dictionaries with
+               "name", "points_before", "points_after", "reduction" (fraction of points
+               removed) and "max_deviation" (mm) per ROI.
+    """
+    simplified, report = [], []
+    for structure in structures:
+        contours, max_deviation = [], 0.0
+        for points in structure["points"]:
+            contour, deviation = simplify_contour(points, tolerance / 10.0)
+            contours.append(contour)
+            max_deviation = max(max_deviation, deviation)
+
+        points_before = sum(len(points) for points in structure["points"])
+        points_after = sum(len(points) for points in contours)
+        simplified.append(dict(structure, points=contours))
+        report.append({
+            "name": structure["name"],
+            "points_before": points_before,
+            "points_after": points_after,
+            "reduction": 1.0 - points_after / points_before if points_before else 0.0,
+            "max_deviation": max_deviation * 10.0,
+        })
+    return simplified, report
@@ -0,0 +1,142 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import pydicom
+from pydicom.encaps import encapsulate
+from pydicom.pixels.encoders import RLELosslessEncoder
+from pydicom.uid import DeflatedExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless
+
+# Transfer syntaxes the writers accept, by option name
+TRANSFER_SYNTAXES = {
+    "implicit": ImplicitVRLittleEndian,
+    "rle": RLELossless,
+    "deflate": DeflatedExplicitVRLittleEndian,
+}
+
+
+def transfer_syntax_uid(name):
+    """
+    Look up the transfer syntax UID for an option name.
+
+    Args:
+        name (str): "implicit", "rle" or "deflate".
+
+    Returns:
+        pydicom.uid.UID: Transfer syntax UID.
+
+    Raises:
+        ValueError: If the name is unknown.
+    """
+    if name not in TRANSFER_SYNTAXES:
+        raise ValueError(f"Unknown transfer syntax: {name}. Expected one of {sorted(TRANSFER_SYNTAXES)}")
+    return TRANSFER_SYNTAXES[name]
+
+
+def can_stream(transfer_syntax):
+    """
+    Whether pixel data can be streamed to the file with write_streamed.
+
+    Args:
+        transfer_syntax (str): Transfer syntax option name.
+
+    Returns:
+        bool: True for uncompressed transfer syntaxes.
+    """
+    return transfer_syntax_uid(transfer_syntax) == ImplicitVRLittleEndian
+
+
+def _rle_encode_frame(frame):
+    """
+    RLE Lossless encode one unsigned 16-bit MONOCHROME2 frame.
+    """
+    return RLELosslessEncoder.encode(
+        frame,
+        rows=frame.shape[0],
+        columns=frame.shape[1],
+        samples_per_pixel=1,
+        number_of_frames=1,
+        bits_allocated=16,
+        bits_stored=16,
+        pixel_representation=0,
+        photometric_interpretation="MONOCHROME2",
+    )
+
+
+def rle_encode_frames(frames, workers=None):
+    """
+    RLE Lossless encode frames, spread over a process pool.
+
+    RLE encoding is CPU bound pure Python, so processes rather than threads are used.
+
+    Args:
+        frames (sequence): 2D uint16 arrays of shape (rows, columns).
+        workers (int, optional): Encoder processes; defaults to the CPU count. 1 encodes
+                                 in the calling process.
+
+    Returns:
+        list: Encoded frames (bytes), in order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(frames) <= 1:
+        return [_rle_encode_frame(frame) for frame in frames]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(frames))) as executor:
+        chunk_size = max(1, len(frames) // (4 * workers))
+        return list(executor.map(_rle_encode_frame, frames, chunksize=chunk_size))
+
+
+def set_pixel_data(ds, pixel_data, transfer_syntax, encoded_frames=None):
+    """
+    Set the transfer syntax of a dataset and assign its pixel data accordingly.
+
+    Args:
+        ds (pydicom.dataset.FileDataset): Dataset to update.
+        pixel_data: Uncompressed pixel data (bytes-like), used unless RLE frames are given.
+        transfer_syntax (str): "implicit", "rle" or "deflate".
+        encoded_frames (list, optional): RLE encoded frames from rle_encode_frames;
+                                         required for "rle".
+    """
+    uid = transfer_syntax_uid(transfer_syntax)
+    ds.file_meta.TransferSyntaxUID = uid
+    if uid == RLELossless:
+        ds.PixelData = encapsulate(encoded_frames)
+        ds["PixelData"].VR = "OB"
+        ds["PixelData"].is_undefined_length = True
+    else:
+        ds.PixelData = pixel_data
+
+
+def write_streamed(ds, fp, pixel_chunks, nbytes):
+    """
+    Write a dataset, then append its Pixel Data element from chunks of bytes.
+
+    The header is encoded by pydicom without pixel data; the Pixel Data element header and
+    the chunks are then written directly, so the pixel data is never held in memory as a
+    whole. Pixel Data must be the last element of the dataset.
+
+    Args:
+        ds (pydicom.dataset.FileDataset): Dataset without PixelData, with an Implicit VR
+                                          Little Endian transfer syntax.
+        fp (file): Writable binary file object.
+        pixel_chunks (iterable): Bytes-like chunks of pixel data, in file order.
+        nbytes (int): Total pixel data length in bytes (must be even).
+
+    Raises:
+        ValueError: If the transfer syntax cannot be streamed or the chunks do not add up to nbytes.
+    """
+    if ds.file_meta.TransferSyntaxUID != ImplicitVRLittleEndian:
+        raise ValueError(f"Pixel data cannot be streamed with transfer syntax {ds.file_meta.TransferSyntaxUID}")
+    if "PixelData" in ds:
+        raise ValueError("Dataset already has pixel data")
+    if nbytes % 2:
+        raise ValueError(f"Pixel data length must be even, got {nbytes}")
+
+    pydicom.dcmwrite(fp, ds)
+    # (7FE0,0010) Pixel Data, implicit VR: tag and 32-bit length
+    fp.write(struct.pack("<HHI", 0x7FE0, 0x0010, nbytes))
+    written = 0
+    for chunk in pixel_chunks:
+        fp.write(chunk)
+        written += memoryview(chunk).nbytes
+    if written != nbytes:
+        raise ValueError(f"Streamed {written} bytes of pixel data, expected {nbytes}")
@@ -0,0 +1,153 @@
+import numpy as np
+from load_structure import contour_spans
+
+
+def contours_on_grid(points_data, start, width, dimensions):
+    """
+    Resample planar contours onto the slices of another grid, e.g. the dose grid.
+
+    Every grid slice inside the structure's z extent takes the contours of the nearest
+    contour slice, moved to the grid slice position. This keeps the even-odd fill rule
+    valid when the grid slices are thicker than the image slices: contours from
+    different image slices are never merged onto one grid slice.
+
+    Args:
+        points_data (list): Contours, each an (N, 3) sequence of x, y, z points on one slice.
+        start (list): Grid origin (x, y, z).
+        width (list): Voxel size (x, y, z).
+        dimensions (list): Grid size (x, y, z).
+
+    Returns:
+        list: Contours as (N, 3) arrays, with z on grid slice positions.
+    """
+    contours = [np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in points_data]
+    contours = [points for points in contours if len(points) >= 3]
+    if not contours:
+        return []
+
+    contour_z = np.round([points[0, 2] for points in contours], 3)
+    levels = np.unique(contour_z)
+    half_spacing = np.median(np.diff(levels)) / 2 if len(levels) > 1 else abs(width[2]) / 2
+
+    centers = start[2] + np.arange(int(dimensions[2])) * width[2]
+    inside = (centers >= levels[0] - half_spacing) & (centers <= levels[-1] + half_spacing)
+    nearest = levels[np.abs(centers[:, None] - levels[None, :]).argmin(axis=1)]
+
+    resampled = []
+    for center, level in zip(centers[inside], nearest[inside]):
+        for points, z in zip(contours, contour_z):
+            if z == level:
+                moved = points.copy()
+                moved[:, 2] = center
+                resampled.append(moved)
+    return resampled
+
+
+def _span_voxels(spans, dimensions):
+    """
+    Flat Fortran-order voxel indices covered by filled runs from contour_spans.
+    """
+    nx, ny, _ = (int(n) for n in dimensions)
+    slices, rows, x_start, x_stop = spans
+    lengths = x_stop - x_start + 1
+    run = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return x_start[run] + offsets + nx * (rows[run] + ny * slices[run])
+
+
+def compute_dvhs(dose_data, structures, bin_width=0.01, dose_levels=(), volume_levels=()):
+    """
+    Compute the DVHs of all structures on the dose grid in one vectorized pass.
+
+    Each ROI is scan-converted from its contours directly on the dose grid, so no image
+    masks are built. The (ROI, voxel) memberships of all ROIs are concatenated, which
+    lets overlapping ROIs share voxels, and a single np.bincount over ROI x dose bin
+    gives every differential DVH at once.
+
+    Args:
+        dose_data (dict): Dose data and metadata from LoadPlanDose.load_dose.
+        structures (list): Structures from LoadStructures.load_structures.
+        bin_width (float): Dose bin width in Gy.
+        dose_levels (sequence): Doses in Gy for V metrics (percent volume receiving at least the dose).
+        volume_levels (sequence): Percent volumes for D metrics (minimum dose to the hottest volume).
+
+    Returns:
+        dict: DVH data with keys:
+            - names (list): ROI names.
+            - bins (np.ndarray): Dose bin edges in Gy, length nbins + 1.
+            - differential (np.ndarray): (ROIs, nbins) volume in cm^3 per dose bin.
+            - cumulative (np.ndarray): (ROIs, nbins) volume in cm^3 receiving at least each lower bin edge.
+            - metrics (np.ndarray): Structured array with one record per ROI: name, volume (cm^3),
+              Dmin, Dmean, Dmax (Gy), D<level> (Gy) per volume level and V<level> (%) per dose level.
+    """
+    dimensions = tuple(int(n) for n in dose_data["dimensions"])
+    start, width = dose_data["start"], dose_data["width"]
+    # Archive grids are in cm, so one voxel is already in cm^3
+    voxel_cc = abs(float(np.prod(width)))
+
+    # (ROI, voxel) pairs for every ROI on the dose grid
+    roi_ids, voxels = [], []
+    for roi, structure in enumerate(structures):
+        contours = contours_on_grid(structure["points"], start, width, dimensions)
+        roi_voxels = _span_voxels(contour_spans(contours, start, width, dimensions), dimensions)
+        voxels.append(roi_voxels)
+        roi_ids.append(np.full(len(roi_voxels), roi, dtype=np.int64))
+    num_rois = len(structures)
+    roi_ids = np.concatenate(roi_ids) if roi_ids else np.empty(0, dtype=np.int64)
+    voxels = np.concatenate(voxels) if voxels else np.empty(0, dtype=np.int64)
+
+    # The file buffer is x fastest, so flat Fortran indices address it directly
+    doses = np.asarray(dose_data["data"].reshape(-1)[voxels], dtype=np.float64)
+    doses = np.nan_to_num(doses, nan=0.0, posinf=0.0, neginf=0.0).clip(min=0.0)
+
+    num_bins = int(doses.max() // bin_width) + 1 if len(doses) else 1
+    bin_index = np.minimum((doses // bin_width).astype(np.int64), num_bins - 1)
+    counts = np.bincount(roi_ids * num_bins + bin_index, minlength=num_rois * num_bins).reshape(num_rois, num_bins)
+    differential = counts * voxel_cc
+    cumulative = differential[:, ::-1].cumsum(axis=1)[:, ::-1]
+    bins = np.arange(num_bins + 1) * bin_width
+
+    # Exact per-ROI statistics
+    voxel_counts = np.bincount(roi_ids, minlength=num_rois)
+    dose_sum = np.bincount(roi_ids, weights=doses, minlength=num_rois)
+    dose_max = np.full(num_rois, -np.inf)
+    dose_min = np.full(num_rois, np.inf)
+    np.maximum.at(dose_max, roi_ids, doses)
+    np.minimum.at(dose_min, roi_ids, doses)
+    empty = voxel_counts == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dose_mean = dose_sum / voxel_counts
+        relative = cumulative / cumulative[:, :1]
+    dose_mean[empty] = dose_max[empty] = dose_min[empty] = np.nan
+
+    # D and V metrics from the cumulative DVHs of all ROIs at once
+    volume_levels = np.asarray(volume_levels, dtype=np.float64)
+    dose_levels = np.asarray(dose_levels, dtype=np.float64)
+    covered = (relative[:, None, :] * 100.0 >= volume_levels[None, :, None]).sum(axis=2)
+    d_metrics = np.where(covered > 0, bins[np.maximum(covered - 1, 0)], np.nan)
+    level_bins = np.ceil(dose_levels / bin_width - 1e-9).astype(np.int64)
+    v_metrics = np.zeros((num_rois, len(dose_levels)))
+    valid = level_bins < num_bins
+    v_metrics[:, valid] = relative[:, level_bins[valid]] * 100.0
+    v_metrics[empty] = np.nan
+
+    names = [structure["name"] for structure in structures]
+    fields = [("name", f"U{max(map(len, names), default=1)}"), ("volume", "f8"), ("Dmin", "f8"), ("Dmean", "f8"), ("Dmax", "f8")]
+    fields += [(f"D{level:g}", "f8") for level in volume_levels]
+    fields += [(f"V{level:g}", "f8") for level in dose_levels]
+    metrics = np.zeros(num_rois, dtype=fields)
+    metrics["name"] = names
+    metrics["volume"] = voxel_counts * voxel_cc
+    metrics["Dmin"], metrics["Dmean"], metrics["Dmax"] = dose_min, dose_mean, dose_max
+    for i, level in enumerate(volume_levels):
+        metrics[f"D{level:g}"] = d_metrics[:, i]
+    for i, level in enumerate(dose_levels):
+        metrics[f"V{level:g}"] = v_metrics[:, i]
+
+    return {
+        "names": list(metrics["name"]),
+        "bins": bins,
+        "differential": differential,
+        "cumulative": cumulative,
+        "metrics": metrics,
+    }
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = "manifest.json"
+
+# Bump when the writers change their output, so existing exports are rewritten
+# 2: contour tolerance in mm, option-dependent UIDs, memmap in the fingerprint
+# 3: Enhanced CT equipment, frame of reference and volumetric attributes
+MANIFEST_VERSION = 3
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 of a file.
+
+    Args:
+        path (str): File path.
+
+    Returns:
+        str: Hex digest.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ExportManifest:
+    """
+    Record of the DICOM objects written by a directory export, used to skip up-to-date objects.
+
+    Objects are tracked per group, a subdirectory of the export (RTPlan, RTStruct, CT, Dose).
+    The manifest stores a fingerprint of the inputs and export options plus the size, mtime
+    and SHA-256 of every file of each finished group. It is saved after each group, so an
+    interrupted export keeps the groups that were completed. Files are only re-hashed when
+    their size or mtime changed since they were recorded.
+    """
+
+    def __init__(self, export_path, fingerprint):
+        """
+        Initialize the ExportManifest and load the existing manifest, if any.
+
+        Entries written for a different fingerprint are dropped, though their files are still
+        known so they can be removed before the group is rewritten.
+
+        Args:
+            export_path (str): Export directory.
+            fingerprint (dict): JSON-serializable description of the inputs and options.
+        """
+        self.export_path = export_path
+        self.path = os.path.join(export_path, MANIFEST_NAME)
+        self.fingerprint = dict(fingerprint, version=MANIFEST_VERSION)
+        self.groups = {}
+        self._previous = {}
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable export manifest {self.path}: {e}")
+            return
+
+        groups = manifest.get("groups", {})
+        self._previous = manifest.get("previous", {})
+        if manifest.get("fingerprint") == self.fingerprint:
+            self.groups = groups
+        else:
+            for group, files in groups.items():
+                self._previous[group] = {**self._previous.get(group, {}), **files}
+
+    def is_current(self, group):
+        """
+        Whether every file recorded for a group is on disk and unchanged.
+
+        Args:
+            group (str): Group name.
+
+        Returns:
+            bool: True if the group can be skipped.
+        """
+        files = self.groups.get(group)
+        if not files:
+            return False
+
+        for name, entry in files.items():
+            path = os.path.join(self.export_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_size != entry["size"]:
+                return False
+            if stat.st_mtime_ns != entry["mtime"] and file_hash(path) != entry["sha256"]:
+                return False
+        return True
+
+    def discard(self, group):
+        """
+        Forget a group and remove the files recorded for it, before it is rewritten.
+
+        Args:
+            group (str): Group name.
+        """
+        files = {**self._previous.pop(group, {}), **self.groups.pop(group, {})}
+        for name in files:
+            try:
+                os.remove(os.path.join(self.export_path, name))
+            except FileNotFoundError:
+                pass
+        self.save()
+
+    def record(self, group):
+        """
+        Hash and record every file of a group's directory, then save the manifest.
+
+        Args:
+            group (str): Group name, the subdirectory holding its files.
+        """
+        directory = os.path.join(self.export_path, group)
+        files = {}
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_file():
+                stat = entry.stat()
+                files[f"{group}/{entry.name}"] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "sha256": file_hash(entry.path),
+                }
+        self.groups[group] = files
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest atomically, so an interruption never leaves it half written.
+        """
+        manifest = {
+            "fingerprint": self.fingerprint,
+            "groups": self.groups,
+            "previous": self._previous,
+        }
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
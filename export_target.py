@@ -0,0 +1,266 @@
+import io
+import os
+import gzip
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Members up to this size are encoded in memory; larger ones spill to a temporary file
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+@contextmanager
+def _spooled_member(max_size=SPOOL_SIZE):
+    """
+    Scratch file a bundle member is encoded into before it is added to the archive.
+
+    Encoding into a private file lets writers on several threads encode at the same time;
+    only the copy into the archive is serialized. Large multi-frame files go to disk
+    instead of staying in memory.
+
+    Args:
+        max_size (int): Bytes kept in memory before spilling to a temporary file.
+
+    Yields:
+        tempfile.SpooledTemporaryFile: Seekable binary scratch file.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=max_size) as spool:
+        yield spool
+
+
+@contextmanager
+def open_output(output_path, target=None):
+    """
+    Open an export file for binary writing, either on disk or inside a bundle.
+
+    Args:
+        output_path (str): File path, or the member name when target is given.
+        target (ZipBundle or TarBundle, optional): Bundle to write into.
+
+    Yields:
+        file: Writable binary file object.
+    """
+    if target is None:
+        with open(output_path, "wb") as f:
+            yield f
+    else:
+        with target.open(output_path) as f:
+            yield f
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Gzip stream whose blocks are compressed on a thread pool.
+
+    Each block becomes a separate gzip member; concatenated members form a valid gzip file
+    (read by gzip, tarfile and the gzip command line tools). zlib releases the GIL, so the
+    blocks compress in parallel while the output stays one sequential write.
+    """
+
+    def __init__(self, fileobj, workers=4, block_size=4 * 1024 * 1024, compresslevel=6):
+        """
+        Initialize the ParallelGzipWriter.
+
+        Args:
+            fileobj (file): Binary file to write the compressed stream to.
+            workers (int): Compression threads.
+            block_size (int): Uncompressed bytes per gzip member.
+            compresslevel (int): zlib compression level.
+        """
+        self._fileobj = fileobj
+        self._block_size = block_size
+        self._compresslevel = compresslevel
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._max_pending = 2 * workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gzip")
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(gzip.compress, block, self._compresslevel, mtime=0))
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+        self._executor.shutdown()
+        super().close()
+
+
+class ZipBundle:
+    """
+    Export target writing every DICOM object straight into one .zip file.
+
+    Each member is encoded into its own spooled scratch file, so writers on several threads
+    encode in parallel; only copying the finished member into the archive (and deflating
+    it) holds the bundle lock.
+    """
+
+    def __init__(self, path, compress=True, compresslevel=None, spool_size=SPOOL_SIZE):
+        """
+        Initialize the ZipBundle.
+
+        Args:
+            path (str): Path of the .zip file.
+            compress (bool): Deflate members; False stores them as is.
+            compresslevel (int, optional): zlib compression level.
+            spool_size (int): Bytes of a member kept in memory before spilling to disk.
+        """
+        self.path = path
+        self.spool_size = spool_size
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self._zip = zipfile.ZipFile(path, "w", compression=compression, compresslevel=compresslevel)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def open(self, name):
+        """
+        Open a member for writing; it is added to the archive when closed.
+
+        Args:
+            name (str): Member path inside the archive.
+
+        Yields:
+            file: Writable binary file object.
+        """
+        with _spooled_member(self.spool_size) as spool:
+            yield spool
+            spool.seek(0)
+            with self._lock, self._zip.open(name.replace(os.sep, "/"), "w", force_zip64=True) as f:
+                shutil.copyfileobj(spool, f)
+
+    def close(self):
+        """
+        Write the zip directory and close the file.
+        """
+        self._zip.close()
+
+
+class TarBundle:
+    """
+    Export target writing every DICOM object into one .tar or .tar.gz stream.
+
+    Tar headers need the member size up front, so each object is encoded into a spooled
+    scratch file (in memory up to spool_size, then on disk) and then appended; the archive
+    itself is one sequential write. With workers > 1 a .tar.gz is compressed on a thread
+    pool (see ParallelGzipWriter).
+    """
+
+    def __init__(self, path, compression=None, workers=1, compresslevel=6, spool_size=SPOOL_SIZE):
+        """
+        Initialize the TarBundle.
+
+        Args:
+            path (str): Path of the .tar or .tar.gz file.
+            compression (str, optional): "gz" for gzip, None for an uncompressed tar.
+            workers (int): Compression threads for gzip.
+            compresslevel (int): zlib compression level.
+            spool_size (int): Bytes of a member kept in memory before spilling to disk.
+        """
+        self.path = path
+        self.spool_size = spool_size
+        self._file = open(path, "wb")
+        self._gzip = None
+        if compression == "gz":
+            if workers > 1:
+                self._gzip = ParallelGzipWriter(self._file, workers, compresslevel=compresslevel)
+            else:
+                self._gzip = gzip.GzipFile(fileobj=self._file, mode="wb", compresslevel=compresslevel, mtime=0)
+        elif compression is not None:
+            raise ValueError(f"Unsupported tar compression: {compression}")
+        self._tar = tarfile.open(fileobj=self._gzip or self._file, mode="w|")
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def open(self, name):
+        """
+        Open a member for writing; it is added to the archive when closed.
+
+        Args:
+            name (str): Member path inside the archive.
+
+        Yields:
+            file: Writable binary file object.
+        """
+        with _spooled_member(self.spool_size) as spool:
+            yield spool
+            info = tarfile.TarInfo(name.replace(os.sep, "/"))
+            info.size = spool.seek(0, io.SEEK_END)
+            info.mtime = int(time.time())
+            spool.seek(0)
+            with self._lock:
+                self._tar.addfile(info, spool)
+
+    def close(self):
+        """
+        Finish the archive and close the file.
+        """
+        self._tar.close()
+        if self._gzip is not None:
+            self._gzip.close()
+        self._file.close()
+
+
+# Bundle file extensions by format name
+BUNDLE_FORMATS = {
+    "zip": ".zip",
+    "tar": ".tar",
+    "tar.gz": ".tar.gz",
+}
+
+
+def open_bundle(path, bundle, workers=1):
+    """
+    Create a bundle export target.
+
+    Args:
+        path (str): Bundle file path without extension.
+        bundle (str): "zip", "tar" or "tar.gz".
+        workers (int): Compression threads (used for tar.gz).
+
+    Returns:
+        ZipBundle or TarBundle: Open export target.
+    """
+    if bundle not in BUNDLE_FORMATS:
+        raise ValueError(f"Unknown bundle format: {bundle}. Expected one of {sorted(BUNDLE_FORMATS)}")
+    path = path.rstrip("/\\") + BUNDLE_FORMATS[bundle]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if bundle == "zip":
+        return ZipBundle(path)
+    return TarBundle(path, compression="gz" if bundle == "tar.gz" else None, workers=workers)
@@ -0,0 +1,63 @@
+from pydicom.uid import generate_uid
+
+# UID roles derived from the image rather than the plan, so every plan exported from the
+# same CT shares its study, frame of reference and CT series
+IMAGE_ROLES = ("study", "frame_of_reference", "ct")
+
+
+class ExportUIDs:
+    """
+    Deterministic DICOM UIDs for the objects of one plan export.
+
+    Every UID is a hash of the archive databaseUID it belongs to and its role (and slice
+    index), so exporting the same plan again gives the same UIDs. Export options that
+    change an object's content are mixed in as a variant of its role, so differently
+    written objects never share a SOP Instance UID.
+    """
+
+    def __init__(self, plan_uid, image_uid=None, variants=None):
+        """
+        Initialize the ExportUIDs.
+
+        Args:
+            plan_uid (str): databaseUID of the plan.
+            image_uid (str, optional): databaseUID of the planning image; defaults to the plan.
+            variants (dict, optional): Role -> string describing the non-default options the
+                                       role's objects were written with.
+        """
+        self.plan_uid = plan_uid
+        self.image_uid = image_uid or plan_uid
+        self.variants = {role: variant for role, variant in (variants or {}).items() if variant}
+
+    def uid(self, role, *parts):
+        """
+        Derive the UID of one object.
+
+        Args:
+            role (str): "study", "frame_of_reference", "ct", "rtplan", "rtstruct" or "rtdose".
+            *parts: Further qualifiers, e.g. "series", "sop" and a slice number.
+
+        Returns:
+            pydicom.uid.UID: Deterministic UID.
+        """
+        source = self.image_uid if role in IMAGE_ROLES else self.plan_uid
+        if role in self.variants:
+            role = f"{role}:{self.variants[role]}"
+        return generate_uid(entropy_srcs=[source, role, *(str(part) for part in parts)])
+
+
+def make_uid(uids, role, *parts):
+    """
+    UID from an ExportUIDs if given, otherwise a new random UID.
+
+    Args:
+        uids (ExportUIDs, optional): Deterministic UID source.
+        role (str): UID role (see ExportUIDs.uid).
+        *parts: Further qualifiers.
+
+    Returns:
+        pydicom.uid.UID: UID.
+    """
+    if uids is None:
+        return generate_uid()
+    return uids.uid(role, *parts)
@@ -1,5 +1,157 @@
 import os
-import xml.etree.ElementTree as ET
+from patient_archive import PatientArchive, full_plan_node
+from load_plan import PlanLoader
+from load_plan_dose import LoadPlanDose
+
+# approvedPlanTrialUID values that mean the plan was never approved
+UNAPPROVED_TRIAL_UIDS = ("", "* * * DO NOT CHANGE THIS STRING VALUE * * *")
+
+
+class PlanRecord:
+    """
+    Compact description of one plan in a patient archive.
+
+    Records only hold the identifying fields; the image, dose and sinogram of a plan are
+    loaded from the shared archive when the corresponding load_* method is called.
+    """
+
+    __slots__ = ("uid", "label", "delivery_type", "plan_type", "approved_trial_uid",
+                 "trial_uids", "legacy", "approved", "finder")
+
+    def __init__(self, uid, label, delivery_type, plan_type, approved_trial_uid, trial_uids,
+                 legacy=False, approved=False, finder=None):
+        """
+        Initialize the PlanRecord.
+
+        Args:
+            uid (str): Plan database UID.
+            label (str): Plan label, or None if missing.
+            delivery_type (str): planDeliveryType (e.g. "Helical"), or None.
+            plan_type (str): typeOfPlan (e.g. "PATIENT"), or None.
+            approved_trial_uid (str): approvedPlanTrialUID, or None.
+            trial_uids (list): UIDs of the plan's patientPlanTrial children.
+            legacy (bool): True for legacyPlan entries.
+            approved (bool): Approval status.
+            finder (PlanFinder, optional): Finder used to load plan data on demand.
+        """
+        self.uid = uid
+        self.label = label
+        self.delivery_type = delivery_type
+        self.plan_type = plan_type
+        self.approved_trial_uid = approved_trial_uid
+        self.trial_uids = trial_uids
+        self.legacy = legacy
+        self.approved = approved
+        self.finder = finder
+
+    def __repr__(self):
+        return (f"PlanRecord(uid={self.uid!r}, label={self.label!r}, delivery_type={self.delivery_type!r}, "
+                f"approved={self.approved}, legacy={self.legacy})")
+
+    def to_dict(self):
+        """
+        Return the record fields as a JSON serializable dictionary.
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != "finder"}
+
+    @classmethod
+    def from_dict(cls, data, finder=None):
+        """
+        Build a record from to_dict() output.
+        """
+        return cls(finder=finder, **data)
+
+    def load_image(self):
+        """
+        Load the plan's reference image.
+
+        Returns:
+            dict: Image data and metadata (see LoadImage.load_image).
+        """
+        # Imported here: load_image pulls in matplotlib, which plan searches do not need
+        from load_image import LoadImage
+
+        finder = self.finder
+        return LoadImage(finder.xml_path, finder.file_name, self.uid, archive=finder.archive).load_image()
+
+    def load_dose(self):
+        """
+        Load the plan's final dose.
+
+        Returns:
+            dict: Dose data and metadata (see LoadPlanDose.load_dose).
+        """
+        finder = self.finder
+        return LoadPlanDose(finder.xml_path, finder.file_name, self.uid, archive=finder.archive).load_dose()
+
+    def load_sinogram(self):
+        """
+        Load the plan's delivery data, including its sinograms.
+
+        Returns:
+            dict: Plan data (see PlanLoader.load_plan).
+        """
+        finder = self.finder
+        return PlanLoader(finder.xml_path, finder.file_name, self.uid, archive=finder.archive).load_plan()
+
+
+class PlanCatalog:
+    """
+    Filterable collection of PlanRecord objects. Every filter returns a new PlanCatalog.
+    """
+
+    def __init__(self, records):
+        self.records = list(records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def filter(self, predicate):
+        """
+        Keep the records for which predicate(record) is true.
+        """
+        return PlanCatalog(record for record in self.records if predicate(record))
+
+    def approved(self):
+        """
+        Keep approved plans.
+        """
+        return self.filter(lambda record: record.approved)
+
+    def patient(self):
+        """
+        Keep non-legacy PATIENT plans that have a UID.
+        """
+        return self.filter(lambda record: not record.legacy and record.plan_type == "PATIENT" and record.uid)
+
+    def legacy(self):
+        """
+        Keep legacy plans that have a UID.
+        """
+        return self.filter(lambda record: record.legacy and record.uid)
+
+    def delivery_type(self, plan_type):
+        """
+        Keep records with the given planDeliveryType; a falsy plan_type keeps everything.
+        """
+        if not plan_type:
+            return PlanCatalog(self.records)
+        return self.filter(lambda record: record.delivery_type == plan_type)
+
+    def by_uid(self, uid):
+        """
+        Return the record with the given UID, or None.
+        """
+        for record in self.records:
+            if record.uid == uid:
+                return record
+        return None
 
 
 class PlanFinder:
@@ -7,13 +159,14 @@ class PlanFinder:
     Class to handle finding approved plans from a TomoTherapy patient archive XML file.
     """
 
-    def __init__(self, xml_path, file_name):
+    def __init__(self, xml_path, file_name, archive=None):
         """
         Initialize the PlanFinder.
 
         Args:
             xml_path (str): Path to the directory containing the XML file.
             file_name (str): Name of the XML file.
+            archive (PatientArchive, optional): Shared parsed archive to read from.
         """
         self.xml_path = xml_path
         self.file_name = file_name
@@ -22,8 +175,59 @@ class PlanFinder:
         if not os.path.exists(self.full_path):
             raise FileNotFoundError(f"XML file not found: {self.full_path}")
 
-        self.tree = ET.parse(self.full_path)
-        self.root = self.tree.getroot()
+        self.archive = PatientArchive.resolve(archive, xml_path, file_name)
+        self._catalog = None
+
+    @property
+    def root(self):
+        return self.archive.root
+
+    def catalog(self):
+        """
+        Classify every briefPlan and legacyPlan of the archive in a single pass.
+
+        Returns:
+            PlanCatalog: All plans of the archive, in document order.
+        """
+        if self._catalog is None:
+            records = self.archive.cached("plan_catalog", self._build_catalog)
+            self._catalog = PlanCatalog(PlanRecord.from_dict(record, finder=self) for record in records)
+        return self._catalog
+
+    def _build_catalog(self):
+        """
+        Walk the archive once and describe every plan.
+
+        Returns:
+            list: PlanRecord dictionaries (see PlanRecord.to_dict).
+        """
+        records = []
+        for plan in self.root.iter("briefPlan", "legacyPlan"):
+            uid = plan.findtext("dbInfo/databaseUID")
+
+            if plan.tag == "legacyPlan":
+                approval_status = plan.findtext("approvalStatus")
+                record = PlanRecord(
+                    uid, plan.findtext("planLabel"), plan.findtext("planDeliveryType"),
+                    plan.findtext("typeOfPlan"), None, [], legacy=True,
+                    approved=bool(approval_status) and approval_status.lower() == "approved",
+                )
+            else:
+                # Only plans stored as fullPlanDataArray/fullPlanDataArray/plan/briefPlan
+                if full_plan_node(plan) is None:
+                    continue
+                approved_trial_uid = plan.findtext("approvedPlanTrialUID")
+                trial_uids = [
+                    trial.findtext("dbInfo/databaseUID")
+                    for trial in self.archive.find_children(uid, tag="patientPlanTrial")
+                ] if uid else []
+                record = PlanRecord(
+                    uid, plan.findtext("planLabel"), plan.findtext("planDeliveryType"),
+                    plan.findtext("typeOfPlan"), approved_trial_uid, trial_uids,
+                    approved=(approved_trial_uid or "") not in UNAPPROVED_TRIAL_UIDS,
+                )
+            records.append(record.to_dict())
+        return records
 
     def find_all_plans(self, plan_type=None):
         """
@@ -37,69 +241,10 @@ class PlanFinder:
         """
         print(f"Searching for all plans in {self.file_name}...")
 
-        plans = []  # This will store all the found plans
-
-        for plan in self.root.findall(".//fullPlanDataArray/fullPlanDataArray/plan/briefPlan"):
-            # Extract various details for each plan
-            db_uid = plan.findtext("dbInfo/databaseUID", default="Unknown UID")
-            plan_label = plan.findtext("planLabel", default="Unknown Label")
-            type_of_plan = plan.findtext("typeOfPlan",
-                                         default="Unknown Type")  # Type of plan (e.g., Composite, PATIENT)
-
-            # Debug: Print the details of the plan
-            print(f"Plan UID: {db_uid}")
-            print(f"Plan Label: {plan_label}")
-            print(f"Type of Plan: {type_of_plan}")
-
-            # Extract approval status
-            approved_uid = plan.find("approvedPlanTrialUID")
-            if approved_uid is not None:
-                print("Approved Plan UID:", approved_uid.text)
-            else:
-                print("Approved Plan UID: Not Available")
-
-            approved_status = (
-                    approved_uid is not None
-                    and approved_uid.text not in ["", "* * * DO NOT CHANGE THIS STRING VALUE * * *"]
-            )
-
-            # Extract delivery type if plan_type is provided
-            if plan_type:
-                delivery_type = plan.find("planDeliveryType")
-                if delivery_type is not None:
-                    print("Delivery Type:", delivery_type.text)
-                else:
-                    print("Delivery Type: Not Available")
-
-                # Filter by plan_type
-                if delivery_type is None or delivery_type.text != plan_type:
-                    continue
-
-            # Additional Debug: Check for plan type node
-            plan_type_node = plan.find("typeOfPlan")
-            if plan_type_node is not None:
-                print("Plan Type Node:", plan_type_node.text)
-            else:
-                print("Plan Type Node: Not Available")
-
-            # Filter for patient plans if necessary
-            if plan_type_node is None or plan_type_node.text != "PATIENT":
-                continue
-
-            # Re-confirm db_uid and plan_label for valid plans
-            db_uid = plan.find("dbInfo/databaseUID")
-            plan_label = plan.find("planLabel")
-
-            if db_uid is None or not db_uid.text:
-                print(f"Skipping plan: Missing UID for Plan Label '{plan_label.text if plan_label else 'UNK'}'")
-                continue
-            print ("- -" *50)
-            # Append plans with approval status
-            plans.append((
-                db_uid.text,  # Plan UID
-                plan_label.text if plan_label is not None else "UNK",  # Plan Label
-                approved_status  # Approved status (True/False)
-            ))
+        plans = [
+            (record.uid, record.label if record.label is not None else "UNK", record.approved)
+            for record in self.catalog().patient().delivery_type(plan_type)
+        ]
 
         print(f"Found {len(plans)} plans." if plans else "No plans found.")
         return plans
@@ -116,29 +261,10 @@ class PlanFinder:
         """
         print(f"Searching for approved plans in {self.file_name}...")
 
-        plans = []
-        for plan in self.root.findall(".//fullPlanDataArray/fullPlanDataArray/plan/briefPlan"):
-
-            approved_uid = plan.find("approvedPlanTrialUID")
-            if approved_uid is None or approved_uid.text in ["", "* * * DO NOT CHANGE THIS STRING VALUE * * *"]:
-                continue
-
-            if plan_type:
-                delivery_type = plan.find("planDeliveryType")
-                if delivery_type is None or delivery_type.text != plan_type:
-                    continue
-
-            plan_type_node = plan.find("typeOfPlan")
-            if plan_type_node is None or plan_type_node.text != "PATIENT":
-                continue
-
-            db_uid = plan.find("dbInfo/databaseUID")
-            plan_label = plan.find("planLabel")
-
-            if db_uid is None or not db_uid.text:
-                continue
-
-            plans.append((db_uid.text, plan_label.text if plan_label is not None else "UNK"))
+        plans = [
+            (record.uid, record.label if record.label is not None else "UNK")
+            for record in self.catalog().patient().approved().delivery_type(plan_type)
+        ]
 
         print(f"Found {len(plans)} approved plans." if plans else "No approved plans found.")
         return plans
@@ -171,13 +297,7 @@ class PlanFinder:
         """
         print("Searching for approved legacy plans...")
 
-        approved_plans = []
-        for plan in self.root.findall(".//legacyPlan"):
-            approval_status = plan.findtext("approvalStatus")
-            if approval_status and approval_status.lower() == "approved":
-                plan_uid = plan.findtext("dbInfo/databaseUID")
-                if plan_uid:
-                    approved_plans.append(plan_uid)
+        approved_plans = [record.uid for record in self.catalog().legacy().approved()]
 
         if not approved_plans:
             raise ValueError("No approved plans found in the legacy archive.")
@@ -3,9 +3,51 @@ import numpy as np
 from lxml import etree
 import logging
 import matplotlib.pyplot as plt
+from patient_archive import PatientArchive, full_plan_node, read_array_header
+
+# Precompiled queries; plan and image queries are relative to the matched node
+_BRIEF_PATIENT = etree.XPath("//FullPatient/patient/briefPatient")
+_PATIENT_NAME = etree.XPath("patientName/text()")
+_PATIENT_ID = etree.XPath("patientID/text()")
+_PATIENT_BIRTH_DATE = etree.XPath("patientBirthDate/text()")
+_PATIENT_GENDER = etree.XPath("patientGender/text()")
+_WINDOW_CENTER = etree.XPath("//WindowCenter/text()")
+_WINDOW_WIDTH = etree.XPath("//WindowWidth/text()")
+_PLAN_IVDT = etree.XPath("plan/fullDoseIVDT/text()")
+_PLAN_POSITION = etree.XPath("plan/patientPosition/text()")
+_PLAN_STRUCTURE_SET_UID = etree.XPath("plan/planStructureSetUID/text()")
+_ISOCENTER = etree.XPath(".//referenceImageIsocenter")
+_COUCH_CHECKSUM = etree.XPath(".//couchChecksum/text()")
+_COUCH_INSERTION_POSITION = etree.XPath(".//couchInsertionPosition/text()")
+_PLAN_IMAGES = etree.XPath("fullImageDataArray/fullImageDataArray/image")
+_IMAGE_TYPE = etree.XPath("imageType/text()")
+_IMAGE_UID = etree.XPath("dbInfo/databaseUID/text()")
+_ARRAY_HEADER = etree.XPath("arrayHeader")
+_RESCALE_SLOPE = etree.XPath(".//RescaleSlope/text()")
+_RESCALE_INTERCEPT = etree.XPath(".//RescaleIntercept/text()")
+_DOCUMENT_RESCALE_SLOPE = etree.XPath("//RescaleSlope/text()")
+_DOCUMENT_RESCALE_INTERCEPT = etree.XPath("//RescaleIntercept/text()")
+
+
+def _first_text(query, node):
+    """
+    Evaluate a compiled text() query and return the first result.
+
+    Args:
+        query (etree.XPath): Compiled query.
+        node: Element or tree to evaluate against (None yields None).
+
+    Returns:
+        str: First matching text or None.
+    """
+    if node is None:
+        return None
+    result = query(node)
+    return str(result[0]) if result else None
+
 
 class LoadImage:
-    def __init__(self, xml_path, xml_name, plan_uid):
+    def __init__(self, xml_path, xml_name, plan_uid, archive=None, memmap=False):
         """
         Initialize the LoadImage class.
 
@@ -13,131 +55,137 @@ class LoadImage:
             xml_path (str): Path to the directory containing the XML file.
             xml_name (str): Name of the XML file.
             plan_uid (str): UID of the plan to extract the reference image.
+            archive (PatientArchive, optional): Shared parsed archive to read from.
+            memmap (bool): Keep the volume as a read-only np.memmap of the raw uint16 file
+                           instead of loading a rescaled float32 copy. Use hu_slice/hu_slab
+                           to get HU values.
         """
         self.xml_path = xml_path
         self.xml_name = xml_name
         self.plan_uid = plan_uid
+        self.archive = PatientArchive.resolve(archive, xml_path, xml_name)
+        self.memmap = memmap
         self.image = {
             "classUID": "1.2.840.10008.5.1.4.1.1.2",  # Standard UID
         }
 
-    def extract_text(self, tree, xpath_query):
+    def parse_xml(self):
         """
-        Extract text from the first node that matches the XPath query.
-
-        Args:
-            tree (etree.ElementTree): Parsed XML tree.
-            xpath_query (str): XPath query string.
+        Parse the XML file and extract image-related information.
 
         Returns:
-            str: Extracted text or None if no match is found.
+            dict: A dictionary containing the image data and metadata.
         """
-        nodes = tree.xpath(xpath_query)
-        return nodes[0].text if nodes else None
+        metadata = self.archive.cached(f"image:{self.plan_uid}", self._extract_metadata)
+        self.image.update(metadata)
+        if "filename" in metadata:
+            self.image["filename"] = os.path.join(self.xml_path, metadata["filename"])
 
-    def parse_xml(self):
+        # Ensure the binary file exists
+        if "filename" not in self.image or not os.path.exists(self.image["filename"]):
+            raise FileNotFoundError(f"Binary file for plan UID {self.plan_uid} not found.")
+
+    def _extract_metadata(self):
         """
-        Parse the XML file and extract image-related information.
+        Extract the image metadata for the plan from the archive XML.
+
+        Patient and display fields are read once from the document; everything else is
+        evaluated with precompiled queries relative to the matched plan node.
 
         Returns:
-            dict: A dictionary containing the image data and metadata.
+            dict: Image metadata; "filename" is relative to xml_path.
         """
-        xml_file = os.path.join(self.xml_path, self.xml_name)
-        if not os.path.exists(xml_file):
-            raise FileNotFoundError(f"XML file {xml_file} does not exist.")
-
-        tree = etree.parse(xml_file)
+        tree = self.archive.tree
+        image = {}
 
         # Extract patient demographics
-        self.image["patientName"] = self.extract_text(tree, "//FullPatient/patient/briefPatient/patientName")
-        self.image["patientID"] = self.extract_text(tree, "//FullPatient/patient/briefPatient/patientID")
-        self.image["patientBirthDate"] = self.extract_text(tree, "//FullPatient/patient/briefPatient/patientBirthDate")
-        self.image["patientSex"] = self.extract_text(tree, "//FullPatient/patient/briefPatient/patientGender")
+        brief_patient = _BRIEF_PATIENT(tree)
+        brief_patient = brief_patient[0] if brief_patient else None
+        image["patientName"] = _first_text(_PATIENT_NAME, brief_patient)
+        image["patientID"] = _first_text(_PATIENT_ID, brief_patient)
+        image["patientBirthDate"] = _first_text(_PATIENT_BIRTH_DATE, brief_patient)
+        image["patientSex"] = _first_text(_PATIENT_GENDER, brief_patient)
 
         # Extract WL and WW from XML if present
-        self.image["window_center"] = float(self.extract_text(tree, "//WindowCenter") or 0)
-        self.image["window_width"] = float(self.extract_text(tree, "//WindowWidth") or 1000)
+        image["window_center"] = float(_first_text(_WINDOW_CENTER, tree) or 0)
+        image["window_width"] = float(_first_text(_WINDOW_WIDTH, tree) or 1000)
 
         # Find the plan matching the given plan UID
-        plan_nodes = tree.xpath("//fullPlanDataArray/fullPlanDataArray")
-        for plan_node in plan_nodes:
-            plan_uid_node = plan_node.xpath("plan/briefPlan/dbInfo/databaseUID")
-            if not plan_uid_node or plan_uid_node[0].text != self.plan_uid:
+        plan_node = None
+        for brief_plan in self.archive.find_by_uid(self.plan_uid, tag="briefPlan"):
+            plan_node = full_plan_node(brief_plan)
+            if plan_node is not None:
+                break
+        if plan_node is None:
+            return image
+
+        # Extract IVDT, patient position and structure set UID
+        image["fullDoseIVDT"] = _first_text(_PLAN_IVDT, plan_node)
+        image["position"] = _first_text(_PLAN_POSITION, plan_node) or "Unknown"
+        image["structureSetUID"] = _first_text(_PLAN_STRUCTURE_SET_UID, plan_node)
+
+        # Extract isocenter coordinates of this plan
+        isocenter = _ISOCENTER(plan_node)
+        isocenter = {axis.tag: axis.text for axis in isocenter[0]} if isocenter else {}
+        image["isocenter"] = [
+            float(isocenter.get("x") or 0),
+            float(isocenter.get("y") or 0),
+            float(isocenter.get("z") or 0),
+        ]
+
+        # Extract couch information
+        image["couchChecksum"] = _first_text(_COUCH_CHECKSUM, plan_node)
+        image["couchInsertionPosition"] = _first_text(_COUCH_INSERTION_POSITION, plan_node)
+
+        # Extract image data
+        for image_node in _PLAN_IMAGES(plan_node):
+            if _first_text(_IMAGE_TYPE, image_node) not in ["KVCT", "Registered_MVCT"]:
                 continue
 
-            # Extract IVDT
-            ivdt_node = plan_node.xpath("plan/fullDoseIVDT")
-            self.image["fullDoseIVDT"] = ivdt_node[0].text if ivdt_node else None
-
-            # Extract patient position
-            position_node = plan_node.xpath("plan/patientPosition")
-            self.image["position"] = position_node[0].text if position_node else "Unknown"
-
-            # Extract structure set UID
-            structure_set_uid_node = plan_node.xpath("plan/planStructureSetUID")
-            self.image["structureSetUID"] = structure_set_uid_node[0].text if structure_set_uid_node else None
-
-            # Extract isocenter coordinates
-            self.image["isocenter"] = [
-                float(self.extract_text(tree, "//referenceImageIsocenter/x") or 0),
-                float(self.extract_text(tree, "//referenceImageIsocenter/y") or 0),
-                float(self.extract_text(tree, "//referenceImageIsocenter/z") or 0),
-            ]
-
-            # Extract couch information
-            self.image["couchChecksum"] = self.extract_text(tree, "//couchChecksum")
-            self.image["couchInsertionPosition"] = self.extract_text(tree, "//couchInsertionPosition")
-
-            # Extract image data
-            image_nodes = plan_node.xpath("fullImageDataArray/fullImageDataArray/image")
-            for image_node in image_nodes:
-                image_type_node = image_node.xpath("imageType")
-                if not image_type_node or image_type_node[0].text not in ["KVCT", "Registered_MVCT"]:
-                    continue
-
-                # Extract filename
-                filename_node = image_node.xpath("arrayHeader/binaryFileName")
-                if filename_node:
-                    self.image["filename"] = os.path.join(self.xml_path, filename_node[0].text)
-
-                # Extract dimensions
-                self.image["dimensions"] = [
-                    int(image_node.xpath("arrayHeader/dimensions/x")[0].text),
-                    int(image_node.xpath("arrayHeader/dimensions/y")[0].text),
-                    int(image_node.xpath("arrayHeader/dimensions/z")[0].text),
-                ]
-
-                # Extract start coordinates
-                self.image["start"] = [
-                    float(image_node.xpath("arrayHeader/start/x")[0].text),
-                    float(image_node.xpath("arrayHeader/start/y")[0].text),
-                    float(image_node.xpath("arrayHeader/start/z")[0].text),
-                ]
-
-                # Extract voxel widths
-                self.image["width"] = [
-                    float(image_node.xpath("arrayHeader/elementSize/x")[0].text),
-                    float(image_node.xpath("arrayHeader/elementSize/y")[0].text),
-                    float(image_node.xpath("arrayHeader/elementSize/z")[0].text),
-                ]
-
-                # Extract scaling factors
-                self.image["rescale_slope"] = float(self.extract_text(tree, "//RescaleSlope") or 1)
-                self.image["rescale_intercept"] = float(self.extract_text(tree, "//RescaleIntercept") or -1024)
+            image["databaseUID"] = _first_text(_IMAGE_UID, image_node)
 
-                break
+            # Extract filename, dimensions, start coordinates and voxel widths
+            header = _ARRAY_HEADER(image_node)
+            if header:
+                image.update(read_array_header(header[0]))
 
-        # Ensure the binary file exists
-        if "filename" not in self.image or not os.path.exists(self.image["filename"]):
-            raise FileNotFoundError(f"Binary file for plan UID {self.plan_uid} not found.")
+            # Extract scaling factors, from the image first, then the plan and then anywhere
+            # in the document
+            image["rescale_slope"] = float(
+                _first_text(_RESCALE_SLOPE, image_node)
+                or _first_text(_RESCALE_SLOPE, plan_node)
+                or _first_text(_DOCUMENT_RESCALE_SLOPE, tree)
+                or 1
+            )
+            image["rescale_intercept"] = float(
+                _first_text(_RESCALE_INTERCEPT, image_node)
+                or _first_text(_RESCALE_INTERCEPT, plan_node)
+                or _first_text(_DOCUMENT_RESCALE_INTERCEPT, tree)
+                or -1024
+            )
+
+            break
+
+        return image
 
     def load_binary_data(self):
         """
         Load binary image data from the file.
 
+        In memmap mode "data" is the raw uint16 volume mapped from disk and
+        "data_is_raw" is True; rescale_slope/rescale_intercept are left as metadata.
+
         Returns:
             dict: A dictionary containing image data and metadata.
         """
+        if self.memmap:
+            self.image["data"] = np.memmap(
+                self.image["filename"], dtype=np.uint16, mode="r",
+                shape=tuple(self.image["dimensions"]), order='F'
+            )
+            self.image["data_is_raw"] = True
+            return self.image
+
         with open(self.image["filename"], "rb") as f:
             image_data = np.fromfile(f, dtype=np.uint16)
             # print("First 100 raw values:", image_data[:100])
@@ -161,6 +209,43 @@ class LoadImage:
         self.parse_xml()
         return self.load_binary_data()
 
+def hu_slab(image_data, start, stop):
+    """
+    Return axial slices [start, stop) of the image in HU.
+
+    For a memmapped raw volume only the requested slab is read and rescaled; an
+    already rescaled volume is returned as a view.
+
+    Args:
+        image_data (dict): The loaded image data and metadata.
+        start (int): First slice index.
+        stop (int): Slice index after the last slice.
+
+    Returns:
+        np.ndarray: Array of shape (x, y, stop - start).
+    """
+    slab = image_data["data"][:, :, start:stop]
+    if not image_data.get("data_is_raw"):
+        return slab
+    rescale_slope = image_data.get("rescale_slope", 1)
+    rescale_intercept = image_data.get("rescale_intercept", -1024)
+    return slab.astype(np.float32) * np.float32(rescale_slope) + np.float32(rescale_intercept)
+
+
+def hu_slice(image_data, slice_index):
+    """
+    Return one axial slice of the image in HU.
+
+    Args:
+        image_data (dict): The loaded image data and metadata.
+        slice_index (int): The index of the slice.
+
+    Returns:
+        np.ndarray: Array of shape (x, y).
+    """
+    return hu_slab(image_data, slice_index, slice_index + 1)[:, :, 0]
+
+
 def plot_image_slice(image_data, slice_index=0, orientation='axial'):
     """
     Plot a specific slice of the image data.
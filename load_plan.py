@@ -1,13 +1,33 @@
 import os
-import xml.etree.ElementTree as ET
 import numpy as np
+from patient_archive import PatientArchive
+
+# Number of MLC leaves per sinogram projection
+NUM_LEAVES = 64
+
+
+def _read_into(f, array):
+    # Fill a contiguous array from a binary file, tolerating short reads
+    buffer = memoryview(array).cast('B')
+    offset = 0
+    while offset < len(buffer):
+        count = f.readinto(buffer[offset:])
+        if not count:
+            raise EOFError(f"Unexpected end of file after {offset} bytes")
+        offset += count
+
 
 class PlanLoader:
-    def __init__(self, xml_path, xml_name, plan_uid):
+    def __init__(self, xml_path, xml_name, plan_uid, archive=None, memmap=False):
         self.xml_path = xml_path
         self.xml_name = xml_name
         self.plan_uid = plan_uid
+        self.archive = PatientArchive.resolve(archive, xml_path, xml_name)
+        # Map single-file sinograms read-only instead of reading them into RAM
+        self.memmap = memmap
         self.plan_data = {}
+        # Sinogram binaries per delivery plan kind, for iter_projections
+        self.sinogram_files = {'fluence': [], 'machine_agnostic': []}
 
     def parse_patient_demographics(self, root):
         # Extract patient information
@@ -20,67 +40,124 @@ class PlanLoader:
 
     def validate_plan_uid(self, root):
         # Validate the plan UID and fetch plan details
-        plans = root.findall(".//fullPlanDataArray/fullPlanDataArray/plan/briefPlan")
-        for plan in plans:
-            uid = plan.findtext("dbInfo/databaseUID")
-            if uid == self.plan_uid:
+        for plan in self.archive.find_by_uid(self.plan_uid, tag="briefPlan"):
+            if plan.getparent().tag == "plan":
                 self.plan_data['plan_label'] = plan.findtext('planLabel', default="Unknown")
                 self.plan_data['plan_date'] = plan.findtext('modificationTimestamp/date', default="Unknown")
                 self.plan_data['plan_time'] = plan.findtext('modificationTimestamp/time', default="Unknown")
                 return True
         return False
 
-    def load_fluence_delivery_plan(self, root):
-        # Load fluence delivery plan binary file paths and extract sinogram
-        delivery_plans = root.findall(".//fullDeliveryPlanDataArray/fullDeliveryPlanDataArray")
-        sinogram = []
+    def find_fluence_files(self, root):
+        # Find the binary file names of the fluence delivery plan
+        fluence_uid = self.plan_data.get('fluence_uid')
+        if not fluence_uid:
+            return []
 
-        for plan in delivery_plans:
-            uid = plan.findtext("deliveryPlan/dbInfo/databaseUID")
-            if uid == self.plan_data.get('fluence_uid'):
-                file_elements = plan.findall("binaryFileNameArray/binaryFileNameArray")
-                for file_element in file_elements:
-                    filename = file_element.text
-                    file_path = os.path.join(self.xml_path, filename)
-                    if os.path.exists(file_path):
-                        sinogram.append(self.extract_sinogram(file_path))
-                break
-
-        if sinogram:
-            self.plan_data['fluence_sinogram'] = np.hstack(sinogram)
+        for delivery_plan in self.archive.find_by_uid(fluence_uid, tag="deliveryPlan"):
+            plan = delivery_plan.getparent()
+            return [element.text for element in plan.findall("binaryFileNameArray/binaryFileNameArray")]
+        return []
+
+    def load_fluence_delivery_plan(self, root=None, filenames=None):
+        # Load fluence delivery plan binary file paths and extract sinogram
+        if filenames is None:
+            filenames = self.find_fluence_files(root)
+        self.sinogram_files['fluence'] = self.existing_sinogram_files(filenames)
+        sinogram = self.read_sinogram(self.sinogram_files['fluence'])
+
+        if sinogram is not None:
+            self.plan_data['fluence_sinogram'] = sinogram
+
+    def existing_sinogram_files(self, filenames):
+        # Full paths of the sinogram binaries listed in filenames that exist on disk
+        file_paths = [os.path.join(self.xml_path, filename) for filename in filenames]
+        return [file_path for file_path in file_paths if os.path.exists(file_path)]
+
+    def sinogram_rows(self, file_path):
+        # Number of projections in a sinogram file, from its size
+        size = os.path.getsize(file_path) // 8
+        if size % NUM_LEAVES != 0:
+            print(f"Warning: Data size {size} is not divisible by {NUM_LEAVES}. Trimming excess.")
+        return size // NUM_LEAVES
+
+    def projection_count(self, file_paths):
+        # Common number of projections of sinogram files read side by side
+        rows = [self.sinogram_rows(file_path) for file_path in file_paths]
+        if len(set(rows)) != 1:
+            raise ValueError(f"Sinogram files have different projection counts: {rows}")
+        return rows[0]
+
+    def read_sinogram(self, file_paths):
+        # Read sinogram files side by side (like np.hstack) into one preallocated array
+        if not file_paths:
+            return None
+
+        num_rows = self.projection_count(file_paths)
+        try:
+            if self.memmap and len(file_paths) == 1:
+                return np.memmap(file_paths[0], dtype=np.float64, mode='r', shape=(num_rows, NUM_LEAVES))
+
+            sinogram = np.empty((num_rows, NUM_LEAVES * len(file_paths)), dtype=np.float64)
+            if len(file_paths) == 1:
+                # Read straight into the output
+                with open(file_paths[0], 'rb') as f:
+                    _read_into(f, sinogram)
+                return sinogram
+
+            # Several files: stream each one through a single scratch buffer
+            scratch = np.empty((num_rows, NUM_LEAVES), dtype=np.float64)
+            for i, file_path in enumerate(file_paths):
+                with open(file_path, 'rb') as f:
+                    _read_into(f, scratch)
+                sinogram[:, i * NUM_LEAVES:(i + 1) * NUM_LEAVES] = scratch
+            return sinogram
+        except (OSError, EOFError) as e:
+            print(f"Error reading sinogram files {file_paths}: {e}")
+            return None
 
     def extract_sinogram(self, file_path):
         # Extract binary data from a sinogram file
-        try:
-            with open(file_path, 'rb') as f:
-                data = np.fromfile(f, dtype=np.float64)
-                if data.size % 64 != 0:
-                    print(f"Warning: Data size {data.size} is not divisible by 64. Trimming excess.")
-                num_rows = data.size // 64
-                data = data[:num_rows * 64]  # Trim excess elements
-                return data.reshape(num_rows, 64)
-        except Exception as e:
-            print(f"Error reading sinogram file {file_path}: {e}")
-            return np.array([])
-
-    def load_machine_agnostic_plan(self, root):
-        # Load machine-agnostic delivery plan
+        sinogram = self.read_sinogram([file_path])
+        return sinogram if sinogram is not None else np.array([])
+
+    def iter_projections(self, kind='machine_agnostic', chunk_size=1024):
+        # Yield (first projection index, block of projections x leaves) without loading the sinogram
+        file_paths = self.sinogram_files[kind]
+        if not file_paths:
+            return
+
+        num_rows = self.projection_count(file_paths)
+        maps = [
+            np.memmap(file_path, dtype=np.float64, mode='r', shape=(num_rows, NUM_LEAVES))
+            for file_path in file_paths
+        ]
+        for start in range(0, num_rows, chunk_size):
+            stop = min(start + chunk_size, num_rows)
+            if len(maps) == 1:
+                yield start, np.asarray(maps[0][start:stop])
+            else:
+                yield start, np.hstack([m[start:stop] for m in maps])
+
+    def find_machine_agnostic_files(self, root):
+        # Find the binary file names of the machine-agnostic delivery plan
         delivery_plans = root.findall(".//fullDeliveryPlanDataArray/fullDeliveryPlanDataArray")
-        agnostic_sinogram = []
 
         for plan in delivery_plans:
             purpose = plan.findtext("deliveryPlan/purpose")
             if purpose == "Machine_Agnostic":
-                file_elements = plan.findall("binaryFileNameArray/binaryFileNameArray")
-                for file_element in file_elements:
-                    filename = file_element.text
-                    file_path = os.path.join(self.xml_path, filename)
-                    if os.path.exists(file_path):
-                        agnostic_sinogram.append(self.extract_sinogram(file_path))
-                break
+                return [element.text for element in plan.findall("binaryFileNameArray/binaryFileNameArray")]
+        return []
+
+    def load_machine_agnostic_plan(self, root=None, filenames=None):
+        # Load machine-agnostic delivery plan
+        if filenames is None:
+            filenames = self.find_machine_agnostic_files(root)
+        self.sinogram_files['machine_agnostic'] = self.existing_sinogram_files(filenames)
+        agnostic_sinogram = self.read_sinogram(self.sinogram_files['machine_agnostic'])
 
-        if agnostic_sinogram:
-            self.plan_data['machine_agnostic_sinogram'] = np.hstack(agnostic_sinogram)
+        if agnostic_sinogram is not None:
+            self.plan_data['machine_agnostic_sinogram'] = agnostic_sinogram
 
     def consistency_check(self):
         # Ensure fluence and machine-agnostic sinograms are compatible
@@ -91,27 +168,39 @@ class PlanLoader:
             if fluence_sinogram.shape != agnostic_sinogram.shape:
                 print("Warning: Sinogram shapes do not match.")
 
-    def load_plan(self):
-        # Load XML and parse plan details
-        xml_file = os.path.join(self.xml_path, self.xml_name)
-        if not os.path.exists(xml_file):
-            raise FileNotFoundError(f"XML file not found: {xml_file}")
+    def cached_metadata(self):
+        # extract_metadata through the archive's metadata cache
+        return self.archive.cached(f"plan:{self.plan_uid}", self.extract_metadata)
 
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+    def extract_metadata(self):
+        # Collect everything load_plan needs from the XML, without reading binaries
+        root = self.archive.root
 
         # Step 1: Parse patient demographics
         self.parse_patient_demographics(root)
 
+        found = self.validate_plan_uid(root)
+        return {
+            'plan_data': dict(self.plan_data),
+            'found': found,
+            'fluence_files': self.find_fluence_files(root) if found else [],
+            'machine_agnostic_files': self.find_machine_agnostic_files(root) if found else [],
+        }
+
+    def load_plan(self):
+        # Parse plan details from the shared archive (or its metadata cache)
+        metadata = self.cached_metadata()
+        self.plan_data.update(metadata['plan_data'])
+
         # Step 2: Validate plan UID
-        if not self.validate_plan_uid(root):
+        if not metadata['found']:
             raise ValueError(f"Plan UID {self.plan_uid} not found in {self.xml_name}")
 
         # Step 3: Load fluence delivery plan
-        self.load_fluence_delivery_plan(root)
+        self.load_fluence_delivery_plan(filenames=metadata['fluence_files'])
 
         # Step 4: Load machine-agnostic plan
-        self.load_machine_agnostic_plan(root)
+        self.load_machine_agnostic_plan(filenames=metadata['machine_agnostic_files'])
 
         # Step 5: Perform consistency checks
         self.consistency_check()
@@ -1,12 +1,15 @@
 import os
-import xml.etree.ElementTree as ET
 import numpy as np
+from patient_archive import PatientArchive, read_array_header
 
 class LoadPlanDose:
-    def __init__(self, xml_path, xml_name, plan_uid):
+    def __init__(self, xml_path, xml_name, plan_uid, archive=None, memmap=False):
         self.xml_path = xml_path
         self.xml_name = xml_name
         self.plan_uid = plan_uid
+        self.archive = PatientArchive.resolve(archive, xml_path, xml_name)
+        # Map the dose binary read-only instead of reading it into RAM
+        self.memmap = memmap
         self.dose = {}
 
     def load_dose(self):
@@ -20,75 +23,52 @@ class LoadPlanDose:
             FileNotFoundError: If the XML file is not found.
             ValueError: If no matching dose data is found.
         """
-        # Parse the main XML file
-        xml_file = os.path.join(self.xml_path, self.xml_name)
-        if not os.path.exists(xml_file):
-            raise FileNotFoundError(f"XML file not found: {xml_file}")
+        metadata = self.cached_metadata()
+        self.dose.update(metadata)
+        self.dose["filename"] = os.path.join(self.xml_path, metadata["filename"])
 
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        # Load dose data from the binary file
+        self._load_binary_data()
+        return self.dose
 
-        # Debugging: List all image types and their database parents
-        print("Listing all image types and their database parents:")
-        image_nodes = root.findall(".//fullImageDataArray/fullImageDataArray/image")
-        checked_image_types = []
-        checked_database_parents = []
+    def cached_metadata(self):
+        """
+        Dose metadata for the plan UID, through the archive's metadata cache.
 
-        for node in image_nodes:
-            image_type = node.findtext("imageType")
-            database_parent = node.findtext("dbInfo/databaseParent")
-            print(f"Image Type: {image_type}, Database Parent: {database_parent}")
+        Returns:
+            dict: Dose metadata (see extract_metadata).
+        """
+        return self.archive.cached(f"dose:{self.plan_uid}", self.extract_metadata)
 
-            # print(ET.tostring(node, encoding="unicode"))
+    def extract_metadata(self):
+        """
+        Find the dose volume for the plan UID and extract its metadata.
 
-            checked_image_types.append(image_type)
-            checked_database_parents.append(database_parent)
-            # print(f"Image Type: {image_type}, Database Parent: {database_parent}")
+        Returns:
+            dict: Dose metadata; "filename" is relative to xml_path.
 
-            if image_type == "Opt_Dose_After_EOP" and database_parent == self.plan_uid:
+        Raises:
+            ValueError: If no matching dose data is found.
+        """
+        # Dose images attached directly to the plan
+        for node in self.archive.find_children(self.plan_uid, tag="image"):
+            if node.findtext("imageType") == "Opt_Dose_After_EOP":
                 print(f"Matching dose found for plan UID: {self.plan_uid}")
-
-                # Extract dose metadata
-                self.dose["frameOfReference"] = node.findtext("frameOfReference")
-                self.dose["filename"] = os.path.join(
-                    self.xml_path, node.findtext("arrayHeader/binaryFileName"))
-                self.dose["dimensions"] = [
-                    int(node.findtext("arrayHeader/dimensions/x")),
-                    int(node.findtext("arrayHeader/dimensions/y")),
-                    int(node.findtext("arrayHeader/dimensions/z"))
-                ]
-                self.dose["start"] = [
-                    float(node.findtext("arrayHeader/start/x")),
-                    float(node.findtext("arrayHeader/start/y")),
-                    float(node.findtext("arrayHeader/start/z"))
-                ]
-                self.dose["width"] = [
-                    float(node.findtext("arrayHeader/elementSize/x")),
-                    float(node.findtext("arrayHeader/elementSize/y")),
-                    float(node.findtext("arrayHeader/elementSize/z"))
-                ]
-
-                # Load dose data from the binary file
-                self._load_binary_data()
-                return self.dose
+                return self._read_dose_metadata(node)
 
         # Fallback: Search for plan trials if no dose found
         print("Searching for plan trials...")
-        plan_trials = root.findall(".//patientPlanTrial")
-        print("Listing all plan trials and their parents:")
-        for trial in plan_trials:
+        for trial in self.archive.find_children(self.plan_uid, tag="patientPlanTrial"):
             trial_uid = trial.findtext("dbInfo/databaseUID")
-            parent_uid = trial.findtext("dbInfo/databaseParent")
-            print(f"Plan Trial UID: {trial_uid}, Parent UID: {parent_uid}")
-            # print(ET.tostring(trial, encoding="unicode"))
-
-            if parent_uid == self.plan_uid:
-                print(f"Plan trial found for parent UID: {parent_uid}")
-                self._search_trial_dose(root, trial_uid)
-                if self.dose:
-                    return self.dose
+            print(f"Plan trial found for parent UID: {self.plan_uid}")
+            metadata = self._search_trial_dose(trial_uid)
+            if metadata:
+                return metadata
 
         # Raise enhanced error if no dose found
+        image_nodes = self.archive.root.findall(".//fullImageDataArray/fullImageDataArray/image")
+        checked_image_types = [node.findtext("imageType") for node in image_nodes]
+        checked_database_parents = [node.findtext("dbInfo/databaseParent") for node in image_nodes]
         raise ValueError(
             f"No matching dose data found for plan UID {self.plan_uid}.\n"
             f"Checked Image Types: {checked_image_types}\n"
@@ -96,44 +76,37 @@ class LoadPlanDose:
             f"Expected Dose Type: 'Opt_Dose_After_EOP'."
         )
 
-    def _search_trial_dose(self, root, trial_uid):
+    def _search_trial_dose(self, trial_uid):
         """
         Search for dose data associated with a specific trial UID.
 
         Args:
-            root: XML root element.
             trial_uid: Trial UID to search for.
-        """
-        dose_volumes = root.findall(".//doseVolumeList/doseVolumeList")
-        for dose_volume in dose_volumes:
-            # print(ET.tostring(dose_volume, encoding="unicode"))
-            image_type = dose_volume.findtext("imageType")
-            database_parent = dose_volume.findtext("dbInfo/databaseParent")
 
-            if image_type == "Opt_Dose_After_EOP" and database_parent == trial_uid:
+        Returns:
+            dict: Dose metadata of the last matching dose volume, or None.
+        """
+        metadata = None
+        for dose_volume in self.archive.find_children(trial_uid, tag="doseVolumeList"):
+            if dose_volume.findtext("imageType") == "Opt_Dose_After_EOP":
                 print(f"Matching dose found for trial UID: {trial_uid}")
+                metadata = self._read_dose_metadata(dose_volume)
 
-                # Extract dose metadata
-                self.dose["frameOfReference"] = dose_volume.findtext("frameOfReference")
-                self.dose["filename"] = os.path.join(self.xml_path, dose_volume.findtext("arrayHeader/binaryFileName"))
-                self.dose["dimensions"] = [
-                    int(dose_volume.findtext("arrayHeader/dimensions/x")),
-                    int(dose_volume.findtext("arrayHeader/dimensions/y")),
-                    int(dose_volume.findtext("arrayHeader/dimensions/z"))
-                ]
-                self.dose["start"] = [
-                    float(dose_volume.findtext("arrayHeader/start/x")),
-                    float(dose_volume.findtext("arrayHeader/start/y")),
-                    float(dose_volume.findtext("arrayHeader/start/z"))
-                ]
-                self.dose["width"] = [
-                    float(dose_volume.findtext("arrayHeader/elementSize/x")),
-                    float(dose_volume.findtext("arrayHeader/elementSize/y")),
-                    float(dose_volume.findtext("arrayHeader/elementSize/z"))
-                ]
-
-                # Load dose data from the binary file
-                self._load_binary_data()
+        return metadata
+
+    def _read_dose_metadata(self, node):
+        """
+        Extract dose metadata from an image or doseVolumeList node.
+
+        Args:
+            node: XML element holding frameOfReference and arrayHeader.
+
+        Returns:
+            dict: Dose metadata; "filename" is relative to xml_path.
+        """
+        metadata = {"frameOfReference": node.findtext("frameOfReference")}
+        metadata.update(read_array_header(node.find("arrayHeader")))
+        return metadata
 
     def _load_binary_data(self):
         """
@@ -142,11 +115,67 @@ class LoadPlanDose:
         if not os.path.exists(self.dose["filename"]):
             raise FileNotFoundError(f"Dose binary file not found: {self.dose['filename']}")
 
+        if self.memmap:
+            self.dose["data"] = np.memmap(
+                self.dose["filename"], dtype=np.float32, mode="r", shape=tuple(self.dose["dimensions"])
+            )
+            return
+
         with open(self.dose["filename"], "rb") as f:
             binary_data = np.fromfile(f, dtype=np.float32)
             self.dose["data"] = binary_data.reshape(self.dose["dimensions"])
 
 
+def dose_grid(dose_data):
+    """
+    Return the dose volume indexed [x, y, z] along the patient axes.
+
+    dose["data"] keeps the file's bytes in order under a C-order (x, y, z) shape, which
+    is what write_dicom_dose serializes. The binary itself is stored x fastest, so the
+    physical grid is the same buffer reshaped in Fortran order. This is a view, so a
+    memmapped dose stays on disk.
+
+    Args:
+        dose_data (dict): Dose data and metadata from LoadPlanDose.load_dose.
+
+    Returns:
+        np.ndarray: View of shape (x, y, z).
+    """
+    return dose_data["data"].reshape(-1).reshape(tuple(dose_data["dimensions"]), order="F")
+
+
+def dose_slab(dose_data, start, stop):
+    """
+    Return dose frames [start, stop) along z.
+
+    Each frame is a contiguous block of the binary file, so for a memmapped dose only
+    the pages of the requested frames are read.
+
+    Args:
+        dose_data (dict): Dose data and metadata.
+        start (int): First frame index.
+        stop (int): Frame index after the last frame.
+
+    Returns:
+        np.ndarray: View of shape (x, y, stop - start).
+    """
+    return dose_grid(dose_data)[:, :, start:stop]
+
+
+def dose_frame(dose_data, frame_index):
+    """
+    Return a single dose frame along z.
+
+    Args:
+        dose_data (dict): Dose data and metadata.
+        frame_index (int): Frame index.
+
+    Returns:
+        np.ndarray: View of shape (x, y).
+    """
+    return dose_grid(dose_data)[:, :, frame_index]
+
+
 
 
 # if __name__ == "__main__":
@@ -1,17 +1,329 @@
 import os
-import xml.etree.ElementTree as ET
+from collections.abc import ItemsView, KeysView, ValuesView
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
 import numpy as np
+from patient_archive import PatientArchive
+from mask_store import CompactMask, fill_runs
 
-import os
-import xml.etree.ElementTree as ET
-import numpy as np
+# Separators in curve file pointData text ("x,y,z;" per line) mapped to whitespace
+_POINT_SEPARATORS = str.maketrans(",;", "  ")
+
+
+def parse_point_data(text):
+    """
+    Decode pointData text into an (N, 3) float array in one vectorized conversion.
+
+    Args:
+        text (str): pointData text, one "x,y,z;" point per line.
+
+    Returns:
+        np.ndarray: Points as an (N, 3) float64 array.
+
+    Raises:
+        ValueError: If the text holds anything but numbers, or a partial point.
+    """
+    # Stripped first: np.fromstring reads whitespace-only text as [-1]
+    coordinates = np.fromstring(text.translate(_POINT_SEPARATORS).strip(), sep=" ")
+    if coordinates.size % 3:
+        raise ValueError(f"pointData holds {coordinates.size} coordinates, not whole points")
+    return coordinates.reshape(-1, 3)
+
+
+def contour_spans(points_data, start, width, dimensions):
+    """
+    Scan-convert planar contours into filled pixel runs with the even-odd rule.
+
+    All contours are processed in one vectorized pass. Contours on the same slice are
+    combined, so nested contours become holes and islands. A pixel is inside when its
+    center is inside (boundary inclusive).
+
+    Args:
+        points_data (list): Contours, each an (N, 3) sequence of x, y, z points on one slice.
+        start (list): Grid origin (x, y, z) of the first voxel center.
+        width (list): Voxel size (x, y, z).
+        dimensions (list): Grid size (x, y, z).
+
+    Returns:
+        tuple: Arrays (slice_index, y_index, x_start, x_stop) of the filled runs;
+               x_stop is inclusive.
+    """
+    nx, ny, nz = (int(n) for n in dimensions)
+    empty = np.empty(0, dtype=np.int64)
+
+    # Edges of every contour in pixel coordinates, tagged with their slice
+    edge_x0, edge_y0, edge_x1, edge_y1, edge_slice = [], [], [], [], []
+    for points in points_data:
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if len(points) < 3:
+            continue
+        slice_index = int(np.round((points[0, 2] - start[2]) / width[2]))
+        if not 0 <= slice_index < nz:
+            continue
+        x = (points[:, 0] - start[0]) / width[0]
+        y = (points[:, 1] - start[1]) / width[1]
+        edge_x0.append(x)
+        edge_y0.append(y)
+        edge_x1.append(np.roll(x, -1))
+        edge_y1.append(np.roll(y, -1))
+        edge_slice.append(np.full(len(x), slice_index, dtype=np.int64))
+    if not edge_x0:
+        return empty, empty, empty, empty
+
+    x0, y0 = np.concatenate(edge_x0), np.concatenate(edge_y0)
+    x1, y1 = np.concatenate(edge_x1), np.concatenate(edge_y1)
+    edge_slice = np.concatenate(edge_slice)
+
+    # Rows crossed by each non-horizontal edge: ymin <= row < ymax (half-open)
+    keep = y0 != y1
+    x0, y0, x1, y1, edge_slice = x0[keep], y0[keep], x1[keep], y1[keep], edge_slice[keep]
+    row_lo = np.maximum(np.ceil(np.minimum(y0, y1)), 0).astype(np.int64)
+    row_hi = np.minimum(np.ceil(np.maximum(y0, y1)) - 1, ny - 1).astype(np.int64)
+    counts = np.maximum(row_hi - row_lo + 1, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty, empty, empty
+
+    # One crossing per (edge, row)
+    edge_index = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    rows = row_lo[edge_index] + (np.arange(total) - offsets[edge_index])
+    crossing_x = x0[edge_index] + (rows - y0[edge_index]) * (
+        (x1 - x0)[edge_index] / (y1 - y0)[edge_index]
+    )
+    slices = edge_slice[edge_index]
+
+    # Sort crossings along each (slice, row) scanline and pair them up
+    order = np.lexsort((crossing_x, rows, slices))
+    crossing_x, rows, slices = crossing_x[order], rows[order], slices[order]
+    line_start = np.ones(total, dtype=bool)
+    line_start[1:] = (rows[1:] != rows[:-1]) | (slices[1:] != slices[:-1])
+    line_first = np.maximum.accumulate(np.where(line_start, np.arange(total), 0))
+    rank = np.arange(total) - line_first
+    left = np.flatnonzero((rank % 2 == 0) & (np.arange(total) + 1 < total))
+    left = left[~line_start[left + 1]]
+
+    x_start = np.maximum(np.ceil(crossing_x[left]), 0).astype(np.int64)
+    x_stop = np.minimum(np.floor(crossing_x[left + 1]), nx - 1).astype(np.int64)
+    filled = x_start <= x_stop
+    return slices[left][filled], rows[left][filled], x_start[filled], x_stop[filled]
+
+
+def spans_to_mask(spans, dimensions):
+    """
+    Paint filled runs from contour_spans into a dense mask.
+
+    Args:
+        spans (tuple): (slice_index, y_index, x_start, x_stop) arrays.
+        dimensions (list): Grid size (x, y, z).
+
+    Returns:
+        np.ndarray: Boolean mask of shape (x, y, z).
+    """
+    nx, ny, nz = (int(n) for n in dimensions)
+    mask = np.zeros((nx, ny, nz), dtype=bool)
+    slices, rows, x_start, x_stop = spans
+    if len(slices) == 0:
+        return mask
+
+    # Paint only the scanlines that have runs
+    line_keys, line_index = np.unique(slices * ny + rows, return_inverse=True)
+    lines = fill_runs(line_index, x_start, x_stop, len(line_keys), nx)
+
+    mask[:, line_keys % ny, line_keys // ny] = lines.T
+    return mask
+
+
+def contour_volume(points_data, slice_thickness):
+    """
+    Compute a structure volume directly from its contours, without a mask.
+
+    Each contour contributes its shoelace area times the slice thickness. Contours on the
+    same slice follow the even-odd rule used by contour_spans: a contour inside an odd
+    number of other contours is a hole and is subtracted. Areas are computed for all
+    contours in one vectorized pass, so the cost depends on the number of points only,
+    not on the image resolution.
+
+    Args:
+        points_data (list): Contours, each an (N, 3) sequence of x, y, z points on one slice.
+        slice_thickness (float): Distance between contour slices, in the units of the
+                                 points (cm for archive contours).
+
+    Returns:
+        float: Volume in the cubed units of the points (cm^3 for archive contours).
+    """
+    contours = [np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in points_data]
+    contours = [points for points in contours if len(points) >= 3]
+    if not contours:
+        return 0.0
+
+    points = np.concatenate(contours)
+    lengths = np.array([len(c) for c in contours])
+    offsets = np.cumsum(lengths) - lengths
+    x, y = points[:, 0], points[:, 1]
+
+    # Next vertex of every point, wrapping around within its own contour
+    next_index = np.arange(len(points)) + 1
+    next_index[offsets + lengths - 1] = offsets
+    x_next, y_next = x[next_index], y[next_index]
+
+    # Shoelace area of every contour
+    areas = 0.5 * np.abs(np.add.reduceat(x * y_next - x_next * y, offsets))
+
+    # Nesting depth of every contour among the contours of its slice
+    slice_keys = np.round(points[offsets, 2], 3)
+    signs = np.ones(len(contours))
+    for key in np.unique(slice_keys):
+        members = np.flatnonzero(slice_keys == key)
+        if len(members) < 2:
+            continue
+        edges = np.concatenate([np.arange(offsets[m], offsets[m] + lengths[m]) for m in members])
+        edge_owner = np.repeat(np.arange(len(members)), lengths[members])
+
+        # Crossing-number test of each contour's first vertex against every edge of the slice
+        px, py = x[offsets[members]][:, None], y[offsets[members]][:, None]
+        ex0, ey0, ex1, ey1 = x[edges], y[edges], x_next[edges], y_next[edges]
+        straddles = (ey0 > py) != (ey1 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = ex0 + (py - ey0) * (ex1 - ex0) / (ey1 - ey0)
+        crossings = straddles & (px < crossing_x)
+
+        counts = np.zeros((len(members), len(members)), dtype=np.int64)
+        np.add.at(counts, (slice(None), edge_owner), crossings)
+        inside = counts % 2 == 1
+        np.fill_diagonal(inside, False)
+        signs[members] = np.where(inside.sum(axis=1) % 2 == 1, -1.0, 1.0)
+
+    return float(np.sum(signs * areas) * slice_thickness)
+
+
+def rasterize_contours(points_data, start, width, dimensions, compact=False):
+    """
+    Fill contours into a mask on the image grid (see contour_spans).
+
+    Args:
+        points_data (list): Contours, each an (N, 3) array of x, y, z points.
+        start (list): Center of the first voxel (x, y, z).
+        width (list): Voxel size (x, y, z).
+        dimensions (list): Grid size (x, y, z).
+        compact (bool): Return a CompactMask instead of a dense array.
+
+    Returns:
+        np.ndarray: 3D boolean mask, or a CompactMask when compact is set.
+    """
+    spans = contour_spans(points_data, start, width, dimensions)
+    if compact:
+        return CompactMask.from_spans(spans, dimensions)
+    return spans_to_mask(spans, dimensions)
+
+
+def mask_volume(mask, width):
+    """
+    Volume of the voxels set in a mask.
+
+    Args:
+        mask (np.ndarray or CompactMask): 3D mask.
+        width (list): Voxel size (x, y, z) in cm.
+
+    Returns:
+        float: Volume in cm^3.
+    """
+    voxel_volume = np.prod(width)
+    if isinstance(mask, CompactMask):
+        return mask.voxel_count() * voxel_volume
+    return np.sum(mask) * voxel_volume
+
+
+class LazyStructure(dict):
+    """
+    Structure dictionary whose "mask" and "volume" are computed on first access.
+
+    Exports that only need names, colors and contour points never rasterize the ROI.
+    The structure keeps its own copy of the image grid rather than the loader, so it does
+    not hold on to the archive tree or the CT volume. "mask" and "volume" are always
+    listed as keys; reading them through items() or values() computes them.
+    """
+
+    LAZY_KEYS = ("mask", "volume")
+
+    def __init__(self, data, start, width, dimensions, compact_masks=False, volume_method="mask"):
+        """
+        Initialize the LazyStructure.
+
+        Args:
+            data (dict): Structure metadata and points, without mask and volume.
+            start (list): Center of the first image voxel (x, y, z).
+            width (list): Image voxel size (x, y, z).
+            dimensions (list): Image grid size (x, y, z).
+            compact_masks (bool): Generate a CompactMask instead of a dense mask.
+            volume_method (str): "mask" or "contour" (see LoadStructures).
+        """
+        super().__init__(data)
+        self._grid = (tuple(start), tuple(width), tuple(dimensions))
+        self._compact_masks = compact_masks
+        self._volume_method = volume_method
+
+    def __missing__(self, key):
+        points = dict.get(self, "points")
+        start, width, dimensions = self._grid
+        if key == "mask":
+            value = rasterize_contours(points, start, width, dimensions, self._compact_masks) if points else None
+        elif key == "volume":
+            if not points:
+                value = 0.0
+            elif self._volume_method == "contour":
+                value = contour_volume(points, abs(width[2]))
+            else:
+                value = mask_volume(self["mask"], width)
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.LAZY_KEYS or dict.__contains__(self, key)
+
+    def __iter__(self):
+        yield from dict.__iter__(self)
+        for key in self.LAZY_KEYS:
+            if not dict.__contains__(self, key):
+                yield key
+
+    def __len__(self):
+        return dict.__len__(self) + sum(not dict.__contains__(self, key) for key in self.LAZY_KEYS)
+
+    def keys(self):
+        return KeysView(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def get(self, key, default=None):
+        if key in self.LAZY_KEYS:
+            return self[key]
+        return dict.get(self, key, default)
 
 
 class LoadStructures:
-    def __init__(self, xml_path, xml_name, image_data):
+    def __init__(self, xml_path, xml_name, image_data, archive=None, compact_masks=False, workers=4,
+                 lazy_masks=True, volume_method="mask"):
         self.xml_path = xml_path
         self.xml_name = xml_name
         self.image_data = image_data
+        self.archive = PatientArchive.resolve(archive, xml_path, xml_name)
+        # Store masks as CompactMask (bit-packed per-slice crops) instead of dense volumes
+        self.compact_masks = compact_masks
+        # Threads parsing ROI curve files concurrently
+        self.workers = workers
+        # Compute masks and volumes only when a caller accesses them
+        self.lazy_masks = lazy_masks
+        # "mask" counts mask voxels, "contour" integrates the contour areas (no mask needed)
+        if volume_method not in ("mask", "contour"):
+            raise ValueError(f"Unknown volume method: {volume_method}")
+        self.volume_method = volume_method
         self.structures = []
 
     def parse_curve_file(self, file_path):
@@ -22,57 +334,108 @@ class LoadStructures:
             file_path (str): Path to the curve XML file.
 
         Returns:
-            list: Extracted contour points or an empty list if parsing fails.
+            list: Extracted contours as (N, 3) point arrays, or an empty list if the file
+                  cannot be parsed.
         """
         try:
             # Parse the XML file
-            tree = ET.parse(file_path)
+            tree = etree.parse(file_path, etree.XMLParser(huge_tree=True))
             root = tree.getroot()
-
-            # Extract points from the XML structure
-            points_data = []
-            point_elements = root.findall(".//pointData")
-            for element in point_elements:
-                num_data_points = int(element.get("numDataPoints", 0))
-                if num_data_points > 0:
-                    # Parse points into a list of tuples (x, y, z)
-                    points_text = element.text.strip()
-                    points = [
-                        tuple(map(float, point.strip(";").split(",")))
-                        for point in points_text.split("\n") if point
-                    ]
-                    points_data.append(points)
-
-            return points_data
         except Exception as e:
             print(f"Error reading curve file {file_path}: {e}")
             return []
 
+        # Extract points from the XML structure; a malformed curve only drops that curve
+        points_data = []
+        for index, element in enumerate(root.iter("pointData")):
+            try:
+                num_data_points = int(element.get("numDataPoints", 0))
+                if num_data_points > 0 and element.text:
+                    points_data.append(parse_point_data(element.text))
+            except ValueError as e:
+                print(f"Warning: skipping curve {index} of {file_path}: {e}")
+
+        return points_data
+
     def load_structures(self):
         """
         Load structures and associated masks based on the given image data.
 
+        With lazy_masks (the default) the structures are LazyStructure dictionaries and
+        each mask is only rasterized when its "mask" or "volume" key is read.
+
         Returns:
             list: List of structures with metadata and masks.
         """
-        # Parse the main XML file
-        xml_file = os.path.join(self.xml_path, self.xml_name)
-        if not os.path.exists(xml_file):
-            raise FileNotFoundError(f"XML file not found: {xml_file}")
+        structures = []
+        for metadata in self.cached_metadata():
+            structure = dict(metadata, points=[])
+
+            # Locate the curve data file
+            if metadata["filename"]:
+                structure["filename"] = os.path.join(self.xml_path, metadata["filename"])
+            structures.append(structure)
+
+        # Parse the available curve files concurrently
+        curve_files = [
+            structure for structure in structures
+            if structure["filename"] and os.path.exists(structure["filename"])
+        ]
+        if self.workers and self.workers > 1 and len(curve_files) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                all_points = list(executor.map(self.parse_curve_file, [s["filename"] for s in curve_files]))
+        else:
+            all_points = [self.parse_curve_file(s["filename"]) for s in curve_files]
+        for structure, points in zip(curve_files, all_points):
+            structure["points"] = points
+
+        for structure in structures:
+            if self.lazy_masks:
+                # Mask and volume are generated on first access
+                self.structures.append(LazyStructure(
+                    structure, self.image_data["start"], self.image_data["width"],
+                    self.image_data["dimensions"], compact_masks=self.compact_masks,
+                    volume_method=self.volume_method,
+                ))
+                continue
+
+            # If points exist, generate a mask
+            structure.update(mask=None, volume=0.0)
+            if structure["points"]:
+                structure["mask"] = self.generate_mask(structure["points"])
+                structure["volume"] = self.structure_volume(structure)
+
+            self.structures.append(structure)
+
+        return self.structures
+
+    def cached_metadata(self):
+        """
+        ROI metadata of the structure set, through the archive's metadata cache.
 
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
+        Returns:
+            list: ROI metadata dictionaries (see extract_metadata).
+        """
+        structure_set_uid = self.image_data.get("structureSetUID")
+        return self.archive.cached(f"structures:{structure_set_uid}", self.extract_metadata)
+
+    def extract_metadata(self):
+        """
+        Extract the metadata of every ROI in the image's structure set.
 
-        # Find all troiList items
-        troi_lists = root.findall(".//troiList/troiList")
-        for troi in troi_lists:
-            # Verify structure set UID
-            parent_uid = troi.findtext("briefROI/dbInfo/databaseParent")
-            if parent_uid != self.image_data.get("structureSetUID"):
+        Returns:
+            list: ROI metadata dictionaries; "filename" is relative to xml_path.
+        """
+        rois = []
+        # Find the troiList items belonging to the structure set
+        structure_set_uid = self.image_data.get("structureSetUID")
+        for brief_roi in self.archive.find_children(structure_set_uid, tag="briefROI"):
+            troi = brief_roi.getparent()
+            if troi.tag != "troiList":
                 continue
 
             # Extract structure metadata
-            structure = {
+            rois.append({
                 "name": troi.findtext("briefROI/name", default="Unknown"),
                 "color": {
                     "red": int(troi.findtext("briefROI/color/red", default="0")),
@@ -81,76 +444,88 @@ class LoadStructures:
                 },
                 "isDensityOverridden": troi.findtext("briefROI/isDensityOverridden", default="False"),
                 "overriddenDensity": float(troi.findtext("briefROI/overriddenDensity", default="0.0")),
-                "filename": None,
-                "mask": None,
-                "volume": 0.0,
-                "points": [],
-            }
+                "filename": troi.findtext("curveDataFile") or None,
+            })
 
-            # Locate the curve data file
-            curve_file = troi.findtext("curveDataFile")
-            if curve_file:
-                structure["filename"] = os.path.join(self.xml_path, curve_file)
+        return rois
 
-            # Parse curve file if available
-            if structure["filename"] and os.path.exists(structure["filename"]):
-                structure["points"] = self.parse_curve_file(structure["filename"])
+    def generate_mask(self, points_data):
+        """
+        Generate a filled mask based on points data and the reference image dimensions.
 
-            # If points exist, generate a mask
-            if structure["points"]:
-                structure["mask"] = self.generate_mask(structure["points"])
-                structure["volume"] = self.calculate_volume(structure["mask"])
+        Contours are filled with an even-odd scanline rule, all at once; several contours
+        on one slice combine into holes and islands. Contours outside the image are skipped.
 
-            self.structures.append(structure)
+        Args:
+            points_data (list): List of contour points.
 
-        return self.structures
+        Returns:
+            np.ndarray: 3D mask array, or a CompactMask when compact_masks is set.
+        """
+        return rasterize_contours(
+            points_data, self.image_data["start"], self.image_data["width"], self.image_data["dimensions"],
+            self.compact_masks,
+        )
 
-    def generate_mask(self, points_data):
+    def calculate_volume(self, mask):
         """
-        Generate a mask based on points data and the reference image dimensions.
+        Calculate the volume of the structure based on its mask.
 
         Args:
-            points_data (list): List of contour points.
+            mask (np.ndarray or CompactMask): 3D mask.
 
         Returns:
-            np.ndarray: 3D mask array.
+            float: Volume in cm^3.
         """
-        dimensions = self.image_data["dimensions"]
-        mask = np.zeros(dimensions, dtype=bool)
+        return mask_volume(mask, self.image_data["width"])
 
-        for points in points_data:
-            # Assuming each points set corresponds to a single slice
-            slice_index = int((points[0][2] - self.image_data["start"][2]) / self.image_data["width"][2])
-            slice_mask = np.zeros(dimensions[:2], dtype=bool)
+    def calculate_contour_volume(self, points_data):
+        """
+        Calculate the volume of the structure from its contours (see contour_volume).
 
-            # Convert points to pixel indices
-            polygon = [
-                ((point[0] - self.image_data["start"][0]) / self.image_data["width"][0],
-                 (point[1] - self.image_data["start"][1]) / self.image_data["width"][1])
-                for point in points
-            ]
-            polygon = np.round(polygon).astype(int)
+        Args:
+            points_data (list): List of contour points.
 
-            # Fill the polygon to generate the mask for the slice
-            rr, cc = polygon[:, 0], polygon[:, 1]
-            slice_mask[rr, cc] = True
+        Returns:
+            float: Volume in cm^3.
+        """
+        return contour_volume(points_data, abs(self.image_data["width"][2]))
 
-            mask[:, :, slice_index] = slice_mask
+    def structure_volume(self, structure, method=None):
+        """
+        Volume of a loaded structure with the given or configured volume method.
 
-        return mask
+        Args:
+            structure (dict): Structure from load_structures.
+            method (str, optional): "mask" or "contour"; defaults to volume_method.
 
-    def calculate_volume(self, mask):
+        Returns:
+            float: Volume in cm^3.
         """
-        Calculate the volume of the structure based on its mask.
+        if not structure["points"]:
+            return 0.0
+        if (method or self.volume_method) == "contour":
+            return self.calculate_contour_volume(structure["points"])
+        return self.calculate_volume(structure["mask"])
+
+    def volume_report(self, method="contour"):
+        """
+        Volumes of every loaded structure. The default contour method needs no masks.
 
         Args:
-            mask (np.ndarray): 3D mask array.
+            method (str): "contour" or "mask".
 
         Returns:
-            float: Volume in mm^3.
+            list: Dictionaries with the structure "name", "volume" (cm^3) and number of "contours".
         """
-        voxel_volume = np.prod(self.image_data["width"])
-        return np.sum(mask) * voxel_volume
+        return [
+            {
+                "name": structure["name"],
+                "volume": self.structure_volume(structure, method),
+                "contours": len(structure["points"]),
+            }
+            for structure in self.structures
+        ]
 
 
 # if __name__ == "__main__":
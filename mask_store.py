@@ -0,0 +1,213 @@
+import numpy as np
+
+
+def fill_runs(lines, x_start, x_stop, num_lines, nx):
+    """
+    Paint horizontal runs into scanlines.
+
+    One difference line per scanline gets +1 at each run start and -1 after each run end;
+    the cumulative sum along x then marks the filled pixels. Shared by the dense masks
+    (load_structure.spans_to_mask) and CompactMask.
+
+    Args:
+        lines (np.ndarray): Scanline index of each run.
+        x_start (np.ndarray): First x index of each run.
+        x_stop (np.ndarray): Last x index of each run (inclusive).
+        num_lines (int): Number of scanlines.
+        nx (int): Scanline length.
+
+    Returns:
+        np.ndarray: Boolean array of shape (num_lines, nx).
+    """
+    diff = np.zeros((num_lines, nx + 1), dtype=np.int8)
+    np.add.at(diff, (lines, x_start), 1)
+    np.add.at(diff, (lines, x_stop + 1), -1)
+    return np.cumsum(diff[:, :nx], axis=1, dtype=np.int8) > 0
+
+
+class CompactMask:
+    """
+    Memory-efficient 3D ROI mask.
+
+    Only slices the ROI touches are stored, each cropped to its bounding box and
+    bit-packed, so a mask costs roughly one bit per voxel of its bounding boxes instead
+    of one byte per voxel of the whole image. Voxel counts, unions and intersections work
+    on the crops; a dense array is only built by to_dense().
+    """
+
+    def __init__(self, dimensions):
+        """
+        Initialize an empty CompactMask.
+
+        Args:
+            dimensions (list): Grid size (x, y, z).
+        """
+        self.dimensions = tuple(int(n) for n in dimensions)
+        # slice index -> (x0, y0, crop shape, packed bits, voxel count)
+        self.slices = {}
+
+    def _store(self, slice_index, x0, y0, crop):
+        """
+        Store a 2D crop for a slice, trimming it to its bounding box first.
+        """
+        xs = np.flatnonzero(crop.any(axis=1))
+        if len(xs) == 0:
+            self.slices.pop(slice_index, None)
+            return
+        ys = np.flatnonzero(crop.any(axis=0))
+        crop = crop[xs[0]:xs[-1] + 1, ys[0]:ys[-1] + 1]
+        self.slices[slice_index] = (
+            x0 + int(xs[0]), y0 + int(ys[0]), crop.shape, np.packbits(crop, axis=None), int(np.count_nonzero(crop))
+        )
+
+    def slice_crop(self, slice_index):
+        """
+        Return the stored crop of a slice.
+
+        Args:
+            slice_index (int): Slice index.
+
+        Returns:
+            tuple: (x0, y0, crop) with crop a boolean (x, y) array, or None if the slice is empty.
+        """
+        entry = self.slices.get(slice_index)
+        if entry is None:
+            return None
+        x0, y0, shape, packed, _ = entry
+        crop = np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+        return x0, y0, crop
+
+    @classmethod
+    def from_spans(cls, spans, dimensions):
+        """
+        Build a mask from filled runs (see load_structure.contour_spans).
+
+        Args:
+            spans (tuple): (slice_index, y_index, x_start, x_stop) arrays.
+            dimensions (list): Grid size (x, y, z).
+
+        Returns:
+            CompactMask: The mask.
+        """
+        mask = cls(dimensions)
+        slices, rows, x_start, x_stop = (np.asarray(a) for a in spans)
+        if len(slices) == 0:
+            return mask
+
+        order = np.argsort(slices, kind="stable")
+        slices, rows, x_start, x_stop = slices[order], rows[order], x_start[order], x_stop[order]
+        bounds = np.flatnonzero(np.diff(slices)) + 1
+        for group in np.split(np.arange(len(slices)), bounds):
+            x0, y0 = int(x_start[group].min()), int(rows[group].min())
+            shape = (int(x_stop[group].max()) - x0 + 1, int(rows[group].max()) - y0 + 1)
+            crop = fill_runs(rows[group] - y0, x_start[group] - x0, x_stop[group] - x0, shape[1], shape[0]).T
+            mask._store(int(slices[group[0]]), x0, y0, crop)
+        return mask
+
+    @classmethod
+    def from_dense(cls, dense):
+        """
+        Build a mask from a dense boolean (x, y, z) array.
+
+        Args:
+            dense (np.ndarray): Dense mask.
+
+        Returns:
+            CompactMask: The mask.
+        """
+        mask = cls(dense.shape)
+        for slice_index in np.flatnonzero(dense.any(axis=(0, 1))):
+            mask._store(int(slice_index), 0, 0, np.asarray(dense[:, :, slice_index], dtype=bool))
+        return mask
+
+    def to_dense(self):
+        """
+        Expand to a dense boolean (x, y, z) array.
+
+        Returns:
+            np.ndarray: Dense mask.
+        """
+        dense = np.zeros(self.dimensions, dtype=bool)
+        for slice_index in self.slices:
+            x0, y0, crop = self.slice_crop(slice_index)
+            dense[x0:x0 + crop.shape[0], y0:y0 + crop.shape[1], slice_index] = crop
+        return dense
+
+    def voxel_count(self):
+        """
+        Number of voxels in the mask.
+
+        Returns:
+            int: Voxel count.
+        """
+        return sum(entry[4] for entry in self.slices.values())
+
+    @property
+    def nbytes(self):
+        """
+        Bytes used by the packed crops.
+        """
+        return sum(entry[3].nbytes for entry in self.slices.values())
+
+    def _combine(self, other, slice_indices, union):
+        """
+        Combine two masks slice by slice over their joint (union) or shared (intersection) box.
+        """
+        if self.dimensions != other.dimensions:
+            raise ValueError(f"Mask dimensions differ: {self.dimensions} vs {other.dimensions}")
+
+        result = CompactMask(self.dimensions)
+        for slice_index in slice_indices:
+            a, b = self.slice_crop(slice_index), other.slice_crop(slice_index)
+            if a is None or b is None:
+                if union:
+                    x0, y0, crop = a if a is not None else b
+                    result._store(slice_index, x0, y0, crop)
+                continue
+
+            boxes = [(x0, y0, x0 + crop.shape[0], y0 + crop.shape[1]) for x0, y0, crop in (a, b)]
+            if union:
+                x0, y0 = min(boxes[0][0], boxes[1][0]), min(boxes[0][1], boxes[1][1])
+                x1, y1 = max(boxes[0][2], boxes[1][2]), max(boxes[0][3], boxes[1][3])
+            else:
+                x0, y0 = max(boxes[0][0], boxes[1][0]), max(boxes[0][1], boxes[1][1])
+                x1, y1 = min(boxes[0][2], boxes[1][2]), min(boxes[0][3], boxes[1][3])
+                if x0 >= x1 or y0 >= y1:
+                    continue
+
+            combined = np.zeros((x1 - x0, y1 - y0), dtype=bool) if union else np.ones((x1 - x0, y1 - y0), dtype=bool)
+            for cx, cy, crop in (a, b):
+                placed = np.zeros_like(combined)
+                sx, sy = max(cx, x0), max(cy, y0)
+                ex, ey = min(cx + crop.shape[0], x1), min(cy + crop.shape[1], y1)
+                placed[sx - x0:ex - x0, sy - y0:ey - y0] = crop[sx - cx:ex - cx, sy - cy:ey - cy]
+                combined = combined | placed if union else combined & placed
+            result._store(slice_index, x0, y0, combined)
+        return result
+
+    def union(self, other):
+        """
+        Voxels in either mask.
+
+        Args:
+            other (CompactMask): Mask on the same grid.
+
+        Returns:
+            CompactMask: The union.
+        """
+        return self._combine(other, sorted(set(self.slices) | set(other.slices)), union=True)
+
+    def intersection(self, other):
+        """
+        Voxels in both masks.
+
+        Args:
+            other (CompactMask): Mask on the same grid.
+
+        Returns:
+            CompactMask: The intersection.
+        """
+        return self._combine(other, sorted(set(self.slices) & set(other.slices)), union=False)
+
+    __or__ = union
+    __and__ = intersection
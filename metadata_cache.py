@@ -0,0 +1,153 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+# Version of the cached metadata. Bump it whenever an extractor returns different
+# metadata, so entries written by older code are dropped instead of being reused.
+# 2: document-level RescaleSlope/RescaleIntercept fallback
+# 3: image databaseUID, used for deterministic export UIDs
+CACHE_VERSION = 3
+
+
+class MetadataCache:
+    """
+    Persistent on-disk cache of metadata extracted from a patient archive XML file.
+
+    Entries are stored as JSON in a small sqlite database, either next to the archive
+    (<xml file>.cache.sqlite) or in a shared cache directory. The cache remembers the size,
+    modification time and SHA-256 of the XML file it was built from, and the CACHE_VERSION
+    of the code that wrote it, and drops every entry as soon as either changes.
+    """
+
+    def __init__(self, xml_file, cache_dir=None):
+        """
+        Initialize the MetadataCache. The database is opened on first use.
+
+        Args:
+            xml_file (str): Full path of the patient archive XML file.
+            cache_dir (str, optional): Directory for the cache database. Defaults to the
+                                       directory of the XML file.
+        """
+        self.xml_file = xml_file
+        if cache_dir is None:
+            self.db_path = xml_file + ".cache.sqlite"
+        else:
+            key = hashlib.sha1(os.path.abspath(xml_file).encode("utf-8")).hexdigest()
+            self.db_path = os.path.join(cache_dir, f"{key}.sqlite")
+        self.cache_dir = cache_dir
+        self._conn = None
+        self._disabled = False
+
+    def _connect(self):
+        """
+        Open the cache database and make sure it matches the current XML file.
+
+        Returns:
+            sqlite3.Connection: Open connection, or None if the cache is unusable.
+        """
+        if self._conn is not None or self._disabled:
+            return self._conn
+
+        try:
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), size INTEGER, mtime INTEGER, sha256 TEXT, "
+                "version INTEGER)"
+            )
+            # Caches written before versioning lack the column; their version reads as NULL
+            if "version" not in {row[1] for row in conn.execute("PRAGMA table_info(archive)")}:
+                conn.execute("ALTER TABLE archive ADD COLUMN version INTEGER")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT)")
+            self._validate(conn)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Warning: metadata cache {self.db_path} unavailable, continuing without it: {e}")
+            self._disabled = True
+            return None
+
+        self._conn = conn
+        return conn
+
+    def _validate(self, conn):
+        """
+        Drop all entries if the XML file changed since the cache was written, or if the
+        entries were written with another CACHE_VERSION.
+
+        Size and mtime are checked first; the file hash is only computed when they
+        differ, so an unchanged archive is never re-read.
+
+        Args:
+            conn (sqlite3.Connection): Open cache connection.
+        """
+        stat = os.stat(self.xml_file)
+        row = conn.execute("SELECT size, mtime, sha256, version FROM archive WHERE id = 1").fetchone()
+        current = row is not None and row[3] == CACHE_VERSION
+        if current and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return
+
+        digest = self._file_hash()
+        with conn:
+            if not current or row[0] != stat.st_size or row[2] != digest:
+                conn.execute("DELETE FROM entries")
+            conn.execute(
+                "INSERT OR REPLACE INTO archive (id, size, mtime, sha256, version) VALUES (1, ?, ?, ?, ?)",
+                (stat.st_size, stat.st_mtime_ns, digest, CACHE_VERSION),
+            )
+
+    def _file_hash(self, chunk_size=1 << 20):
+        """
+        Compute the SHA-256 of the XML file.
+
+        Returns:
+            str: Hex digest.
+        """
+        sha = hashlib.sha256()
+        with open(self.xml_file, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def get(self, key, default=None):
+        """
+        Look up a cached entry.
+
+        Args:
+            key (str): Entry key.
+            default: Value returned when the entry is missing.
+
+        Returns:
+            The cached value, or default.
+        """
+        conn = self._connect()
+        if conn is None:
+            return default
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def set(self, key, value):
+        """
+        Store an entry. The value must be JSON serializable.
+
+        Args:
+            key (str): Entry key.
+            value: Value to store.
+        """
+        conn = self._connect()
+        if conn is None:
+            return
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def close(self):
+        """
+        Close the cache database.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
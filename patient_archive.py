@@ -0,0 +1,308 @@
+import os
+from collections import defaultdict
+from lxml import etree
+from metadata_cache import MetadataCache
+
+# Subtrees the loaders read from; streaming mode keeps these (with their ancestors) and
+# drops everything else as it is parsed.
+STREAM_KEEP_TAGS = {
+    "briefPatient",
+    "fullPlanDataArray",
+    "troiList",
+    "doseVolumeList",
+    "patientPlanTrial",
+    "fullDeliveryPlanDataArray",
+    "legacyPlan",
+    "WindowCenter",
+    "WindowWidth",
+    "RescaleSlope",
+    "RescaleIntercept",
+    "referenceImageIsocenter",
+    "couchChecksum",
+    "couchInsertionPosition",
+}
+
+# Large payloads never read by the loaders, cleared even inside kept subtrees.
+STREAM_SKIP_TAGS = {"graphicData", "scanList", "scanListZValues", "slicesToReconstruct"}
+
+_MISSING = object()
+
+
+def read_array_header(header):
+    """
+    Read an arrayHeader element in a single pass over its children.
+
+    Args:
+        header (etree._Element): arrayHeader element.
+
+    Returns:
+        dict: "filename" (relative binaryFileName), "dimensions" (ints), "start" and
+              "width" (floats); keys are missing when the header lacks them.
+    """
+    fields = {"dimensions": ("dimensions", int), "start": ("start", float), "elementSize": ("width", float)}
+    result = {}
+    for child in header:
+        if child.tag == "binaryFileName":
+            result["filename"] = child.text
+        elif child.tag in fields:
+            key, cast = fields[child.tag]
+            axes = {axis.tag: axis.text for axis in child}
+            result[key] = [cast(axes["x"]), cast(axes["y"]), cast(axes["z"])]
+    return result
+
+
+def full_plan_node(brief_plan):
+    """
+    Return the plan entry holding a briefPlan stored as fullPlanDataArray/plan/briefPlan.
+
+    Args:
+        brief_plan (etree._Element): briefPlan element.
+
+    Returns:
+        etree._Element: The enclosing fullPlanDataArray element, or None if the briefPlan
+                        is stored anywhere else.
+    """
+    plan = brief_plan.getparent()
+    if plan is None or plan.tag != "plan":
+        return None
+    container = plan.getparent()
+    if container is None or container.tag != "fullPlanDataArray":
+        return None
+    return container
+
+
+class PatientArchive:
+    """
+    Parse-once view of a TomoTherapy patient archive XML file.
+
+    The loaders (LoadImage, LoadStructures, PlanLoader, LoadPlanDose) and PlanFinder all
+    read the same *_patient.xml. Sharing a PatientArchive between them means the file is
+    parsed a single time per export instead of once per loader.
+    """
+
+    def __init__(self, xml_path, xml_name, streaming=False, cache=False, cache_dir=None):
+        """
+        Initialize the PatientArchive. The XML file is parsed on first access.
+
+        Args:
+            xml_path (str): Path to the directory containing the XML file.
+            xml_name (str): Name of the XML file.
+            streaming (bool): Parse with iterparse and keep only the subtrees the loaders
+                              use, so peak memory does not grow with the archive size.
+            cache (bool): Keep extracted metadata in a persistent MetadataCache so repeated
+                          exports of an unchanged archive skip XML parsing.
+            cache_dir (str, optional): Directory for the cache database. Defaults to the
+                                       directory of the XML file.
+        """
+        self.xml_path = xml_path
+        self.xml_name = xml_name
+        self.full_path = os.path.join(xml_path, xml_name)
+        self.streaming = streaming
+        self.cache = MetadataCache(self.full_path, cache_dir) if cache or cache_dir else None
+        self._tree = None
+        self._memo = {}
+        self._by_uid = None
+        self._by_parent = None
+        self._by_image_type = None
+
+    @property
+    def tree(self):
+        """
+        Parsed XML tree, parsed on first access.
+
+        Returns:
+            etree._ElementTree: Parsed XML tree.
+
+        Raises:
+            FileNotFoundError: If the XML file is not found.
+        """
+        if self._tree is None:
+            if not os.path.exists(self.full_path):
+                raise FileNotFoundError(f"XML file not found: {self.full_path}")
+            if self.streaming:
+                self._tree = self._stream_parse()
+            else:
+                parser = etree.XMLParser(huge_tree=True)
+                self._tree = etree.parse(self.full_path, parser)
+        return self._tree
+
+    @property
+    def root(self):
+        """
+        Root element of the parsed XML tree.
+
+        Returns:
+            etree._Element: Root element.
+        """
+        return self.tree.getroot()
+
+    def _build_indexes(self):
+        """
+        Index every dbInfo owner by UID and parent UID, and every imageType owner by type.
+
+        Built once, in a single pass over the tree, on the first lookup.
+        """
+        by_uid = defaultdict(list)
+        by_parent = defaultdict(list)
+        by_image_type = defaultdict(list)
+
+        for elem in self.root.iter("dbInfo", "imageType"):
+            owner = elem.getparent()
+            if owner is None:
+                continue
+            if elem.tag == "imageType":
+                by_image_type[elem.text].append(owner)
+                continue
+            uid = elem.findtext("databaseUID")
+            parent_uid = elem.findtext("databaseParent")
+            if uid:
+                by_uid[uid].append(owner)
+            if parent_uid:
+                by_parent[parent_uid].append(owner)
+
+        self._by_uid = by_uid
+        self._by_parent = by_parent
+        self._by_image_type = by_image_type
+
+    @staticmethod
+    def _select(nodes, tag):
+        """
+        Filter index entries by element tag.
+        """
+        if tag is None:
+            return list(nodes)
+        return [node for node in nodes if node.tag == tag]
+
+    def find_by_uid(self, uid, tag=None):
+        """
+        Find the elements whose dbInfo/databaseUID equals uid.
+
+        Args:
+            uid (str): Database UID.
+            tag (str, optional): Only return elements with this tag (e.g. "briefPlan").
+
+        Returns:
+            list: Matching elements (the owners of the dbInfo), in document order.
+        """
+        if self._by_uid is None:
+            self._build_indexes()
+        return self._select(self._by_uid.get(uid, ()), tag)
+
+    def find_children(self, parent_uid, tag=None):
+        """
+        Find the elements whose dbInfo/databaseParent equals parent_uid.
+
+        Args:
+            parent_uid (str): Database UID of the parent object.
+            tag (str, optional): Only return elements with this tag (e.g. "image").
+
+        Returns:
+            list: Matching elements (the owners of the dbInfo), in document order.
+        """
+        if self._by_parent is None:
+            self._build_indexes()
+        return self._select(self._by_parent.get(parent_uid, ()), tag)
+
+    def find_by_image_type(self, image_type, tag=None):
+        """
+        Find the elements whose imageType equals image_type.
+
+        Args:
+            image_type (str): Image type (e.g. "KVCT", "Opt_Dose_After_EOP").
+            tag (str, optional): Only return elements with this tag.
+
+        Returns:
+            list: Matching elements, in document order.
+        """
+        if self._by_image_type is None:
+            self._build_indexes()
+        return self._select(self._by_image_type.get(image_type, ()), tag)
+
+    def _stream_parse(self):
+        """
+        Parse the XML file incrementally, keeping only STREAM_KEEP_TAGS subtrees.
+
+        Elements outside a kept subtree are removed as soon as they are closed unless they
+        still hold a kept descendant, so the finished tree has the same paths as a full
+        parse for everything the loaders query.
+
+        Returns:
+            etree._ElementTree: Pruned XML tree.
+        """
+        keep_depth = 0
+        root = None
+        for event, elem in etree.iterparse(self.full_path, events=("start", "end"), huge_tree=True):
+            if event == "start":
+                if root is None:
+                    root = elem
+                if elem.tag in STREAM_KEEP_TAGS:
+                    keep_depth += 1
+                continue
+
+            if elem.tag in STREAM_KEEP_TAGS:
+                keep_depth -= 1
+                continue
+
+            if elem.tag in STREAM_SKIP_TAGS:
+                elem.clear()
+
+            if keep_depth or elem is root:
+                continue
+
+            # Outside any kept subtree: drop the element unless it leads to kept data
+            if len(elem) == 0:
+                parent = elem.getparent()
+                if parent is not None:
+                    parent.remove(elem)
+            else:
+                elem.text = None
+
+        return etree.ElementTree(root)
+
+    def cached(self, key, compute):
+        """
+        Return cached metadata for key, computing and storing it on a cache miss.
+
+        The XML file is only parsed if compute() touches the tree, so a warm cache
+        never parses it. Values must be JSON serializable; tuples come back as lists.
+        Results are also kept in memory for the lifetime of the archive, so loaders
+        sharing it extract each piece of metadata once.
+
+        Args:
+            key (str): Entry key, unique per kind of metadata and plan/structure set.
+            compute (callable): Function extracting the metadata from the archive.
+
+        Returns:
+            The cached or freshly computed metadata.
+        """
+        value = self._memo.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        if self.cache is None or not os.path.exists(self.full_path):
+            value = compute()
+        else:
+            value = self.cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = compute()
+                self.cache.set(key, value)
+
+        self._memo[key] = value
+        return value
+
+    @staticmethod
+    def resolve(archive, xml_path, xml_name):
+        """
+        Return the given archive, or a new one for xml_path/xml_name if none was given.
+
+        Args:
+            archive (PatientArchive or None): Shared archive, if any.
+            xml_path (str): Path to the directory containing the XML file.
+            xml_name (str): Name of the XML file.
+
+        Returns:
+            PatientArchive: Archive to read from.
+        """
+        if archive is not None:
+            return archive
+        return PatientArchive(xml_path, xml_name)
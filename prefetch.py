@@ -0,0 +1,82 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BinaryPrefetcher:
+    """
+    Read binary files in the background so later loaders find them in the page cache.
+
+    Export reads the CT, curve, sinogram and dose binaries one after another, usually from
+    a network share. Submitting the files read after the CT as soon as their names are known
+    overlaps those reads with XML parsing, the CT read and each other.
+    """
+
+    def __init__(self, max_workers=4, chunk_size=8 * 1024 * 1024):
+        """
+        Initialize the BinaryPrefetcher.
+
+        Args:
+            max_workers (int): Number of reader threads.
+            chunk_size (int): Read size in bytes.
+        """
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=exc_type is None)
+
+    def _warm(self, file_path):
+        """
+        Read a file once, discarding the data, to pull it into the page cache.
+
+        Args:
+            file_path (str): File to read.
+
+        Returns:
+            int: Number of bytes read.
+        """
+        buffer = bytearray(self.chunk_size)
+        total = 0
+        with open(file_path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                total += count
+        return total
+
+    def prefetch(self, file_path):
+        """
+        Start reading a file in the background. Missing files and repeats are ignored.
+
+        Args:
+            file_path (str): File to prefetch.
+        """
+        if not file_path or file_path in self._futures or not os.path.exists(file_path):
+            return
+        self._futures[file_path] = self._executor.submit(self._warm, file_path)
+
+    def prefetch_all(self, file_paths):
+        """
+        Start reading several files in the background, in the given order.
+
+        Args:
+            file_paths (list): Files to prefetch.
+        """
+        for file_path in file_paths:
+            self.prefetch(file_path)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the reader threads.
+
+        Args:
+            wait (bool): Wait for running reads to finish.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,101 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ARCHIVE_NAME = "TEST_patient.xml"
+CT_DIMENSIONS = (32, 24, 10)
+DOSE_DIMENSIONS = (16, 12, 5)
+
+
+def _array_header(filename, dimensions, start, width):
+    return (
+        f"<arrayHeader><binaryFileName>{filename}</binaryFileName>"
+        f"<dimensions><x>{dimensions[0]}</x><y>{dimensions[1]}</y><z>{dimensions[2]}</z></dimensions>"
+        f"<start><x>{start[0]}</x><y>{start[1]}</y><z>{start[2]}</z></start>"
+        f"<elementSize><x>{width[0]}</x><y>{width[1]}</y><z>{width[2]}</z></elementSize></arrayHeader>"
+    )
+
+
+def _curve_file(path, contours):
+    point_data = "".join(
+        f'<pointData numDataPoints="{len(points)}">\n'
+        + "\n".join(f"{x},{y},{z};" for x, y, z in points)
+        + "\n</pointData>"
+        for points in contours
+    )
+    with open(path, "w") as f:
+        f.write(f"<curves>{point_data}</curves>")
+
+
+def _square(half_size, z):
+    return [(-half_size, -half_size, z), (half_size, -half_size, z), (half_size, half_size, z), (-half_size, half_size, z)]
+
+
+def build_archive(directory):
+    """
+    Write a small synthetic patient archive: one approved helical plan (PLAN1) with a KVCT,
+    two ROIs, a dose volume and a machine agnostic sinogram, plus an unapproved plan and an
+    approved legacy plan.
+    """
+    nx, ny, nz = CT_DIMENSIONS
+    ct = (np.arange(nx * ny * nz, dtype=np.uint16) % 2000).reshape(CT_DIMENSIONS, order="F")
+    ct.ravel(order="F").tofile(os.path.join(directory, "ct.img"))
+    dose = np.random.RandomState(0).rand(*DOSE_DIMENSIONS).astype(np.float32) * 60
+    dose.tofile(os.path.join(directory, "dose.img"))
+    np.random.RandomState(1).rand(50, 64).tofile(os.path.join(directory, "sino.bin"))
+
+    # Body: squares with a square hole on slices 2..7; PTV: dense circles on slices 3..5
+    body = []
+    for k in range(2, 8):
+        body += [_square(4.0, -2.0 + k * 0.5), _square(1.5, -2.0 + k * 0.5)]
+    _curve_file(os.path.join(directory, "body.xml"), body)
+    angles = np.linspace(0, 2 * np.pi, 400, endpoint=False)
+    ptv = [[(2 * np.cos(a), 2 * np.sin(a), -2.0 + k * 0.5) for a in angles] for k in range(3, 6)]
+    _curve_file(os.path.join(directory, "ptv.xml"), ptv)
+
+    ct_header = _array_header("ct.img", CT_DIMENSIONS, (-8, -6, -2), (0.5, 0.5, 0.5))
+    dose_header = _array_header("dose.img", DOSE_DIMENSIONS, (-8, -6, -2), (1.0, 1.0, 1.0))
+    xml = f"""<?xml version="1.0"?>
+<FullPatient><patient><briefPatient><patientName>DOE^JANE</patientName><patientID>123</patientID><patientBirthDate>19500101</patientBirthDate><patientGender>F</patientGender></briefPatient>
+<WindowCenter>40</WindowCenter><WindowWidth>400</WindowWidth>
+<scanList>{'<scan>1</scan>' * 200}</scanList>
+<fullPlanDataArray>
+ <fullPlanDataArray><plan><briefPlan><dbInfo><databaseUID>PLAN1</databaseUID><databaseParent>PAT</databaseParent></dbInfo><planLabel>Plan One</planLabel><typeOfPlan>PATIENT</typeOfPlan><planDeliveryType>Helical</planDeliveryType><approvedPlanTrialUID>TRIAL1</approvedPlanTrialUID><modificationTimestamp><date>20230101</date><time>101010</time></modificationTimestamp></briefPlan>
+  <fullDoseIVDT>IVDT1</fullDoseIVDT><patientPosition>HFS</patientPosition><planStructureSetUID>SS1</planStructureSetUID>
+  <referenceImageIsocenter><x>1.5</x><y>2.5</y><z>3.5</z></referenceImageIsocenter><couchChecksum>abc</couchChecksum><couchInsertionPosition>10</couchInsertionPosition></plan>
+  <fullImageDataArray><fullImageDataArray><image><dbInfo><databaseUID>IMG1</databaseUID><databaseParent>PLAN1</databaseParent></dbInfo><imageType>KVCT</imageType>{ct_header}<graphicData>{'1 ' * 500}</graphicData></image></fullImageDataArray></fullImageDataArray>
+ </fullPlanDataArray>
+ <fullPlanDataArray><plan><briefPlan><dbInfo><databaseUID>PLAN2</databaseUID></dbInfo><planLabel>Plan Two</planLabel><typeOfPlan>PATIENT</typeOfPlan><planDeliveryType>Direct</planDeliveryType><approvedPlanTrialUID>* * * DO NOT CHANGE THIS STRING VALUE * * *</approvedPlanTrialUID></briefPlan>
+  <referenceImageIsocenter><x>9</x><y>9</y><z>9</z></referenceImageIsocenter></plan></fullPlanDataArray>
+</fullPlanDataArray>
+<troiList><troiList><briefROI><dbInfo><databaseUID>ROI1</databaseUID><databaseParent>SS1</databaseParent></dbInfo><name>Body</name><color><red>255</red><green>0</green><blue>0</blue></color></briefROI><curveDataFile>body.xml</curveDataFile></troiList>
+<troiList><briefROI><dbInfo><databaseUID>ROI2</databaseUID><databaseParent>SS1</databaseParent></dbInfo><name>PTV</name><color><red>0</red><green>255</green><blue>0</blue></color><isDensityOverridden>false</isDensityOverridden></briefROI><curveDataFile>ptv.xml</curveDataFile></troiList>
+<troiList><briefROI><dbInfo><databaseUID>ROI3</databaseUID><databaseParent>OTHER</databaseParent></dbInfo><name>Other</name></briefROI></troiList></troiList>
+<patientPlanTrial><dbInfo><databaseUID>TRIAL1</databaseUID><databaseParent>PLAN1</databaseParent></dbInfo></patientPlanTrial>
+<doseVolumeList><doseVolumeList><dbInfo><databaseUID>DV1</databaseUID><databaseParent>TRIAL1</databaseParent></dbInfo><imageType>Opt_Dose_After_EOP</imageType><frameOfReference>FOR1</frameOfReference>{dose_header}</doseVolumeList></doseVolumeList>
+<fullDeliveryPlanDataArray><fullDeliveryPlanDataArray><deliveryPlan><dbInfo><databaseUID>DP1</databaseUID><databaseParent>PLAN1</databaseParent></dbInfo><purpose>Machine_Agnostic</purpose></deliveryPlan><binaryFileNameArray><binaryFileNameArray>sino.bin</binaryFileNameArray></binaryFileNameArray></fullDeliveryPlanDataArray></fullDeliveryPlanDataArray>
+<legacyPlan><dbInfo><databaseUID>LEG1</databaseUID></dbInfo><approvalStatus>Approved</approvalStatus></legacyPlan>
+</patient></FullPatient>"""
+    with open(os.path.join(directory, ARCHIVE_NAME), "w") as f:
+        f.write(xml)
+    return directory
+
+
+@pytest.fixture(scope="session")
+def archive_dir(tmp_path_factory):
+    """
+    Directory holding the synthetic archive; shared, so tests must not modify it.
+    """
+    return str(build_archive(tmp_path_factory.mktemp("archive")))
+
+
+@pytest.fixture
+def fresh_archive_dir(tmp_path):
+    """
+    Private copy of the synthetic archive, for tests that write caches or exports next to it.
+    """
+    return str(build_archive(tmp_path))
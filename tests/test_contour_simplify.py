@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from contour_simplify import _segment_distance, decimate_structures, simplify_contour
+
+
+def circle(radius, n, z=0.0):
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return np.column_stack([radius * np.cos(angles), radius * np.sin(angles), np.full(n, z)])
+
+
+def max_deviation(points, simplified):
+    """
+    Largest distance of an original point to the closed simplified polyline.
+    """
+    a = simplified
+    b = np.roll(simplified, -1, axis=0)
+    distances = [
+        _segment_distance(np.repeat(points[i:i + 1], len(a), axis=0), a, b).min()
+        for i in range(len(points))
+    ]
+    return max(distances)
+
+
+def test_collinear_points_are_removed():
+    square = np.array([[0, 0, 0], [1, 0, 0], [2, 0, 0], [2, 1, 0], [2, 2, 0], [1, 2, 0], [0, 2, 0], [0, 1, 0]], dtype=float)
+    simplified, deviation = simplify_contour(square, 1e-9)
+
+    assert len(simplified) == 4
+    assert deviation == pytest.approx(0.0)
+
+
+@pytest.mark.parametrize("tolerance", [0.001, 0.01, 0.05])
+def test_deviation_stays_within_tolerance(tolerance):
+    points = circle(3.0, 400)
+    simplified, deviation = simplify_contour(points, tolerance)
+
+    assert 3 <= len(simplified) < len(points)
+    assert deviation <= tolerance
+    assert max_deviation(points, simplified) <= tolerance + 1e-12
+
+
+def test_decimate_structures_uses_mm_tolerance_on_cm_points():
+    structure = {"name": "PTV", "points": [circle(3.0, 400)]}
+    simplified, report = decimate_structures([structure], tolerance=0.5)
+
+    # 0.5 mm on contours in cm
+    deviation_cm = max_deviation(structure["points"][0], simplified[0]["points"][0])
+    assert deviation_cm <= 0.05 + 1e-12
+    assert deviation_cm * 10.0 <= report[0]["max_deviation"] + 1e-9
+    assert report[0]["max_deviation"] <= 0.5
+    assert report[0]["points_before"] == 400
+    assert report[0]["points_after"] == len(simplified[0]["points"][0])
+    assert structure["points"][0].shape == (400, 3)
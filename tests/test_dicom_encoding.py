@@ -0,0 +1,55 @@
+import numpy as np
+import pydicom
+import pytest
+from dicom_encoding import TRANSFER_SYNTAXES, transfer_syntax_uid
+from write_dicom_dose import write_dicom_dose
+from write_dicom_image import reorient_volume, write_dicom_enhanced_image, write_dicom_image
+
+
+def make_image_data(shape=(7, 5, 3)):
+    rng = np.random.default_rng(2)
+    data = rng.integers(-1000, 3000, size=shape).astype(np.float64)
+    return {"data": data, "start": [-1.0, -2.0, -3.0], "width": [0.1, 0.1, 0.3]}
+
+
+def test_unknown_transfer_syntax_is_rejected():
+    with pytest.raises(ValueError):
+        transfer_syntax_uid("jpeg")
+
+
+@pytest.mark.parametrize("transfer_syntax", sorted(TRANSFER_SYNTAXES))
+def test_ct_slices_round_trip(tmp_path, transfer_syntax):
+    image_data = make_image_data()
+    expected = reorient_volume(image_data["data"], 1024)
+
+    write_dicom_image(image_data, str(tmp_path / "CT"), {}, workers=1, transfer_syntax=transfer_syntax, encode_workers=1)
+
+    for i in range(expected.shape[0]):
+        ds = pydicom.dcmread(str(tmp_path / f"CT_{i + 1:03d}.dcm"))
+        assert ds.file_meta.TransferSyntaxUID == TRANSFER_SYNTAXES[transfer_syntax]
+        np.testing.assert_array_equal(ds.pixel_array, expected[i])
+
+
+@pytest.mark.parametrize("transfer_syntax", sorted(TRANSFER_SYNTAXES))
+def test_enhanced_ct_round_trips(tmp_path, transfer_syntax):
+    image_data = make_image_data()
+    output_file = str(tmp_path / "CT.dcm")
+
+    write_dicom_enhanced_image(image_data, output_file, {}, transfer_syntax=transfer_syntax, encode_workers=1)
+
+    ds = pydicom.dcmread(output_file)
+    np.testing.assert_array_equal(ds.pixel_array, reorient_volume(image_data["data"], 1024))
+
+
+@pytest.mark.parametrize("transfer_syntax", sorted(TRANSFER_SYNTAXES))
+def test_dose_round_trips(tmp_path, transfer_syntax):
+    rng = np.random.default_rng(3)
+    dose_data = {"data": rng.uniform(0, 70, size=(6, 5, 4)), "start": [0.0, 0.0, 0.0], "width": [0.4, 0.4, 0.5]}
+    output_path = str(tmp_path / "RTDose.dcm")
+
+    write_dicom_dose(dose_data, output_path, transfer_syntax=transfer_syntax, encode_workers=1)
+
+    ds = pydicom.dcmread(output_path)
+    assert ds.file_meta.TransferSyntaxUID == TRANSFER_SYNTAXES[transfer_syntax]
+    expected = np.clip(dose_data["data"] / ds.DoseGridScaling, 0, 65535).astype(np.uint16)
+    np.testing.assert_array_equal(ds.pixel_array.reshape(-1), expected.reshape(-1))
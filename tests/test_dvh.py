@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from dvh import compute_dvhs
+from load_structure import LoadStructures
+
+
+def square(x0, y0, x1, y1, z):
+    return np.array([[x0, y0, z], [x1, y0, z], [x1, y1, z], [x0, y1, z]], dtype=np.float64)
+
+
+START, WIDTH, DIMENSIONS = [0.0, 0.0, 0.0], [0.2, 0.25, 0.5], [30, 24, 8]
+
+
+def make_dose(values):
+    # compute_dvhs reads the dose in file order (x fastest)
+    return {"data": np.asarray(values, dtype=np.float32), "start": START, "width": WIDTH, "dimensions": DIMENSIONS}
+
+
+def test_total_volume_matches_mask_volume_in_cm3():
+    loader = LoadStructures("", "unused.xml", {"start": START, "width": WIDTH, "dimensions": DIMENSIONS}, lazy_masks=False)
+    points = [square(0.9, 1.1, 3.9, 4.1, z) for z in (1.0, 1.5, 2.0, 2.5)]
+    structures = [{"name": "PTV", "points": points}]
+
+    result = compute_dvhs(make_dose(np.full(np.prod(DIMENSIONS), 2.0)), structures, bin_width=0.1)
+
+    expected = loader.calculate_volume(loader.generate_mask(points))
+    assert expected == pytest.approx(3.0 * 3.0 * 4 * 0.5)
+    assert result["metrics"]["volume"][0] == pytest.approx(expected)
+    assert result["cumulative"][0, 0] == pytest.approx(expected)
+    assert result["differential"][0].sum() == pytest.approx(expected)
+
+
+def test_dose_metrics():
+    dose = np.zeros(DIMENSIONS, dtype=np.float32)
+    dose[:, :, 2] = 1.0
+    dose[:, :, 3] = 3.0
+    points = [square(0.9, 1.1, 3.9, 4.1, z) for z in (1.0, 1.5)]
+
+    result = compute_dvhs(
+        make_dose(dose.reshape(-1, order="F")), [{"name": "PTV", "points": points}],
+        bin_width=0.5, dose_levels=(2.0,), volume_levels=(50.0,)
+    )
+
+    metrics = result["metrics"][0]
+    assert metrics["Dmin"] == pytest.approx(1.0)
+    assert metrics["Dmax"] == pytest.approx(3.0)
+    assert metrics["Dmean"] == pytest.approx(2.0)
+    assert metrics["V2"] == pytest.approx(50.0)
+    assert metrics["D50"] == pytest.approx(3.0)
+
+
+def test_long_names_are_not_truncated():
+    points = [square(0.9, 1.1, 3.9, 4.1, 1.0)]
+    names = ["PTV", "Z" * 100 + "_opt"]
+    structures = [{"name": name, "points": points} for name in names]
+
+    result = compute_dvhs(make_dose(np.ones(np.prod(DIMENSIONS))), structures)
+
+    assert list(result["metrics"]["name"]) == names
+    assert result["names"] == names
@@ -0,0 +1,157 @@
+import os
+import pydicom
+import pytest
+from conftest import ARCHIVE_NAME
+from export_manifest import ExportManifest
+from export_uids import ExportUIDs, make_uid
+from tomo_extract import TomoExtract
+
+
+def write_group(export_path, group, files):
+    os.makedirs(os.path.join(export_path, group), exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(export_path, group, name), "wb") as f:
+            f.write(content)
+
+
+def test_uids_are_deterministic():
+    uids = ExportUIDs("PLAN1", "IMG1")
+    again = ExportUIDs("PLAN1", "IMG1")
+
+    assert uids.uid("ct", "sop", 1) == again.uid("ct", "sop", 1)
+    assert uids.uid("ct", "sop", 1) != uids.uid("ct", "sop", 2)
+    assert uids.uid("rtplan", "sop") != uids.uid("rtstruct", "sop")
+    assert len(str(uids.uid("ct", "sop", 1))) <= 64
+
+
+def test_image_uids_are_shared_between_plans():
+    first, second = ExportUIDs("PLAN1", "IMG1"), ExportUIDs("PLAN2", "IMG1")
+
+    for role in ("study", "frame_of_reference"):
+        assert first.uid(role) == second.uid(role)
+    assert first.uid("ct", "sop", 1) == second.uid("ct", "sop", 1)
+    assert first.uid("rtdose", "sop") != second.uid("rtdose", "sop")
+
+
+def test_variants_change_only_their_role():
+    plain = ExportUIDs("PLAN1", "IMG1")
+    raw = ExportUIDs("PLAN1", "IMG1", {"ct": "raw", "rtstruct": ""})
+
+    assert raw.uid("ct", "sop", 1) != plain.uid("ct", "sop", 1)
+    assert raw.uid("rtstruct", "sop") == plain.uid("rtstruct", "sop")
+    assert raw.uid("study") == plain.uid("study")
+
+
+def test_make_uid_without_source_is_random():
+    assert make_uid(None, "ct", "sop", 1) != make_uid(None, "ct", "sop", 1)
+    assert make_uid(ExportUIDs("PLAN1"), "ct", "sop", 1) == ExportUIDs("PLAN1").uid("ct", "sop", 1)
+
+
+def test_recorded_group_is_current_until_changed(tmp_path):
+    export_path = str(tmp_path)
+    write_group(export_path, "CT", {"CT_001.dcm": b"a" * 10, "CT_002.dcm": b"b" * 10})
+    manifest = ExportManifest(export_path, {"plan_uid": "PLAN1"})
+    assert not manifest.is_current("CT")
+
+    manifest.record("CT")
+    assert manifest.is_current("CT")
+
+    # Same size, different content
+    write_group(export_path, "CT", {"CT_002.dcm": b"c" * 10})
+    os.utime(os.path.join(export_path, "CT", "CT_002.dcm"), ns=(1, 1))
+    assert not manifest.is_current("CT")
+
+    os.remove(os.path.join(export_path, "CT", "CT_002.dcm"))
+    assert not manifest.is_current("CT")
+
+
+def test_completed_groups_survive_an_interruption(tmp_path):
+    export_path = str(tmp_path)
+    manifest = ExportManifest(export_path, {"plan_uid": "PLAN1"})
+    write_group(export_path, "RTPlan", {"RTPlan.dcm": b"plan"})
+    manifest.record("RTPlan")
+    manifest.discard("CT")
+    write_group(export_path, "CT", {"CT_001.dcm": b"partial"})
+
+    resumed = ExportManifest(export_path, {"plan_uid": "PLAN1"})
+    assert resumed.is_current("RTPlan")
+    assert not resumed.is_current("CT")
+
+
+def test_changed_fingerprint_discards_old_files(tmp_path):
+    export_path = str(tmp_path)
+    write_group(export_path, "CT", {"CT_001.dcm": b"a", "CT_002.dcm": b"b"})
+    ExportManifest(export_path, {"multiframe_ct": False}).record("CT")
+
+    manifest = ExportManifest(export_path, {"multiframe_ct": True})
+    assert not manifest.is_current("CT")
+
+    manifest.discard("CT")
+    assert os.listdir(os.path.join(export_path, "CT")) == []
+    assert not os.path.exists(os.path.join(export_path, "manifest.json.tmp"))
+
+
+def make_extract(tmp_path, **kwargs):
+    if not (tmp_path / "patient.xml").exists():
+        (tmp_path / "patient.xml").write_text("<FullPatient/>")
+    return TomoExtract(str(tmp_path), "patient.xml", **kwargs)
+
+
+@pytest.mark.parametrize("option, value", [
+    ("memmap", True),
+    ("contour_tolerance", 0.5),
+    ("multiframe_ct", True),
+    ("transfer_syntax", "rle"),
+])
+def test_fingerprint_covers_output_options(tmp_path, option, value):
+    default = make_extract(tmp_path)._export_fingerprint("PLAN1")
+    assert make_extract(tmp_path, **{option: value})._export_fingerprint("PLAN1") != default
+
+
+def test_fingerprint_ignores_performance_options(tmp_path):
+    default = make_extract(tmp_path)._export_fingerprint("PLAN1")
+    tuned = make_extract(tmp_path, write_workers=1, prefetch_workers=0, compact_masks=True)
+    assert tuned._export_fingerprint("PLAN1") == default
+
+
+def test_memmap_export_gets_its_own_ct_uids(tmp_path):
+    def ct_uid(extract):
+        return ExportUIDs("PLAN1", "IMG1", extract._uid_variants()).uid("ct", "sop", 1)
+
+    assert ct_uid(make_extract(tmp_path, memmap=True)) != ct_uid(make_extract(tmp_path))
+
+
+def test_incremental_needs_deterministic_uids_and_a_directory(tmp_path):
+    with pytest.raises(ValueError):
+        make_extract(tmp_path, incremental=True, deterministic_uids=False)
+    with pytest.raises(ValueError):
+        make_extract(tmp_path, incremental=True, bundle="zip")
+
+
+def export_uids(archive_dir, export_path, **kwargs):
+    TomoExtract(archive_dir, ARCHIVE_NAME, **kwargs).export_dicom("PLAN1", export_path)
+    ct = pydicom.dcmread(os.path.join(export_path, "CT", "CT_001.dcm"))
+    dose = pydicom.dcmread(os.path.join(export_path, "Dose", "RTDose.dcm"))
+    return [ct.StudyInstanceUID, ct.FrameOfReferenceUID, ct.SeriesInstanceUID, ct.SOPInstanceUID, dose.SOPInstanceUID]
+
+
+def test_cold_and_warm_cache_exports_share_uids(fresh_archive_dir):
+    cold = export_uids(fresh_archive_dir, os.path.join(fresh_archive_dir, "cold"), cache=True)
+    warm = export_uids(fresh_archive_dir, os.path.join(fresh_archive_dir, "warm"), cache=True)
+    uncached = export_uids(fresh_archive_dir, os.path.join(fresh_archive_dir, "uncached"))
+
+    assert cold == warm == uncached
+    assert cold[0] == ExportUIDs("PLAN1", "IMG1").uid("study")
+
+
+def test_missing_image_uid_is_reported(fresh_archive_dir, capsys):
+    path = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    with open(path) as f:
+        xml = f.read()
+    with open(path, "w") as f:
+        f.write(xml.replace("<databaseUID>IMG1</databaseUID>", ""))
+
+    uids = export_uids(fresh_archive_dir, os.path.join(fresh_archive_dir, "export"))
+
+    assert "has no databaseUID" in capsys.readouterr().out
+    assert uids[0] == ExportUIDs("PLAN1").uid("study")
@@ -0,0 +1,109 @@
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+import pydicom
+import pytest
+from conftest import ARCHIVE_NAME
+from export_target import BUNDLE_FORMATS, ParallelGzipWriter, TarBundle, ZipBundle, open_bundle, open_output
+from tomo_extract import TomoExtract
+
+MEMBERS = {"CT/CT_001.dcm": b"a" * 1000, "CT/CT_002.dcm": os.urandom(5000), "Dose/RTDose.dcm": b""}
+
+
+def read_members(path):
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as bundle:
+            return {name: bundle.read(name) for name in bundle.namelist()}
+    with tarfile.open(path) as bundle:
+        return {member.name: bundle.extractfile(member).read() for member in bundle.getmembers()}
+
+
+def write_members(target):
+    with target:
+        for name, content in MEMBERS.items():
+            with open_output(name, target) as f:
+                f.write(content)
+    return target.path
+
+
+@pytest.mark.parametrize("spool_size", [0, 1 << 20])
+def test_zip_bundle_round_trip(tmp_path, spool_size):
+    path = write_members(ZipBundle(str(tmp_path / "export.zip"), spool_size=spool_size))
+    assert read_members(path) == MEMBERS
+
+
+@pytest.mark.parametrize("compression,workers", [(None, 1), ("gz", 1), ("gz", 3)])
+@pytest.mark.parametrize("spool_size", [0, 1 << 20])
+def test_tar_bundle_round_trip(tmp_path, compression, workers, spool_size):
+    path = str(tmp_path / ("export.tar.gz" if compression else "export.tar"))
+    write_members(TarBundle(path, compression=compression, workers=workers, spool_size=spool_size))
+    assert read_members(path) == MEMBERS
+
+
+def test_tar_bundle_rejects_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        TarBundle(str(tmp_path / "export.tar.xz"), compression="xz")
+
+
+@pytest.mark.parametrize("bundle_class,name", [(ZipBundle, "export.zip"), (TarBundle, "export.tar")])
+def test_members_are_encoded_concurrently(tmp_path, bundle_class, name):
+    # Both members are open at once; the bundle lock is only taken when one is added
+    with bundle_class(str(tmp_path / name)) as bundle:
+        with bundle.open("a.dcm") as first, bundle.open("b.dcm") as second:
+            first.write(b"first")
+            second.write(b"second")
+    assert read_members(bundle.path) == {"a.dcm": b"first", "b.dcm": b"second"}
+
+
+def test_failed_member_is_not_added(tmp_path):
+    with ZipBundle(str(tmp_path / "export.zip")) as bundle:
+        with pytest.raises(RuntimeError):
+            with bundle.open("broken.dcm") as f:
+                f.write(b"partial")
+                raise RuntimeError("encoding failed")
+    assert read_members(bundle.path) == {}
+
+
+@pytest.mark.parametrize("block_size", [7, 1000, 1 << 20])
+def test_parallel_gzip_writer_round_trip(block_size):
+    data = os.urandom(3000) + b"z" * 5000
+    output = io.BytesIO()
+    writer = ParallelGzipWriter(output, workers=3, block_size=block_size)
+    for start in range(0, len(data), 999):
+        writer.write(data[start:start + 999])
+    writer.close()
+    writer.close()
+
+    assert gzip.decompress(output.getvalue()) == data
+
+
+def test_open_bundle_formats(tmp_path):
+    for bundle, extension in BUNDLE_FORMATS.items():
+        target = open_bundle(str(tmp_path / "nested" / "plan"), bundle, workers=2)
+        assert target.path == str(tmp_path / "nested" / ("plan" + extension))
+        assert isinstance(target, ZipBundle if bundle == "zip" else TarBundle)
+        target.close()
+    with pytest.raises(ValueError, match="Unknown bundle format"):
+        open_bundle(str(tmp_path / "plan"), "rar")
+
+
+@pytest.mark.parametrize("bundle", sorted(BUNDLE_FORMATS))
+def test_bundled_export_members_are_valid_dicom(fresh_archive_dir, bundle):
+    export_path = os.path.join(fresh_archive_dir, "export")
+    extract = TomoExtract(fresh_archive_dir, ARCHIVE_NAME, bundle=bundle, compress_workers=2, write_workers=4)
+    extract.export_dicom("PLAN1", export_path)
+    members = read_members(export_path + BUNDLE_FORMATS[bundle])
+
+    names = sorted(members)
+    assert names == sorted(
+        [f"CT/CT_{i:03d}.dcm" for i in range(1, 11)]
+        + ["Dose/RTDose.dcm", "RTPlan/RTPlan.dcm", "RTStruct/RTStruct.dcm"]
+    )
+    for name, content in members.items():
+        ds = pydicom.dcmread(io.BytesIO(content))
+        assert ds.SOPInstanceUID
+        if name.startswith("CT/"):
+            assert ds.pixel_array.shape == (24, 32)
+    assert pydicom.dcmread(io.BytesIO(members["Dose/RTDose.dcm"])).Modality == "RTDOSE"
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from lxml import etree
+import find_plan
+from conftest import ARCHIVE_NAME
+from find_plan import PlanCatalog, PlanFinder, PlanRecord
+from patient_archive import PatientArchive, full_plan_node
+
+
+def test_catalog_classifies_every_plan(archive_dir):
+    catalog = PlanFinder(archive_dir, ARCHIVE_NAME).catalog()
+
+    assert [record.uid for record in catalog] == ["PLAN1", "PLAN2", "LEG1"]
+    plan1, plan2, legacy = catalog
+    assert (plan1.label, plan1.delivery_type, plan1.plan_type) == ("Plan One", "Helical", "PATIENT")
+    assert plan1.approved and plan1.trial_uids == ["TRIAL1"] and not plan1.legacy
+    assert not plan2.approved and plan2.trial_uids == []
+    assert legacy.legacy and legacy.approved
+
+
+def test_catalog_filters(archive_dir):
+    catalog = PlanFinder(archive_dir, ARCHIVE_NAME).catalog()
+
+    assert [record.uid for record in catalog.patient()] == ["PLAN1", "PLAN2"]
+    assert [record.uid for record in catalog.patient().approved()] == ["PLAN1"]
+    assert [record.uid for record in catalog.delivery_type("Direct")] == ["PLAN2"]
+    assert len(catalog.delivery_type(None)) == 3
+    assert [record.uid for record in catalog.legacy().approved()] == ["LEG1"]
+    assert catalog.by_uid("PLAN2") is catalog[1]
+    assert catalog.by_uid("missing") is None
+    assert isinstance(catalog.approved(), PlanCatalog)
+
+
+def test_finder_results_match_the_catalog(archive_dir):
+    finder = PlanFinder(archive_dir, ARCHIVE_NAME)
+
+    assert finder.find_all_plans() == [("PLAN1", "Plan One", True), ("PLAN2", "Plan Two", False)]
+    assert finder.find_plans("Helical") == [("PLAN1", "Plan One")]
+    assert finder.find_plans("Direct") == []
+    assert finder.find_legacy_plans() == ["LEG1"]
+    assert finder.handle_find_plans_results(finder.find_plans()) == "PLAN1"
+
+
+def test_record_round_trip_and_loaders(archive_dir):
+    finder = PlanFinder(archive_dir, ARCHIVE_NAME)
+    record = finder.catalog().by_uid("PLAN1")
+
+    assert PlanRecord.from_dict(record.to_dict()).to_dict() == record.to_dict()
+    assert record.load_image()["data"].shape == (32, 24, 10)
+    assert np.isfinite(record.load_dose()["data"]).all()
+    assert record.load_sinogram()["plan_label"] == "Plan One"
+
+
+def test_catalog_is_cached(fresh_archive_dir):
+    cold = PatientArchive(fresh_archive_dir, ARCHIVE_NAME, cache=True)
+    expected = [record.to_dict() for record in PlanFinder(fresh_archive_dir, ARCHIVE_NAME, archive=cold).catalog()]
+
+    warm = PatientArchive(fresh_archive_dir, ARCHIVE_NAME, cache=True)
+    catalog = PlanFinder(fresh_archive_dir, ARCHIVE_NAME, archive=warm).catalog()
+    assert [record.to_dict() for record in catalog] == expected
+    assert warm._tree is None
+
+
+def test_full_plan_node_at_the_document_root():
+    root = etree.fromstring("<briefPlan/>")
+    assert full_plan_node(root) is None
+    plan = etree.fromstring("<plan><briefPlan/></plan>")
+    assert full_plan_node(plan[0]) is None
+    container = etree.fromstring("<fullPlanDataArray><plan><briefPlan/></plan></fullPlanDataArray>")
+    assert full_plan_node(container[0][0]) is container
+
+
+def test_catalog_skips_plans_at_the_document_root(tmp_path):
+    (tmp_path / "root.xml").write_text("<plan><briefPlan><dbInfo><databaseUID>P</databaseUID></dbInfo></briefPlan></plan>")
+    assert len(PlanFinder(str(tmp_path), "root.xml").catalog()) == 0
+
+
+def test_find_plan_does_not_import_matplotlib():
+    code = "import sys, find_plan; sys.exit('matplotlib' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(find_plan.__file__)).returncode == 0
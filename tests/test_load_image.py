@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+from conftest import ARCHIVE_NAME, CT_DIMENSIONS
+from load_image import LoadImage, hu_slab, hu_slice
+from patient_archive import PatientArchive
+
+
+def rewrite_archive(directory, old, new):
+    path = os.path.join(directory, ARCHIVE_NAME)
+    with open(path) as f:
+        xml = f.read()
+    with open(path, "w") as f:
+        f.write(xml.replace(old, new, 1))
+
+
+def load_metadata(directory, streaming=False):
+    archive = PatientArchive(directory, ARCHIVE_NAME, streaming=streaming)
+    loader = LoadImage(directory, ARCHIVE_NAME, "PLAN1", archive=archive)
+    loader.parse_xml()
+    return loader.image
+
+
+def test_rescale_defaults(archive_dir):
+    image = load_metadata(archive_dir)
+    assert (image["rescale_slope"], image["rescale_intercept"]) == (1, -1024)
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_rescale_falls_back_to_the_document(fresh_archive_dir, streaming):
+    rewrite_archive(
+        fresh_archive_dir, "<WindowCenter>",
+        "<RescaleSlope>2</RescaleSlope><RescaleIntercept>-1000</RescaleIntercept><WindowCenter>",
+    )
+    image = load_metadata(fresh_archive_dir, streaming)
+    assert (image["rescale_slope"], image["rescale_intercept"]) == (2, -1000)
+
+
+def test_rescale_prefers_the_image(fresh_archive_dir):
+    rewrite_archive(fresh_archive_dir, "<WindowCenter>", "<RescaleSlope>2</RescaleSlope><WindowCenter>")
+    rewrite_archive(fresh_archive_dir, "<imageType>KVCT</imageType>", "<imageType>KVCT</imageType><RescaleSlope>3</RescaleSlope>")
+    assert load_metadata(fresh_archive_dir)["rescale_slope"] == 3
+
+
+def test_memmap_volume_matches_the_eager_volume(archive_dir):
+    eager = LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1").load_image()
+    mapped = LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1", memmap=True).load_image()
+
+    assert isinstance(mapped["data"], np.memmap) and mapped["data"].dtype == np.uint16
+    assert mapped["data_is_raw"] and not eager.get("data_is_raw")
+    assert mapped["data"].shape == eager["data"].shape == CT_DIMENSIONS
+    np.testing.assert_array_equal(hu_slab(mapped, 0, CT_DIMENSIONS[2]), eager["data"])
+    np.testing.assert_array_equal(hu_slab(mapped, 3, 6), eager["data"][:, :, 3:6])
+    np.testing.assert_array_equal(hu_slice(mapped, 4), eager["data"][:, :, 4])
+    assert hu_slab(mapped, 3, 6).dtype == np.float32
+
+
+def test_hu_slab_of_an_eager_volume_is_a_view(archive_dir):
+    eager = LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1").load_image()
+    assert np.shares_memory(hu_slab(eager, 2, 5), eager["data"])
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from conftest import ARCHIVE_NAME
+from load_plan import NUM_LEAVES, PlanLoader
+
+
+def write_sinogram(path, rows, seed):
+    data = np.random.RandomState(seed).rand(rows, NUM_LEAVES)
+    data.tofile(path)
+    return data
+
+
+@pytest.fixture
+def sinograms(tmp_path):
+    first = write_sinogram(tmp_path / "a.bin", 30, 2)
+    second = write_sinogram(tmp_path / "b.bin", 30, 3)
+    return [str(tmp_path / "a.bin"), str(tmp_path / "b.bin")], np.hstack([first, second])
+
+
+def loader(archive_dir, memmap=False):
+    return PlanLoader(archive_dir, ARCHIVE_NAME, "PLAN1", memmap=memmap)
+
+
+def test_load_plan_reads_the_sinogram(archive_dir):
+    plan_data = loader(archive_dir).load_plan()
+    expected = np.fromfile(os.path.join(archive_dir, "sino.bin")).reshape(-1, NUM_LEAVES)
+
+    assert plan_data["plan_label"] == "Plan One"
+    np.testing.assert_array_equal(plan_data["machine_agnostic_sinogram"], expected)
+
+
+def test_preallocated_read_matches_hstack(archive_dir, sinograms):
+    file_paths, expected = sinograms
+    sinogram = loader(archive_dir).read_sinogram(file_paths)
+
+    assert sinogram.dtype == np.float64 and sinogram.flags.c_contiguous
+    np.testing.assert_array_equal(sinogram, expected)
+    np.testing.assert_array_equal(loader(archive_dir).read_sinogram(file_paths[:1]), expected[:, :NUM_LEAVES])
+
+
+def test_memmap_read(archive_dir, sinograms):
+    file_paths, expected = sinograms
+
+    mapped = loader(archive_dir, memmap=True).read_sinogram(file_paths[:1])
+    assert isinstance(mapped, np.memmap)
+    np.testing.assert_array_equal(mapped, expected[:, :NUM_LEAVES])
+    # Several files cannot be mapped side by side and are read instead
+    np.testing.assert_array_equal(loader(archive_dir, memmap=True).read_sinogram(file_paths), expected)
+
+
+def test_trailing_partial_projection_is_trimmed(archive_dir, tmp_path):
+    data = write_sinogram(tmp_path / "c.bin", 10, 4)
+    with open(tmp_path / "c.bin", "ab") as f:
+        f.write(np.zeros(5).tobytes())
+
+    np.testing.assert_array_equal(loader(archive_dir).read_sinogram([str(tmp_path / "c.bin")]), data)
+
+
+def test_iter_projections(archive_dir, sinograms):
+    file_paths, expected = sinograms
+    plan_loader = loader(archive_dir)
+    plan_loader.sinogram_files["fluence"] = file_paths
+
+    blocks = list(plan_loader.iter_projections("fluence", chunk_size=8))
+    assert [start for start, _ in blocks] == [0, 8, 16, 24]
+    np.testing.assert_array_equal(np.vstack([block for _, block in blocks]), expected)
+    assert list(plan_loader.iter_projections("machine_agnostic")) == []
+
+
+def test_different_projection_counts_raise(archive_dir, sinograms, tmp_path):
+    file_paths, _ = sinograms
+    write_sinogram(tmp_path / "short.bin", 20, 5)
+    file_paths = [file_paths[0], str(tmp_path / "short.bin")]
+    plan_loader = loader(archive_dir)
+    plan_loader.sinogram_files["fluence"] = file_paths
+
+    with pytest.raises(ValueError, match="projection counts"):
+        plan_loader.read_sinogram(file_paths)
+    with pytest.raises(ValueError, match="projection counts"):
+        list(plan_loader.iter_projections("fluence"))
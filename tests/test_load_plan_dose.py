@@ -0,0 +1,30 @@
+import os
+import numpy as np
+from conftest import ARCHIVE_NAME, DOSE_DIMENSIONS
+from load_plan_dose import LoadPlanDose, dose_frame, dose_grid, dose_slab
+
+
+def file_grid(archive_dir):
+    return np.fromfile(os.path.join(archive_dir, "dose.img"), dtype=np.float32).reshape(DOSE_DIMENSIONS, order="F")
+
+
+def test_dose_grid_is_x_fastest(archive_dir):
+    dose = LoadPlanDose(archive_dir, ARCHIVE_NAME, "PLAN1").load_dose()
+
+    assert dose["frameOfReference"] == "FOR1"
+    assert dose["data"].shape == DOSE_DIMENSIONS
+    np.testing.assert_array_equal(dose_grid(dose), file_grid(archive_dir))
+    assert np.shares_memory(dose_grid(dose), dose["data"])
+
+
+def test_memmap_dose_matches_the_eager_dose(archive_dir):
+    eager = LoadPlanDose(archive_dir, ARCHIVE_NAME, "PLAN1").load_dose()
+    mapped = LoadPlanDose(archive_dir, ARCHIVE_NAME, "PLAN1", memmap=True).load_dose()
+    expected = file_grid(archive_dir)
+
+    assert isinstance(mapped["data"], np.memmap)
+    np.testing.assert_array_equal(mapped["data"], eager["data"])
+    np.testing.assert_array_equal(dose_slab(mapped, 1, 4), expected[:, :, 1:4])
+    np.testing.assert_array_equal(dose_frame(mapped, 2), expected[:, :, 2])
+    np.testing.assert_array_equal(dose_frame(eager, 4), expected[:, :, 4])
+    assert np.shares_memory(dose_slab(mapped, 1, 4), mapped["data"])
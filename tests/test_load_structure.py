@@ -0,0 +1,167 @@
+import gc
+import weakref
+import numpy as np
+import pytest
+from conftest import ARCHIVE_NAME
+from load_image import LoadImage
+from load_structure import (
+    LazyStructure, LoadStructures, contour_spans, contour_volume, parse_point_data, spans_to_mask
+)
+from mask_store import CompactMask
+
+
+def square(x0, y0, x1, y1, z):
+    return np.array([[x0, y0, z], [x1, y0, z], [x1, y1, z], [x0, y1, z]], dtype=np.float64)
+
+
+# 20 x 20 x 4 grid with 1 cm voxels and the first voxel center at the origin
+START, WIDTH, DIMENSIONS = [0.0, 0.0, 0.0], [1.0, 1.0, 1.0], [20, 20, 4]
+
+
+def test_square_fills_pixel_centers_inside():
+    mask = spans_to_mask(contour_spans([square(1.5, 2.5, 7.5, 9.5, 1.0)], START, WIDTH, DIMENSIONS), DIMENSIONS)
+
+    expected = np.zeros(DIMENSIONS, dtype=bool)
+    expected[2:8, 3:10, 1] = True
+    np.testing.assert_array_equal(mask, expected)
+
+
+def test_nested_contour_is_a_hole():
+    contours = [square(1.5, 1.5, 10.5, 10.5, 2.0), square(3.5, 3.5, 6.5, 6.5, 2.0)]
+    mask = spans_to_mask(contour_spans(contours, START, WIDTH, DIMENSIONS), DIMENSIONS)
+
+    assert mask[:, :, 2].sum() == 9 * 9 - 3 * 3
+    assert not mask[5, 5, 2]
+    assert mask[2, 2, 2]
+    assert mask[:, :, [0, 1, 3]].sum() == 0
+
+
+def test_contours_outside_the_grid_are_clipped_or_skipped():
+    contours = [square(-5.5, -5.5, 2.5, 2.5, 0.0), square(1, 1, 5, 5, 10.0)]
+    mask = spans_to_mask(contour_spans(contours, START, WIDTH, DIMENSIONS), DIMENSIONS)
+
+    assert mask[:, :, 0].sum() == 3 * 3
+    assert mask[:, :, 1:].sum() == 0
+
+
+def test_compact_mask_matches_dense_mask():
+    contours = [square(1.5, 1.5, 10.5, 10.5, 2.0), square(3.5, 3.5, 6.5, 6.5, 2.0), square(12.2, 0.7, 18.9, 6.1, 3.0)]
+    spans = contour_spans(contours, START, WIDTH, DIMENSIONS)
+
+    dense = spans_to_mask(spans, DIMENSIONS)
+    compact = CompactMask.from_spans(spans, DIMENSIONS)
+    np.testing.assert_array_equal(compact.to_dense(), dense)
+    assert compact.voxel_count() == dense.sum()
+
+
+def make_loader(dimensions=DIMENSIONS, width=WIDTH, start=START):
+    image_data = {"dimensions": dimensions, "width": width, "start": start}
+    return LoadStructures("", "unused.xml", image_data, lazy_masks=False)
+
+
+def test_contour_volume_of_prism_is_area_times_thickness():
+    contours = [square(0, 0, 4, 2.5, z) for z in (0.0, 0.5, 1.0)]
+    assert contour_volume(contours, 0.5) == pytest.approx(3 * 4 * 2.5 * 0.5)
+
+
+def test_contour_volume_subtracts_holes_and_adds_islands():
+    contours = [square(0, 0, 10, 10, 0.0), square(2, 2, 6, 6, 0.0), square(3, 3, 5, 5, 0.0)]
+    assert contour_volume(contours, 1.0) == pytest.approx(100 - 16 + 4)
+
+    # Winding direction does not matter
+    contours = [square(0, 0, 10, 10, 0.0), square(2, 2, 6, 6, 0.0)[::-1]]
+    assert contour_volume(contours, 1.0) == pytest.approx(100 - 16)
+
+
+def test_contour_volume_matches_mask_volume_in_cm3():
+    loader = make_loader(dimensions=[40, 40, 6], width=[0.25, 0.25, 0.5])
+    contours = [square(1.125, 1.125, 6.125, 4.125, z) for z in (0.5, 1.0, 1.5, 2.0)]
+    contours += [square(2.125, 2.125, 3.125, 3.125, z) for z in (1.0, 1.5)]
+
+    mask_volume = loader.calculate_volume(loader.generate_mask(contours))
+    assert mask_volume == pytest.approx(4 * 5 * 3 * 0.5 - 2 * 1 * 1 * 0.5)
+    assert loader.calculate_contour_volume(contours) == pytest.approx(mask_volume)
+
+
+def test_parse_point_data():
+    points = parse_point_data("\n1.5,-2,3;\n4,5e-1,-6.25;\n")
+    np.testing.assert_array_equal(points, [[1.5, -2, 3], [4, 0.5, -6.25]])
+    assert parse_point_data(" \n ").shape == (0, 3)
+    with pytest.raises(ValueError):
+        parse_point_data("1,2,3;\n4,5;")
+    with pytest.raises(ValueError):
+        parse_point_data("1,2,x;")
+
+
+def write_curves(path, *point_data):
+    path.write_text("<curves>" + "".join(point_data) + "</curves>")
+    return str(path)
+
+
+def test_parse_curve_file_skips_only_malformed_curves(tmp_path):
+    file_path = write_curves(
+        tmp_path / "curves.xml",
+        '<pointData numDataPoints="2">0,0,1;\n1,0,1;</pointData>',
+        '<pointData numDataPoints="two">0,0,2;\n1,0,2;</pointData>',
+        '<pointData numDataPoints="2">0,0,3;\n1,0;</pointData>',
+        '<pointData numDataPoints="0">0,0,4;</pointData>',
+        '<pointData numDataPoints="1">0,0,5;</pointData>',
+    )
+    points = make_loader().parse_curve_file(file_path)
+
+    assert [contour[0, 2] for contour in points] == [1, 5]
+
+
+def test_parse_curve_file_of_a_broken_file(tmp_path):
+    (tmp_path / "broken.xml").write_text("<curves><pointData>")
+    assert make_loader().parse_curve_file(str(tmp_path / "broken.xml")) == []
+    assert make_loader().parse_curve_file(str(tmp_path / "missing.xml")) == []
+
+
+def lazy_structure(points, **kwargs):
+    return LazyStructure({"name": "ROI", "points": points}, START, WIDTH, DIMENSIONS, **kwargs)
+
+
+def test_lazy_structure_computes_mask_and_volume_on_access():
+    contours = [square(1.5, 2.5, 7.5, 9.5, 1.0)]
+    structure = lazy_structure(contours)
+
+    assert not dict.__contains__(structure, "mask")
+    expected = spans_to_mask(contour_spans(contours, START, WIDTH, DIMENSIONS), DIMENSIONS)
+    np.testing.assert_array_equal(structure["mask"], expected)
+    assert structure["volume"] == expected.sum()
+    assert structure.get("mask") is structure["mask"]
+    assert lazy_structure([], volume_method="contour")["volume"] == 0.0
+    assert lazy_structure([])["mask"] is None
+    assert isinstance(lazy_structure(contours, compact_masks=True)["mask"], CompactMask)
+    assert lazy_structure(contours, volume_method="contour")["volume"] == pytest.approx(6 * 7)
+
+
+def test_lazy_structure_views_agree_with_contains():
+    structure = lazy_structure([square(1.5, 2.5, 7.5, 9.5, 1.0)])
+
+    assert set(structure.keys()) == {"name", "points", "mask", "volume"}
+    assert list(structure) == list(structure.keys())
+    assert len(structure) == 4
+    assert all(key in structure for key in structure.keys())
+    assert "missing" not in structure and structure.get("missing", 1) == 1
+    items = dict(structure.items())
+    assert items["volume"] == 42 and list(structure.values())[-1] == 42
+    assert dict(structure) == items
+    assert len(structure) == 4
+
+
+def test_lazy_structure_does_not_reference_the_loader(archive_dir):
+    image = LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1").load_image()
+    eager = LoadStructures(archive_dir, ARCHIVE_NAME, image, lazy_masks=False).load_structures()
+    loader = LoadStructures(archive_dir, ARCHIVE_NAME, image)
+    structures = loader.load_structures()
+    references = [weakref.ref(loader), weakref.ref(loader.archive), weakref.ref(image["data"])]
+    del loader, image
+    gc.collect()
+
+    assert [reference() for reference in references] == [None, None, None]
+    assert all(isinstance(structure, LazyStructure) for structure in structures)
+    for lazy, dense in zip(structures, eager):
+        np.testing.assert_array_equal(lazy["mask"], dense["mask"])
+        assert lazy["volume"] == dense["volume"]
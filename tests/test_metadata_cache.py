@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import metadata_cache
+from conftest import ARCHIVE_NAME
+from metadata_cache import MetadataCache
+from tomo_extract import TomoExtract
+
+
+def test_entries_survive_reopening(fresh_archive_dir):
+    xml_file = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    cache = MetadataCache(xml_file)
+    cache.set("key", {"value": [1, 2]})
+    cache.close()
+
+    assert MetadataCache(xml_file).get("key") == {"value": [1, 2]}
+
+
+def test_changed_archive_drops_entries(fresh_archive_dir):
+    xml_file = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    cache = MetadataCache(xml_file)
+    cache.set("key", 1)
+    cache.close()
+
+    with open(xml_file, "a") as f:
+        f.write("\n<!-- changed -->")
+    assert MetadataCache(xml_file).get("key") is None
+
+
+def test_touched_but_unchanged_archive_keeps_entries(fresh_archive_dir):
+    xml_file = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    cache = MetadataCache(xml_file)
+    cache.set("key", 1)
+    cache.close()
+
+    os.utime(xml_file, ns=(1, 1))
+    assert MetadataCache(xml_file).get("key") == 1
+
+
+def test_other_cache_version_drops_entries(fresh_archive_dir, monkeypatch):
+    xml_file = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    cache = MetadataCache(xml_file)
+    cache.set("key", 1)
+    cache.close()
+
+    monkeypatch.setattr(metadata_cache, "CACHE_VERSION", metadata_cache.CACHE_VERSION + 1)
+    assert MetadataCache(xml_file).get("key") is None
+
+
+def test_unversioned_cache_is_upgraded_and_dropped(fresh_archive_dir):
+    xml_file = os.path.join(fresh_archive_dir, ARCHIVE_NAME)
+    stat = os.stat(xml_file)
+    conn = sqlite3.connect(xml_file + ".cache.sqlite")
+    conn.execute("CREATE TABLE archive (id INTEGER PRIMARY KEY CHECK (id = 1), size INTEGER, mtime INTEGER, sha256 TEXT)")
+    conn.execute("CREATE TABLE entries (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO archive VALUES (1, ?, ?, 'x')", (stat.st_size, stat.st_mtime_ns))
+    conn.execute("INSERT INTO entries VALUES ('key', '1')")
+    conn.commit()
+    conn.close()
+
+    cache = MetadataCache(xml_file)
+    assert cache.get("key") is None
+    cache.set("key", 2)
+    cache.close()
+    assert MetadataCache(xml_file).get("key") == 2
+
+
+def test_warm_cache_gives_the_same_metadata(fresh_archive_dir):
+    cold = TomoExtract(fresh_archive_dir, ARCHIVE_NAME, cache=True).load_plan_data("PLAN1")
+    warm_extract = TomoExtract(fresh_archive_dir, ARCHIVE_NAME, cache=True)
+    warm = warm_extract.load_plan_data("PLAN1")
+
+    assert warm_extract.archive._tree is None
+    assert {k: v for k, v in warm["image"].items() if k != "data"} == {k: v for k, v in cold["image"].items() if k != "data"}
+    assert [s["name"] for s in warm["structures"]] == [s["name"] for s in cold["structures"]]
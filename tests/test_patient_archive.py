@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+import patient_archive
+from conftest import ARCHIVE_NAME
+from find_plan import PlanFinder
+from load_image import LoadImage
+from load_plan import PlanLoader
+from load_plan_dose import LoadPlanDose
+from patient_archive import PatientArchive
+from tomo_extract import TomoExtract
+
+
+@pytest.fixture
+def parse_count(monkeypatch):
+    calls = []
+    parse = patient_archive.etree.parse
+
+    def counting_parse(source, *args, **kwargs):
+        # Curve files are parsed separately; only count the archive
+        if str(source).endswith(ARCHIVE_NAME):
+            calls.append(source)
+        return parse(source, *args, **kwargs)
+
+    monkeypatch.setattr(patient_archive.etree, "parse", counting_parse)
+    return calls
+
+
+def test_archive_is_parsed_once_per_export(archive_dir, parse_count):
+    extract = TomoExtract(archive_dir, ARCHIVE_NAME)
+
+    assert extract.find_approved_plans() == [("PLAN1", "Plan One")]
+    plan_data = extract.load_plan_data("PLAN1")
+
+    assert len(parse_count) == 1
+    assert set(plan_data) == {"image", "structures", "plan", "dose"}
+
+
+def test_loaders_share_the_given_archive(archive_dir, parse_count):
+    archive = PatientArchive(archive_dir, ARCHIVE_NAME)
+    loaders = [
+        LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1", archive=archive),
+        PlanLoader(archive_dir, ARCHIVE_NAME, "PLAN1", archive=archive),
+        LoadPlanDose(archive_dir, ARCHIVE_NAME, "PLAN1", archive=archive),
+    ]
+    assert all(loader.archive is archive for loader in loaders)
+    assert PlanFinder(archive_dir, ARCHIVE_NAME, archive=archive).root is archive.root
+
+    image = loaders[0].load_image()
+    loaders[1].load_plan()
+    loaders[2].load_dose()
+    assert len(parse_count) == 1
+
+    # Same result as a loader parsing the file on its own
+    standalone = LoadImage(archive_dir, ARCHIVE_NAME, "PLAN1").load_image()
+    assert len(parse_count) == 2
+    np.testing.assert_array_equal(standalone["data"], image["data"])
+    assert {k: v for k, v in standalone.items() if k != "data"} == {k: v for k, v in image.items() if k != "data"}
+
+
+def test_missing_archive_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PatientArchive(str(tmp_path), "missing.xml").tree
+
+
+def assert_plan_data_equal(actual, expected):
+    np.testing.assert_array_equal(actual["image"]["data"], expected["image"]["data"])
+    np.testing.assert_array_equal(actual["dose"]["data"], expected["dose"]["data"])
+    assert {k: v for k, v in actual["image"].items() if k != "data"} == {k: v for k, v in expected["image"].items() if k != "data"}
+    assert [s["name"] for s in actual["structures"]] == [s["name"] for s in expected["structures"]]
+    for a, b in zip(actual["structures"], expected["structures"]):
+        assert len(a["points"]) == len(b["points"])
+        for pa, pb in zip(a["points"], b["points"]):
+            np.testing.assert_array_equal(pa, pb)
+    assert set(actual["plan"]) == set(expected["plan"])
+    np.testing.assert_array_equal(
+        actual["plan"]["machine_agnostic_sinogram"], expected["plan"]["machine_agnostic_sinogram"]
+    )
+
+
+def test_streaming_parse_gives_the_same_plan_data(archive_dir):
+    full = TomoExtract(archive_dir, ARCHIVE_NAME).load_plan_data("PLAN1")
+    streamed = TomoExtract(archive_dir, ARCHIVE_NAME, streaming=True).load_plan_data("PLAN1")
+
+    assert_plan_data_equal(streamed, full)
+
+
+def test_streaming_parse_prunes_unused_subtrees(archive_dir):
+    full = PatientArchive(archive_dir, ARCHIVE_NAME)
+    streamed = PatientArchive(archive_dir, ARCHIVE_NAME, streaming=True)
+
+    # scanList is outside every kept subtree; graphicData is cleared inside a kept one
+    assert full.root.find(".//scanList") is not None
+    assert streamed.root.find(".//scanList") is None
+    assert full.root.findtext(".//graphicData").strip()
+    assert not (streamed.root.findtext(".//graphicData") or "").strip()
+
+    # Kept subtrees keep their full paths
+    for path in ("patient/briefPatient/patientName", "patient/fullPlanDataArray/fullPlanDataArray/plan/briefPlan",
+                 "patient/troiList/troiList/briefROI", "patient/legacyPlan/approvalStatus"):
+        assert len(streamed.root.findall(path)) == len(full.root.findall(path)) > 0
+    assert streamed.find_by_uid("IMG1")[0].tag == "image"
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_uid_parent_and_image_type_indexes(archive_dir, streaming):
+    archive = PatientArchive(archive_dir, ARCHIVE_NAME, streaming=streaming)
+
+    assert [node.tag for node in archive.find_by_uid("PLAN1")] == ["briefPlan"]
+    assert archive.find_by_uid("PLAN1", tag="image") == []
+    assert archive.find_by_uid("missing") == []
+    assert [node.tag for node in archive.find_children("PLAN1")] == ["image", "patientPlanTrial", "deliveryPlan"]
+    assert [node.findtext("name") for node in archive.find_children("SS1", tag="briefROI")] == ["Body", "PTV"]
+    assert [node.findtext("dbInfo/databaseUID") for node in archive.find_by_image_type("KVCT")] == ["IMG1"]
+    assert [node.tag for node in archive.find_by_image_type("Opt_Dose_After_EOP")] == ["doseVolumeList"]
+
+    # Same answers as a full document search
+    for uid in ("PLAN1", "IMG1", "ROI2", "TRIAL1", "DV1", "LEG1"):
+        expected = [info.getparent() for info in archive.root.iter("dbInfo") if info.findtext("databaseUID") == uid]
+        assert archive.find_by_uid(uid) == expected
@@ -0,0 +1,48 @@
+import os
+import prefetch
+from conftest import ARCHIVE_NAME
+from prefetch import BinaryPrefetcher
+from tomo_extract import TomoExtract
+
+
+def test_prefetch_reads_each_file_once(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(3000))
+
+    with BinaryPrefetcher(max_workers=2, chunk_size=1024) as prefetcher:
+        prefetcher.prefetch_all([str(path), str(path), str(tmp_path / "missing.bin"), None, ""])
+        assert list(prefetcher._futures) == [str(path)]
+        assert prefetcher._futures[str(path)].result() == 3000
+
+
+def test_shutdown_without_waiting(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"x" * 10)
+    prefetcher = BinaryPrefetcher(max_workers=1)
+    prefetcher.prefetch(str(path))
+    prefetcher.shutdown(wait=False)
+    assert prefetcher._executor._shutdown
+
+
+def test_export_prefetches_the_files_read_after_the_ct(archive_dir, monkeypatch):
+    submitted = []
+    original = BinaryPrefetcher.prefetch
+
+    def record(self, file_path):
+        submitted.append(os.path.basename(file_path))
+        original(self, file_path)
+
+    monkeypatch.setattr(prefetch.BinaryPrefetcher, "prefetch", record)
+    plan_data = TomoExtract(archive_dir, ARCHIVE_NAME).load_plan_data("PLAN1")
+
+    assert submitted == ["body.xml", "ptv.xml", "sino.bin", "dose.img"]
+    assert "ct.img" not in submitted
+    assert plan_data["dose"]["data"].size
+
+
+def test_prefetching_can_be_disabled(archive_dir, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("prefetcher created")
+
+    monkeypatch.setattr(prefetch.BinaryPrefetcher, "__init__", fail)
+    TomoExtract(archive_dir, ARCHIVE_NAME, prefetch_workers=0).load_plan_data("PLAN1")
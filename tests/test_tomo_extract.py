@@ -0,0 +1,130 @@
+import os
+import numpy as np
+import pydicom
+import pytest
+from conftest import ARCHIVE_NAME, build_archive
+from tomo_extract import TomoExtract
+from write_dicom_dose import write_dicom_dose
+from write_dicom_image import write_dicom_enhanced_image
+
+# Options whose exports must hold the same images, doses and contours as the default
+EQUIVALENT_OPTIONS = [
+    dict(memmap=True),
+    dict(streaming=True),
+    dict(cache=True),
+    dict(multiframe_ct=True),
+    dict(multiframe_ct=True, memmap=True),
+    dict(transfer_syntax="rle", encode_workers=1),
+    dict(transfer_syntax="deflate", multiframe_ct=True),
+    dict(transfer_syntax="rle", encode_workers=1, multiframe_ct=True, memmap=True),
+    dict(compact_masks=True, lazy_masks=False, volume_method="contour"),
+    dict(write_workers=1, prefetch_workers=0),
+    dict(deterministic_uids=False),
+]
+
+
+def export(archive_dir, export_path, **options):
+    TomoExtract(archive_dir, ARCHIVE_NAME, **options).export_dicom("PLAN1", str(export_path))
+    return str(export_path)
+
+
+def read_export(export_path):
+    """
+    Decoded content of an export: CT volume and dose grid as stored values times their
+    scaling, and the RTSTRUCT contours.
+    """
+    ct_files = sorted(os.listdir(os.path.join(export_path, "CT")))
+    ct = [pydicom.dcmread(os.path.join(export_path, "CT", name)) for name in ct_files]
+    if len(ct) == 1:
+        pixels = ct[0].pixel_array
+        transformation = ct[0].SharedFunctionalGroupsSequence[0].PixelValueTransformationSequence[0]
+    else:
+        pixels = np.stack([ds.pixel_array for ds in ct])
+        transformation = ct[0]
+    volume = pixels * float(transformation.RescaleSlope) + float(transformation.RescaleIntercept)
+
+    dose = pydicom.dcmread(os.path.join(export_path, "Dose", "RTDose.dcm"))
+    structure_set = pydicom.dcmread(os.path.join(export_path, "RTStruct", "RTStruct.dcm"))
+    plan = pydicom.dcmread(os.path.join(export_path, "RTPlan", "RTPlan.dcm"))
+    return {
+        "ct": ct,
+        "volume": volume,
+        "dose": dose,
+        "dose_grid": dose.pixel_array * float(dose.DoseGridScaling),
+        "structure_set": structure_set,
+        "contours": [
+            [list(contour.ContourData) for contour in roi.ContourSequence]
+            for roi in structure_set.ROIContourSequence
+        ],
+        "plan": plan,
+    }
+
+
+@pytest.fixture(scope="module")
+def reference(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("reference"))
+    build_archive(directory)
+    return read_export(export(directory, os.path.join(directory, "export")))
+
+
+def test_default_export(reference):
+    assert len(reference["ct"]) == 10
+    assert reference["volume"].shape == (10, 24, 32)
+    assert [len(contours) for contours in reference["contours"]] == [12, 3]
+    assert reference["dose"].Modality == "RTDOSE"
+    assert reference["plan"].SOPClassUID == "1.2.840.10008.5.1.4.1.1.481.5"
+    assert reference["structure_set"].StructureSetROISequence[1].ROIName == "PTV"
+
+
+@pytest.mark.parametrize("options", EQUIVALENT_OPTIONS, ids=lambda options: ",".join(f"{k}={v}" for k, v in options.items()))
+def test_options_give_the_same_objects(fresh_archive_dir, reference, options):
+    result = read_export(export(fresh_archive_dir, os.path.join(fresh_archive_dir, "export"), **options))
+
+    np.testing.assert_array_equal(result["volume"], reference["volume"])
+    np.testing.assert_allclose(result["dose_grid"], reference["dose_grid"])
+    assert result["contours"] == reference["contours"]
+    assert result["plan"].RTPlanLabel == reference["plan"].RTPlanLabel
+
+
+def test_uids_are_stable_and_shared(fresh_archive_dir, reference):
+    default = read_export(export(fresh_archive_dir, os.path.join(fresh_archive_dir, "default")))
+    mapped = read_export(export(fresh_archive_dir, os.path.join(fresh_archive_dir, "memmap"), memmap=True))
+
+    for key in ("dose", "structure_set", "plan"):
+        assert default[key].SOPInstanceUID == reference[key].SOPInstanceUID
+    assert default["ct"][0].StudyInstanceUID == mapped["ct"][0].StudyInstanceUID
+    assert default["ct"][0].FrameOfReferenceUID == mapped["ct"][0].FrameOfReferenceUID
+    # Raw memmapped slices are stored differently, so they get their own SOP Instance UIDs
+    assert default["ct"][0].SOPInstanceUID != mapped["ct"][0].SOPInstanceUID
+
+
+def test_memmap_and_eager_loads_are_equal(archive_dir):
+    eager = TomoExtract(archive_dir, ARCHIVE_NAME).load_plan_data("PLAN1")
+    mapped = TomoExtract(archive_dir, ARCHIVE_NAME, memmap=True).load_plan_data("PLAN1")
+
+    image = mapped["image"]
+    hu = image["data"].astype(np.float32) * image["rescale_slope"] + image["rescale_intercept"]
+    np.testing.assert_array_equal(hu, eager["image"]["data"])
+    np.testing.assert_array_equal(mapped["dose"]["data"], eager["dose"]["data"])
+    np.testing.assert_array_equal(
+        mapped["plan"]["machine_agnostic_sinogram"], eager["plan"]["machine_agnostic_sinogram"]
+    )
+
+
+def test_streamed_and_full_pixel_data_are_identical(archive_dir, tmp_path):
+    plan_data = TomoExtract(archive_dir, ARCHIVE_NAME).load_plan_data("PLAN1")
+    for stream_pixels in (True, False):
+        write_dicom_enhanced_image(
+            plan_data["image"], str(tmp_path / f"ct_{stream_pixels}.dcm"), {},
+            stream_pixels=stream_pixels, chunk_size=2000,
+        )
+        write_dicom_dose(
+            plan_data["dose"], str(tmp_path / f"dose_{stream_pixels}.dcm"), plan_data["image"],
+            stream_pixels=stream_pixels, chunk_size=2000,
+        )
+
+    for name in ("ct", "dose"):
+        streamed = pydicom.dcmread(tmp_path / f"{name}_True.dcm")
+        full = pydicom.dcmread(tmp_path / f"{name}_False.dcm")
+        assert streamed.PixelData == full.PixelData
+        assert streamed.get("DoseGridScaling") == full.get("DoseGridScaling")
@@ -0,0 +1,60 @@
+import numpy as np
+import pydicom
+import pytest
+from write_dicom_dose import DoseQuantizer, write_dicom_dose
+
+
+def make_dose_data(shape=(6, 5, 4)):
+    rng = np.random.default_rng(1)
+    data = rng.uniform(0, 60, size=shape).astype(np.float32)
+    data[0, 0, 0] = np.nan
+    data[1, 0, 0] = np.inf
+    data[2, 0, 0] = -5.0
+    return {"data": data, "start": [-1.0, -2.0, -3.0], "width": [0.4, 0.4, 0.5]}
+
+
+def reference_quantization(data):
+    # Former full-grid scaling
+    data = np.nan_to_num(data, nan=0, posinf=0, neginf=0)
+    scaling = np.max(data) / 65535
+    return scaling, np.clip(data / scaling, 0, 65535).astype(np.uint16)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64, 1 << 20])
+def test_quantizer_matches_full_grid_scaling(chunk_size):
+    data = make_dose_data()["data"]
+    original = data.copy()
+    frame_size = data.shape[0] * data.shape[1]
+    scaling, expected = reference_quantization(data)
+
+    quantizer = DoseQuantizer(data, frame_size, chunk_size)
+    assert quantizer.max_dose == pytest.approx(np.nanmax(np.where(np.isfinite(data), data, np.nan)))
+    streamed = np.concatenate([block.copy() for block in quantizer.blocks(scaling)])
+    out = np.empty(data.size, dtype=np.uint16)
+    for _ in DoseQuantizer(data, frame_size, chunk_size).blocks(scaling, out=out):
+        pass
+
+    np.testing.assert_array_equal(streamed, expected.reshape(-1))
+    np.testing.assert_array_equal(out, expected.reshape(-1))
+    np.testing.assert_array_equal(data, original)
+
+    report = quantizer.report()
+    assert report["non_finite"] == 2
+    # Truncation error is below one step, except for the clipped negative dose
+    assert report["max_error"] == pytest.approx(5.0)
+    assert report["rms_error"] > 0
+
+
+@pytest.mark.parametrize("stream_pixels", [True, False])
+def test_written_dose_round_trips(tmp_path, stream_pixels):
+    dose_data = make_dose_data()
+    original = dose_data["data"].copy()
+    output_path = str(tmp_path / "RTDose.dcm")
+
+    write_dicom_dose(dose_data, output_path, stream_pixels=stream_pixels, chunk_size=64)
+
+    ds = pydicom.dcmread(output_path)
+    scaling, expected = reference_quantization(original)
+    assert float(ds.DoseGridScaling) == pytest.approx(scaling)
+    np.testing.assert_array_equal(ds.pixel_array.reshape(-1), expected.reshape(-1))
+    np.testing.assert_array_equal(dose_data["data"], original)
@@ -0,0 +1,158 @@
+import numpy as np
+import pydicom
+import pytest
+import write_dicom_image as write_dicom_image_module
+from export_uids import ExportUIDs
+from write_dicom_image import (
+    reorient_volume, reoriented_chunks, reoriented_slabs, write_dicom_enhanced_image, write_dicom_image
+)
+
+
+def make_volume(shape=(7, 5, 4)):
+    # Non-square slices catch swapped rows and columns
+    rng = np.random.default_rng(0)
+    return rng.integers(-1024, 2000, size=shape).astype(np.float64)
+
+
+def reference_slices(data, offset):
+    # Former per-slice conversion: rotate, flip and cast each slice
+    return np.stack([
+        np.flip(np.rot90(data[:, :, i] + offset, 3), 1).astype(np.uint16)
+        for i in range(data.shape[2])
+    ])
+
+
+def test_reorient_volume_matches_per_slice_rotation():
+    data = make_volume()
+    original = data.copy()
+
+    pixel_volume = reorient_volume(data, 1024)
+
+    assert pixel_volume.dtype == np.uint16
+    assert pixel_volume.shape == (4, 5, 7)
+    assert pixel_volume.flags.c_contiguous
+    np.testing.assert_array_equal(pixel_volume, reference_slices(original, 1024))
+    np.testing.assert_array_equal(data, original)
+
+
+def test_reoriented_chunks_match_whole_volume():
+    data = make_volume()
+    expected = reorient_volume(data, 1024).tobytes()
+
+    # One slice is 70 bytes: chunks of one, two and all slices
+    for chunk_size in (1, 150, 1 << 20):
+        streamed = b"".join(bytes(chunk) for chunk in reoriented_chunks(data, 1024, chunk_size))
+        assert streamed == expected
+
+
+def make_image(data, **extra):
+    return dict(data=data, start=[-1.0, -2.0, -3.0], width=[0.5, 0.25, 0.3], dimensions=list(data.shape), **extra)
+
+
+def read_series(directory):
+    paths = sorted(directory.glob("CT_*.dcm"))
+    return [pydicom.dcmread(path) for path in paths]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_template_clone_writes_one_file_per_slice(tmp_path, workers):
+    data = make_volume()
+    metadata = {"patientName": "DOE^JANE", "patientID": "123"}
+
+    sop_uids = write_dicom_image(make_image(data), str(tmp_path / "CT"), metadata, workers=workers)
+    series = read_series(tmp_path)
+
+    assert [ds.SOPInstanceUID for ds in series] == sop_uids
+    assert len(set(sop_uids)) == len(series) == data.shape[2]
+    expected = reference_slices(data, 1024)
+    for i, ds in enumerate(series):
+        assert ds.InstanceNumber == i + 1
+        assert ds.file_meta.MediaStorageSOPClassUID == "1.2.840.10008.5.1.4.1.1.2"
+        assert (ds.Rows, ds.Columns) == (5, 7)
+        assert [float(v) for v in ds.ImagePositionPatient] == pytest.approx([-10.0, -20.0, -30.0 + 3.0 * i])
+        assert [float(v) for v in ds.PixelSpacing] == pytest.approx([5.0, 2.5])
+        assert ds.RescaleIntercept == -1024 and ds.RescaleSlope == 1
+        np.testing.assert_array_equal(ds.pixel_array, expected[i])
+    # Shared header elements are identical on every slice
+    for keyword in ("StudyInstanceUID", "SeriesInstanceUID", "FrameOfReferenceUID", "PatientName", "InstanceCreationDate"):
+        assert len({str(getattr(ds, keyword)) for ds in series}) == 1
+
+
+def test_template_clone_keeps_raw_values_and_rescale(tmp_path):
+    raw = np.asfortranarray(make_volume() + 1024).astype(np.uint16)
+    image = make_image(raw, data_is_raw=True, rescale_slope=2.0, rescale_intercept=-1000.0)
+
+    write_dicom_image(image, str(tmp_path / "CT"), {}, workers=2)
+    series = read_series(tmp_path)
+
+    assert (series[0].RescaleSlope, series[0].RescaleIntercept) == (2, -1000)
+    for i, ds in enumerate(series):
+        np.testing.assert_array_equal(ds.pixel_array, raw[:, :, i].T)
+
+
+def test_template_clone_with_deterministic_uids(tmp_path):
+    data = make_volume()
+    first = write_dicom_image(make_image(data), str(tmp_path / "a"), {}, uids=ExportUIDs("PLAN", "IMAGE"))
+    second = write_dicom_image(make_image(data), str(tmp_path / "b"), {}, uids=ExportUIDs("PLAN", "IMAGE"))
+    assert first == second
+
+
+def test_reoriented_slabs_cover_the_volume():
+    data = make_volume()
+    expected = reorient_volume(data, 1024)
+    slabs = [slab.copy() for slab in reoriented_slabs(data, 1024, 150)]
+
+    assert [len(slab) for slab in slabs] == [2, 2]
+    np.testing.assert_array_equal(np.concatenate(slabs), expected)
+
+
+def memmapped_raw_image(tmp_path):
+    raw = np.asfortranarray(make_volume() + 1024).astype(np.uint16)
+    raw.ravel(order="F").tofile(tmp_path / "ct.img")
+    mapped = np.memmap(tmp_path / "ct.img", dtype=np.uint16, mode="r", shape=raw.shape, order="F")
+    return raw, make_image(mapped, data_is_raw=True)
+
+
+@pytest.mark.parametrize("transfer_syntax", ["implicit", "rle"])
+def test_memmapped_volume_is_reoriented_slice_by_slice(tmp_path, monkeypatch, transfer_syntax):
+    raw, image = memmapped_raw_image(tmp_path)
+    shapes = []
+    original = write_dicom_image_module.reorient_volume
+
+    def recording(data, offset=0):
+        shapes.append(data.shape)
+        return original(data, offset)
+
+    monkeypatch.setattr(write_dicom_image_module, "reorient_volume", recording)
+    write_dicom_image(image, str(tmp_path / "CT"), {}, workers=2, transfer_syntax=transfer_syntax, encode_workers=1)
+
+    assert raw.shape not in shapes
+    for i, ds in enumerate(read_series(tmp_path)):
+        np.testing.assert_array_equal(ds.pixel_array, raw[:, :, i].T)
+
+
+@pytest.mark.parametrize("transfer_syntax", ["rle", "deflate"])
+def test_memmapped_enhanced_image_matches_the_series(tmp_path, transfer_syntax):
+    raw, image = memmapped_raw_image(tmp_path)
+
+    write_dicom_enhanced_image(image, str(tmp_path / "enhanced.dcm"), {}, transfer_syntax=transfer_syntax, encode_workers=1)
+    ds = pydicom.dcmread(tmp_path / "enhanced.dcm")
+
+    np.testing.assert_array_equal(ds.pixel_array, raw.transpose(2, 1, 0))
+
+
+def test_enhanced_image_has_the_type_1_attributes(tmp_path):
+    data = make_volume()
+    write_dicom_enhanced_image(make_image(data), str(tmp_path / "enhanced.dcm"), {"Manufacturer": "ACME"})
+    ds = pydicom.dcmread(tmp_path / "enhanced.dcm")
+
+    assert ds.Manufacturer == "ACME"
+    assert ds.ManufacturerModelName and ds.DeviceSerialNumber and ds.SoftwareVersions
+    assert "PositionReferenceIndicator" in ds
+    frame_type = ds.SharedFunctionalGroupsSequence[0].CTImageFrameTypeSequence[0]
+    for item in (ds, frame_type):
+        assert item.PixelPresentation == "MONOCHROME"
+        assert item.VolumetricProperties == "VOLUME"
+        assert item.VolumeBasedCalculationTechnique == "NONE"
+    assert ds.NumberOfFrames == data.shape[2]
+    np.testing.assert_array_equal(ds.pixel_array, reference_slices(data, 1024))
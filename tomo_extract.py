@@ -4,22 +4,87 @@ from load_structure import LoadStructures
 from load_plan_dose import LoadPlanDose
 from load_plan import PlanLoader
 from find_plan import PlanFinder
+from patient_archive import PatientArchive
+from prefetch import BinaryPrefetcher
+from export_target import open_bundle
+from export_manifest import ExportManifest
+from export_uids import ExportUIDs
+from dvh import compute_dvhs
 from write_dicom_tomo_plan import write_dicom_tomo_plan
 from write_dicom_structure import write_dicom_structures
-from write_dicom_image import write_dicom_image
+from write_dicom_image import write_dicom_image, write_dicom_enhanced_image
 from write_dicom_dose import write_dicom_dose
 
 class TomoExtract:
-    def __init__(self, xml_path, xml_name):
+    def __init__(self, xml_path, xml_name, streaming=False, cache=False, cache_dir=None, memmap=False,
+                 prefetch_workers=4, compact_masks=False, lazy_masks=True,
+                 volume_method="mask", contour_tolerance=None, write_workers=4,
+                 multiframe_ct=False, transfer_syntax="implicit", encode_workers=None,
+                 bundle=None, compress_workers=1, deterministic_uids=True, incremental=False):
         """
         Initialize the TomoExtract class.
 
         Args:
             xml_path (str): Path to the directory containing the XML file.
             xml_name (str): Name of the XML file.
+            streaming (bool): Parse the archive with the streaming reader, which keeps only
+                              the subtrees the loaders need (for very large archives).
+            cache (bool): Keep extracted metadata in a persistent cache next to the archive
+                          (or in cache_dir) so re-exports skip XML parsing.
+            cache_dir (str, optional): Directory for the metadata cache.
+            memmap (bool): Memory-map binary volumes instead of reading them into RAM.
+            prefetch_workers (int): Threads reading referenced binaries ahead of the loaders;
+                                    0 disables prefetching.
+            compact_masks (bool): Store structure masks as bit-packed CompactMask objects.
+            lazy_masks (bool): Rasterize structure masks only when "mask" or "volume" is
+                               read, so a DICOM export never builds them.
+            volume_method (str): "mask" counts mask voxels for structure volumes, "contour"
+                                 integrates the contour areas without building a mask.
+            contour_tolerance (float, optional): Simplify RTSTRUCT contours so no removed
+                                                 point deviates more than this (mm).
+            write_workers (int): Threads encoding and writing CT slices.
+            multiframe_ct (bool): Write the CT as one Enhanced CT multi-frame file (CT/CT.dcm)
+                                  instead of one file per slice.
+            transfer_syntax (str): Transfer syntax of the CT and dose files: "implicit"
+                                   (uncompressed), "rle" (RLE Lossless) or "deflate".
+            encode_workers (int, optional): Processes for RLE encoding; defaults to the CPU count.
+            bundle (str, optional): Export each plan as one "zip", "tar" or "tar.gz" file
+                                    instead of loose directories.
+            compress_workers (int): Threads compressing a tar.gz bundle.
+            deterministic_uids (bool): Derive every UID from the archive databaseUIDs (and slice
+                                       number), so re-exports give the same UIDs; False
+                                       generates random UIDs.
+            incremental (bool): Keep a manifest.json of written objects in each export directory
+                                and skip objects that are already up to date, so repeated and
+                                interrupted exports only write what is missing. Needs
+                                deterministic UIDs and a directory export.
         """
+        if incremental and not deterministic_uids:
+            raise ValueError("Incremental export requires deterministic UIDs")
+        if incremental and bundle:
+            raise ValueError("Incremental export is only supported for directory exports, not bundles")
+
         self.xml_path = xml_path
         self.xml_name = xml_name
+        self.memmap = memmap
+        self.prefetch_workers = prefetch_workers
+        self.compact_masks = compact_masks
+        self.lazy_masks = lazy_masks
+        self.volume_method = volume_method
+        self.contour_tolerance = contour_tolerance
+        self.write_workers = write_workers
+        self.multiframe_ct = multiframe_ct
+        self.transfer_syntax = transfer_syntax
+        self.encode_workers = encode_workers
+        self.bundle = bundle
+        self.compress_workers = compress_workers
+        self.deterministic_uids = deterministic_uids
+        self.incremental = incremental
+
+        # Shared archive so the patient XML is parsed only once per export
+        self.archive = PatientArchive(
+            xml_path, xml_name, streaming=streaming, cache=cache, cache_dir=cache_dir
+        )
 
     def find_approved_plans(self, plan_type=None):
         """
@@ -31,9 +96,19 @@ class TomoExtract:
         Returns:
             list: A list of approved plan UIDs and labels.
         """
-        finder = PlanFinder(self.xml_path, self.xml_name)
+        finder = PlanFinder(self.xml_path, self.xml_name, archive=self.archive)
         return finder.find_plans(plan_type)
 
+    def plan_catalog(self):
+        """
+        List every plan in the archive as lazily loading PlanRecord objects.
+
+        Returns:
+            PlanCatalog: All plans of the archive.
+        """
+        finder = PlanFinder(self.xml_path, self.xml_name, archive=self.archive)
+        return finder.catalog()
+
     def load_plan_data(self, plan_uid):
         """
         Load all relevant plan data for a given UID.
@@ -44,21 +119,40 @@ class TomoExtract:
         Returns:
             dict: A dictionary containing image, structure, plan, and dose data.
         """
-        # Load image data
-        image_loader = LoadImage(self.xml_path, self.xml_name, plan_uid)
-        image_data = image_loader.load_image()
+        image_loader = LoadImage(self.xml_path, self.xml_name, plan_uid, archive=self.archive, memmap=self.memmap)
+        plan_loader = PlanLoader(self.xml_path, self.xml_name, plan_uid, archive=self.archive, memmap=self.memmap)
+        dose_loader = LoadPlanDose(self.xml_path, self.xml_name, plan_uid, archive=self.archive, memmap=self.memmap)
 
-        # Load structure data
-        structure_loader = LoadStructures(self.xml_path, self.xml_name, image_data)
-        structure_data = structure_loader.load_structures()
+        prefetcher = BinaryPrefetcher(self.prefetch_workers) if self.prefetch_workers else None
+        try:
+            # Image metadata first: the structure set depends on it. The CT is read next
+            # on this thread, so only the files read after it are prefetched
+            image_loader.parse_xml()
+            structure_loader = LoadStructures(
+                self.xml_path, self.xml_name, image_loader.image, archive=self.archive,
+                compact_masks=self.compact_masks, lazy_masks=self.lazy_masks,
+                volume_method=self.volume_method
+            )
 
-        # Load plan data
-        plan_loader = PlanLoader(self.xml_path, self.xml_name, plan_uid)
-        plan_data = plan_loader.load_plan()
+            # Each remaining binary is submitted as soon as its loader's metadata is
+            # extracted, so the reads overlap the rest of the XML work
+            if prefetcher is not None:
+                prefetcher.prefetch_all(self._referenced_binaries(structure_loader, plan_loader, dose_loader))
 
-        # Load dose data
-        dose_loader = LoadPlanDose(self.xml_path, self.xml_name, plan_uid)
-        dose_data = dose_loader.load_dose()
+            # Load image data
+            image_data = image_loader.load_binary_data()
+
+            # Load structure data
+            structure_data = structure_loader.load_structures()
+
+            # Load plan data
+            plan_data = plan_loader.load_plan()
+
+            # Load dose data
+            dose_data = dose_loader.load_dose()
+        finally:
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=False)
 
         return {
             "image": image_data,
@@ -66,56 +160,219 @@ class TomoExtract:
             "plan": plan_data,
             "dose": dose_data
         }
+
+    def _referenced_binaries(self, structure_loader, plan_loader, dose_loader):
+        """
+        Yield the binary files the structure, plan and dose loaders will read, in load order.
+
+        Each loader's metadata is extracted (and memoized by the archive) only when its
+        files are requested, so a consumer can start on the curve files before the plan
+        and dose metadata are parsed. A missing plan or dose is left for the loaders
+        themselves to report.
+
+        Yields:
+            str: Full paths of curve, sinogram and dose files.
+        """
+        for roi in structure_loader.cached_metadata():
+            if roi["filename"]:
+                yield os.path.join(self.xml_path, roi["filename"])
+
+        plan_metadata = plan_loader.cached_metadata()
+        for filename in plan_metadata["fluence_files"] + plan_metadata["machine_agnostic_files"]:
+            yield os.path.join(self.xml_path, filename)
+
+        try:
+            dose_metadata = dose_loader.cached_metadata()
+        except ValueError:
+            return
+        yield os.path.join(self.xml_path, dose_metadata["filename"])
+
+    def compute_dvhs(self, plan_uid, plan_data=None, bin_width=0.01, dose_levels=(), volume_levels=()):
+        """
+        Compute the DVHs of every ROI of a plan (see dvh.compute_dvhs).
+
+        Args:
+            plan_uid (str): UID of the plan.
+            plan_data (dict, optional): Result of load_plan_data, to avoid loading the plan again.
+            bin_width (float): Dose bin width in Gy.
+            dose_levels (sequence): Doses in Gy for V metrics.
+            volume_levels (sequence): Percent volumes for D metrics.
+
+        Returns:
+            dict: Cumulative and differential DVHs and the metrics structured array.
+        """
+        if plan_data is None:
+            plan_data = self.load_plan_data(plan_uid)
+        return compute_dvhs(
+            plan_data["dose"], plan_data["structures"],
+            bin_width=bin_width, dose_levels=dose_levels, volume_levels=volume_levels
+        )
+
     def export_dicom(self, plan_uid, export_path):
         """
         Export the loaded plan data to DICOM format.
 
+        In incremental mode, objects recorded as up to date in the export manifest are
+        skipped, and the plan is not even loaded when nothing needs to be written.
+
         Args:
             plan_uid (str): UID of the plan to export.
-            export_path (str): Path to save the DICOM files.
+            export_path (str): Path to save the DICOM files. With a bundle format set, the
+                               bundle is written to export_path plus its extension.
         """
+        groups = ["RTPlan", "RTStruct", "CT", "Dose"]
+        manifest = None
+        if self.incremental:
+            os.makedirs(export_path, exist_ok=True)
+            manifest = ExportManifest(export_path, self._export_fingerprint(plan_uid))
+            groups = [group for group in groups if not manifest.is_current(group)]
+            if not groups:
+                print(f"Plan {plan_uid} is up to date in {export_path}")
+                return
+
         plan_data = self.load_plan_data(plan_uid)
+        uids = None
+        if self.deterministic_uids:
+            image_uid = plan_data["image"].get("databaseUID")
+            if not image_uid:
+                print(f"Warning: the image of plan {plan_uid} has no databaseUID; its study, frame of "
+                      f"reference and CT UIDs are derived from the plan UID instead")
+            uids = ExportUIDs(plan_uid, image_uid, self._uid_variants())
+
+        # Stream every object into one bundle, or write loose files under export_path
+        target = open_bundle(export_path, self.bundle, self.compress_workers) if self.bundle else None
+        base_path = "" if target is not None else export_path
 
         # Create directories for DICOM files
-        rtplan_path = os.path.join(export_path, "RTPlan")
-        rtstruct_path = os.path.join(export_path, "RTStruct")
-        ct_path = os.path.join(export_path, "CT")
-        dose_path = os.path.join(export_path, "Dose")
-
-        os.makedirs(rtplan_path, exist_ok=True)
-        os.makedirs(rtstruct_path, exist_ok=True)
-        os.makedirs(ct_path, exist_ok=True)
-        os.makedirs(dose_path, exist_ok=True)
-
-        # Export RT Plan
-        rtplan_file = os.path.join(rtplan_path, "RTPlan.dcm")
-        write_dicom_tomo_plan(plan_data["plan"], rtplan_file)
-
-        # Export RT Structures
-        rtstruct_file = os.path.join(rtstruct_path, "RTStruct.dcm")
-        write_dicom_structures(
-            plan_data["structures"],
-            rtstruct_file,
-            plan_data["plan"]
-        )
+        rtplan_path = os.path.join(base_path, "RTPlan")
+        rtstruct_path = os.path.join(base_path, "RTStruct")
+        ct_path = os.path.join(base_path, "CT")
+        dose_path = os.path.join(base_path, "Dose")
 
-        # Export CT Images
-        ct_prefix = os.path.join(ct_path, "CT")
-        write_dicom_image(
-            plan_data["image"],
-            ct_prefix,
-            plan_data["plan"]
-        )
+        if target is None:
+            os.makedirs(rtplan_path, exist_ok=True)
+            os.makedirs(rtstruct_path, exist_ok=True)
+            os.makedirs(ct_path, exist_ok=True)
+            os.makedirs(dose_path, exist_ok=True)
 
-        # Export Dose
-        dose_file = os.path.join(dose_path, "RTDose.dcm")
+        def export_rtplan():
+            rtplan_file = os.path.join(rtplan_path, "RTPlan.dcm")
+            write_dicom_tomo_plan(plan_data["plan"], rtplan_file, target=target, uids=uids)
 
-        write_dicom_dose(
-            dose_data=plan_data["dose"],
-            output_path=dose_file,
-            image_data=plan_data['image']
-        )
-        print(f"Dose exported to: {dose_file}")
+        def export_rtstruct():
+            rtstruct_file = os.path.join(rtstruct_path, "RTStruct.dcm")
+            write_dicom_structures(
+                plan_data["structures"],
+                rtstruct_file,
+                plan_data["plan"],
+                tolerance=self.contour_tolerance,
+                target=target,
+                uids=uids
+            )
+
+        def export_ct():
+            ct_prefix = os.path.join(ct_path, "CT")
+            if self.multiframe_ct:
+                write_dicom_enhanced_image(
+                    plan_data["image"],
+                    f"{ct_prefix}.dcm",
+                    plan_data["plan"],
+                    transfer_syntax=self.transfer_syntax,
+                    encode_workers=self.encode_workers,
+                    target=target,
+                    uids=uids
+                )
+            else:
+                write_dicom_image(
+                    plan_data["image"],
+                    ct_prefix,
+                    plan_data["plan"],
+                    workers=self.write_workers,
+                    transfer_syntax=self.transfer_syntax,
+                    encode_workers=self.encode_workers,
+                    target=target,
+                    uids=uids
+                )
+
+        def export_dose():
+            dose_file = os.path.join(dose_path, "RTDose.dcm")
+            write_dicom_dose(
+                dose_data=plan_data["dose"],
+                output_path=dose_file,
+                image_data=plan_data['image'],
+                transfer_syntax=self.transfer_syntax,
+                encode_workers=self.encode_workers,
+                target=target,
+                uids=uids
+            )
+            print(f"Dose exported to: {dose_file}")
+
+        writers = {"RTPlan": export_rtplan, "RTStruct": export_rtstruct, "CT": export_ct, "Dose": export_dose}
+        try:
+            for group in groups:
+                if manifest is None:
+                    writers[group]()
+                    continue
+
+                # Remove the group's old files, write it, then record it as complete
+                manifest.discard(group)
+                writers[group]()
+                manifest.record(group)
+        finally:
+            if target is not None:
+                target.close()
+
+        if target is not None:
+            print(f"Plan exported to: {target.path}")
+
+    def export_plans(self, plan_uids, export_path):
+        """
+        Export several plans, each into its own subdirectory (or bundle) named after its UID.
+
+        In incremental mode a re-run after an interruption skips the plans and objects that
+        were already written and resumes with the rest.
+
+        Args:
+            plan_uids (list): UIDs of the plans to export.
+            export_path (str): Directory holding the plan exports.
+        """
+        for plan_uid in plan_uids:
+            self.export_dicom(plan_uid, os.path.join(export_path, plan_uid))
+
+    def _uid_variants(self):
+        """
+        Non-default options that change the content of written objects, per UID role.
+
+        memmap writes the CT as raw stored values with the archive rescale instead of the
+        offset eager volume, and a contour tolerance changes the RTSTRUCT contours.
+
+        Returns:
+            dict: Role -> variant string (empty for defaults).
+        """
+        return {
+            "ct": "raw" if self.memmap else "",
+            "rtstruct": f"tolerance={self.contour_tolerance:g}" if self.contour_tolerance else "",
+        }
+
+    def _export_fingerprint(self, plan_uid):
+        """
+        Describe the inputs and every option that changes the written bytes, for the export
+        manifest. Options that only affect speed or memory (workers, caching, masks) are left
+        out.
+
+        Returns:
+            dict: JSON-serializable fingerprint.
+        """
+        stat = os.stat(os.path.join(self.xml_path, self.xml_name))
+        return {
+            "plan_uid": plan_uid,
+            "archive": {"name": self.xml_name, "size": stat.st_size, "mtime": stat.st_mtime_ns},
+            "memmap": self.memmap,
+            "contour_tolerance": self.contour_tolerance,
+            "multiframe_ct": self.multiframe_ct,
+            "transfer_syntax": self.transfer_syntax,
+            "deterministic_uids": self.deterministic_uids,
+        }
 
 
     # def export_dicom(self, plan_uid, export_path):
@@ -10,8 +10,98 @@ import pydicom
 from pydicom.dataset import Dataset, FileDataset
 from datetime import datetime
 import os
+from export_target import open_output
+from export_uids import make_uid
+from dicom_encoding import can_stream, rle_encode_frames, set_pixel_data, transfer_syntax_uid, write_streamed
 
-def write_dicom_dose(dose_data, output_path, image_data=None):
+# Bytes of dose data scaled and written per step when streaming
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class DoseQuantizer:
+    """
+    Quantize a float dose grid to uint16 frame by frame, without modifying or copying it.
+
+    The maximum dose is found in one chunked pass. blocks() then scales and clips whole
+    frames into a preallocated uint16 buffer, reusing one float work buffer, and keeps
+    track of the quantization error (including NaN/inf replaced by 0).
+    """
+
+    def __init__(self, dose_array, frame_size, chunk_size=CHUNK_SIZE):
+        """
+        Initialize the DoseQuantizer and find the maximum dose.
+
+        Args:
+            dose_array (np.ndarray): Dose array (or memmap), in written byte order.
+            frame_size (int): Values per frame (Rows x Columns).
+            chunk_size (int): Approximate bytes of dose data per block; at least one frame.
+        """
+        self.flat = dose_array.reshape(-1)
+        self.step = frame_size * max(1, chunk_size // (frame_size * self.flat.itemsize))
+        self.max_error = 0.0
+        self.sum_squared_error = 0.0
+        self.non_finite = 0
+
+        # NaN and inf count as 0, like the written values
+        self.max_dose = 0
+        for start in range(0, len(self.flat), self.step):
+            block = self.flat[start:start + self.step]
+            finite = np.isfinite(block)
+            if finite.any():
+                self.max_dose = max(self.max_dose, np.max(block, where=finite, initial=-np.inf))
+
+    def blocks(self, scaling, out=None):
+        """
+        Yield the quantized dose block by block.
+
+        Args:
+            scaling (float): Dose per stored unit (DoseGridScaling).
+            out (np.ndarray, optional): Preallocated flat uint16 buffer for the whole grid.
+                                        Without it, one block-sized buffer is reused, so each
+                                        block must be consumed before the next is requested.
+
+        Yields:
+            np.ndarray: uint16 values of the next block of whole frames.
+        """
+        # Scale in the precision numpy would use for dose / scaling
+        work_dtype = (self.flat[:1] / scaling).dtype
+        work = np.empty(min(self.step, len(self.flat)), dtype=work_dtype)
+        scratch = np.empty(len(work), dtype=np.uint16) if out is None else None
+        for start in range(0, len(self.flat), self.step):
+            block = self.flat[start:start + self.step]
+            values = work[:len(block)]
+            quantized = out[start:start + len(block)] if out is not None else scratch[:len(block)]
+
+            np.copyto(values, block)
+            self.non_finite += int(len(block) - np.count_nonzero(np.isfinite(values)))
+            np.nan_to_num(values, copy=False, nan=0, posinf=0, neginf=0)
+            np.divide(values, scaling, out=values)
+            np.clip(values, 0, 65535, out=quantized, casting="unsafe")
+
+            # Error of the stored value against the unclipped scaled dose, in Gy
+            np.subtract(values, quantized, out=values)
+            values *= scaling
+            self.max_error = max(self.max_error, float(np.max(np.abs(values))))
+            self.sum_squared_error += float(np.dot(values, values))
+            yield quantized
+
+    def report(self):
+        """
+        Summarize the quantization error of the blocks produced so far.
+
+        Returns:
+            dict: "max_error" and "rms_error" in Gy, and the "non_finite" value count.
+        """
+        count = len(self.flat)
+        return {
+            "max_error": self.max_error,
+            "rms_error": float(np.sqrt(self.sum_squared_error / count)) if count else 0.0,
+            "non_finite": self.non_finite,
+        }
+
+
+def write_dicom_dose(dose_data, output_path, image_data=None, transfer_syntax="implicit", encode_workers=None,
+                     stream_pixels=True, chunk_size=CHUNK_SIZE, target=None, uids=None):
     """
     Write the dose array to a DICOM RT Dose file.
 
@@ -21,14 +111,27 @@ def write_dicom_dose(dose_data, output_path, image_data=None):
         output_path (str): File path to save the DICOM RTDOSE file.
         image_data (dict, optional): Dictionary containing image and DICOM header information.
                                      Includes patientName, patientID, frameRefUID, etc.
+        transfer_syntax (str): "implicit" (uncompressed), "rle" (RLE Lossless) or "deflate"
+                               (Deflated Explicit VR Little Endian).
+        encode_workers (int, optional): Processes for RLE encoding; defaults to the CPU count.
+        stream_pixels (bool): Write the header first and then scale and stream the dose in
+                              chunks, so no full-grid copy is made. Only used with
+                              uncompressed transfer syntaxes.
+        chunk_size (int): Approximate bytes of dose data per streamed chunk.
+        target (ZipBundle or TarBundle, optional): Bundle to write into; the output path is then
+            the member name.
+        uids (ExportUIDs, optional): Derive the UIDs deterministically; random UIDs by default.
     Returns:
         str: SOPInstanceUID of the saved DICOM file.
     """
+    # Fail early on an unknown transfer syntax
+    transfer_syntax_uid(transfer_syntax)
+
     # Prepare DICOM metadata
     ds = FileDataset("", {}, file_meta=pydicom.Dataset(), preamble=b"\0" * 128)
     ds.Modality = "RTDOSE"
     ds.SOPClassUID = "1.2.840.10008.5.1.4.1.1.481.2"  # RTDOSE SOP Class UID
-    ds.SOPInstanceUID = pydicom.uid.generate_uid()
+    ds.SOPInstanceUID = make_uid(uids, "rtdose", "sop")
     ds.InstanceCreationDate = datetime.now().strftime("%Y%m%d")
     ds.InstanceCreationTime = datetime.now().strftime("%H%M%S")
 
@@ -38,9 +141,9 @@ def write_dicom_dose(dose_data, output_path, image_data=None):
         ds.PatientID = image_data.get("patientID", "000000")
         ds.PatientBirthDate = image_data.get("patientBirthDate", "")
         ds.PatientSex = image_data.get("patientSex", "O")
-        ds.FrameOfReferenceUID = image_data.get("frameRefUID", pydicom.uid.generate_uid())
-        ds.StudyInstanceUID = image_data.get("studyUID", pydicom.uid.generate_uid())
-        ds.SeriesInstanceUID = pydicom.uid.generate_uid()
+        ds.FrameOfReferenceUID = image_data.get("frameRefUID") or make_uid(uids, "frame_of_reference")
+        ds.StudyInstanceUID = image_data.get("studyUID") or make_uid(uids, "study")
+        ds.SeriesInstanceUID = make_uid(uids, "rtdose", "series")
         ds.StudyDescription = image_data.get("studyDescription", "RT Dose Study")
         ds.SeriesDescription = image_data.get("seriesDescription", "RT Dose Series")
     else:
@@ -49,9 +152,9 @@ def write_dicom_dose(dose_data, output_path, image_data=None):
         ds.PatientID = "000000"
         ds.PatientBirthDate = ""
         ds.PatientSex = "O"
-        ds.FrameOfReferenceUID = pydicom.uid.generate_uid()
-        ds.StudyInstanceUID = pydicom.uid.generate_uid()
-        ds.SeriesInstanceUID = pydicom.uid.generate_uid()
+        ds.FrameOfReferenceUID = make_uid(uids, "frame_of_reference")
+        ds.StudyInstanceUID = make_uid(uids, "study")
+        ds.SeriesInstanceUID = make_uid(uids, "rtdose", "series")
         ds.StudyDescription = "RT Dose Study"
         ds.SeriesDescription = "RT Dose Series"
 
@@ -72,26 +175,52 @@ def write_dicom_dose(dose_data, output_path, image_data=None):
     ds.DoseType = "PHYSICAL"
     ds.DoseSummationType = "PLAN"
 
-    # Handle NaN and inf in dose data
-    dose_data["data"] = np.nan_to_num(dose_data["data"], nan=0, posinf=0, neginf=0)
+    # Image pixel description, needed to decode (compressed) pixel data
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+
+    # Quantize frame by frame without touching dose_data["data"]
+    quantizer = DoseQuantizer(dose_data["data"], ds.Rows * ds.Columns, chunk_size)
+    ds.DoseGridScaling = quantizer.max_dose / 65535 if quantizer.max_dose > 0 else 1
+    if target is None:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    # Set DoseGridScaling
-    valid_data = dose_data["data"][~np.isnan(dose_data["data"]) & ~np.isinf(dose_data["data"])]
-    ds.DoseGridScaling = np.max(valid_data) / 65535 if np.max(valid_data) > 0 else 1
+    if stream_pixels and can_stream(transfer_syntax):
+        # Header first, then each quantized block straight into the file
+        ds.file_meta.TransferSyntaxUID = transfer_syntax_uid(transfer_syntax)
+        with open_output(output_path, target) as f:
+            write_streamed(ds, f, quantizer.blocks(ds.DoseGridScaling), dose_data["data"].size * 2)
+    else:
+        # Scale dose data into one preallocated buffer
+        scaled_data = np.empty(dose_data["data"].size, dtype=np.uint16)
+        for _ in quantizer.blocks(ds.DoseGridScaling, out=scaled_data):
+            pass
 
-    # Scale dose data
-    scaled_data = np.clip(dose_data["data"] / ds.DoseGridScaling, 0, 65535).astype(np.uint16)
-    ds.PixelData = scaled_data.tobytes()
+        # RLE encodes each frame (Rows x Columns of the written byte stream) on a process pool
+        encoded_frames = None
+        if transfer_syntax == "rle":
+            frames = scaled_data.reshape(ds.NumberOfFrames, ds.Rows, ds.Columns)
+            encoded_frames = rle_encode_frames(list(frames), encode_workers)
+        set_pixel_data(ds, memoryview(scaled_data).cast('B'), transfer_syntax, encoded_frames)
 
-    # Write the DICOM file
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    ds.save_as(output_path)
+        # Write the DICOM file
+        with open_output(output_path, target) as f:
+            ds.save_as(f)
+
+    error = quantizer.report()
+    print(
+        f"Dose quantization: scaling {float(ds.DoseGridScaling):.6g} Gy, max error {error['max_error']:.3g} Gy, "
+        f"RMS error {error['rms_error']:.3g} Gy, {error['non_finite']} non-finite values set to 0"
+    )
     print(f"DICOM RT Dose file saved to: {output_path}")
 
     return ds.SOPInstanceUID
 
 
-
 # def write_dicom_dose(dose_data, output_path, dicom_info=None):
 #     """
 #     Write the dose array to a DICOM RT Dose file.
@@ -4,8 +4,137 @@ import pydicom
 from pydicom.dataset import Dataset, FileDataset
 from datetime import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from export_target import open_output
+from export_uids import make_uid
+from dicom_encoding import can_stream, rle_encode_frames, set_pixel_data, transfer_syntax_uid, write_streamed
 
-def write_dicom_image(image_data, output_prefix, plan_metadata):
+# Bytes of pixel data reoriented and written per step when streaming
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Enhanced General Equipment attributes are Type 1 but the archive does not record the
+# scanner; these placeholders are used unless plan_metadata provides the values
+EQUIPMENT_PLACEHOLDERS = {
+    "Manufacturer": "UNKNOWN",
+    "ManufacturerModelName": "UNKNOWN",
+    "DeviceSerialNumber": "UNKNOWN",
+    "SoftwareVersions": "UNKNOWN",
+}
+
+def reorient_volume(data, offset=0):
+    """
+    Convert an (x, y, z) volume to a contiguous (z, y, x) uint16 pixel buffer in one pass.
+
+    Args:
+        data (np.ndarray): Image volume indexed [x, y, z] (array or memmap).
+        offset (int): Value added to every voxel before the uint16 conversion.
+
+    Returns:
+        np.ndarray: uint16 array of shape (z, y, x); [i] is the pixel data of slice i.
+    """
+    pixel_volume = np.empty(data.shape[::-1], dtype=np.uint16)
+    np.add(data.transpose(2, 1, 0), offset, out=pixel_volume, casting='unsafe')
+    return pixel_volume
+
+
+def reoriented_slabs(data, offset=0, chunk_size=CHUNK_SIZE):
+    """
+    Yield the reoriented uint16 pixel data of an (x, y, z) volume a few slices at a time.
+
+    The same scratch buffer is reused for every slab, so memory stays bounded by the chunk
+    size; each slab must be consumed before the next one is requested.
+
+    Args:
+        data (np.ndarray): Image volume indexed [x, y, z] (array or memmap).
+        offset (int): Value added to every voxel before the uint16 conversion.
+        chunk_size (int): Approximate slab size in bytes (at least one slice).
+
+    Yields:
+        np.ndarray: uint16 array of shape (slices, y, x) holding the next slices.
+    """
+    nx, ny, nz = data.shape
+    step = max(1, chunk_size // (nx * ny * 2))
+    buffer = np.empty((min(step, nz), ny, nx), dtype=np.uint16)
+    for start in range(0, nz, step):
+        stop = min(start + step, nz)
+        block = buffer[:stop - start]
+        np.add(data[:, :, start:stop].transpose(2, 1, 0), offset, out=block, casting='unsafe')
+        yield block
+
+
+def reoriented_chunks(data, offset=0, chunk_size=CHUNK_SIZE):
+    """
+    Yield the bytes of reoriented_slabs, for streaming the pixel data to a file.
+
+    Args:
+        data (np.ndarray): Image volume indexed [x, y, z] (array or memmap).
+        offset (int): Value added to every voxel before the uint16 conversion.
+        chunk_size (int): Approximate chunk size in bytes (at least one slice).
+
+    Yields:
+        memoryview: Bytes of the next (slices, y, x) block.
+    """
+    for block in reoriented_slabs(data, offset, chunk_size):
+        yield memoryview(block).cast('B')
+
+
+def _in_memory(image_data):
+    """
+    Whether the volume is a rescaled array in RAM, which is cheapest to reorient as a whole.
+
+    Raw and memmapped volumes are reoriented slab by slab instead, so they are never
+    copied into memory in full.
+    """
+    return not image_data.get("data_is_raw") and not isinstance(image_data["data"], np.memmap)
+
+
+def _rle_encode_volume(data, offset, workers, pixel_volume=None):
+    """
+    RLE encode every slice, from the reoriented volume if given or else slab by slab.
+
+    Args:
+        data (np.ndarray): Image volume indexed [x, y, z].
+        offset (int): Value added to every voxel before the uint16 conversion.
+        workers (int, optional): Encoder processes (see rle_encode_frames).
+        pixel_volume (np.ndarray, optional): Result of reorient_volume for the volume.
+
+    Returns:
+        list: Encoded frames (bytes), in slice order.
+    """
+    if pixel_volume is not None:
+        return rle_encode_frames(list(pixel_volume), workers)
+    return [frame for slab in reoriented_slabs(data, offset) for frame in rle_encode_frames(list(slab), workers)]
+
+
+def _pixel_offset(image_data, logger):
+    """
+    Validate the image data and work out the offset applied before the uint16 conversion.
+
+    Args:
+        image_data (dict): Image array and metadata.
+        logger (logging.Logger): Logger for progress messages.
+
+    Returns:
+        tuple: (offset, whether the data is raw stored values).
+    """
+    # Validate image_data contains required fields
+    if not all(key in image_data for key in ["start", "width", "data"]):
+        raise ValueError("Image data must contain 'start', 'width', and 'data' fields.")
+
+    # Raw (memmapped) volumes are written as stored, with their own rescale parameters
+    is_raw = image_data.get("data_is_raw", False)
+
+    # Preprocessing for negative values; the caller's array is never modified
+    offset = 0
+    if not is_raw and np.min(image_data["data"]) < 0:
+        logger.info("Adjusting negative values in data by adding 1024.")
+        offset = 1024
+
+    return offset, is_raw
+
+
+def write_dicom_image(image_data, output_prefix, plan_metadata, workers=4, transfer_syntax="implicit",
+                      encode_workers=None, target=None, uids=None):
     """
     Write the provided image data to a series of DICOM files.
 
@@ -13,6 +142,14 @@ def write_dicom_image(image_data, output_prefix, plan_metadata):
         image_data (dict): Contains the image array and metadata (start, width, and data fields).
         output_prefix (str): Path and prefix for output DICOM files.
         plan_metadata (dict): Contains DICOM header information (e.g., patient name, UID).
+        workers (int): Threads encoding and writing slices; 1 writes them sequentially.
+        transfer_syntax (str): "implicit" (uncompressed), "rle" (RLE Lossless) or "deflate"
+                               (Deflated Explicit VR Little Endian).
+        encode_workers (int, optional): Processes for RLE encoding; defaults to the CPU count.
+        target (ZipBundle or TarBundle, optional): Bundle to write into; the output prefix is then
+            the member name.
+        uids (ExportUIDs, optional): Derive the UIDs deterministically from the image and slice
+            number; random UIDs by default.
 
     Returns:
         list: SOP Instance UIDs of the written images.
@@ -20,14 +157,15 @@ def write_dicom_image(image_data, output_prefix, plan_metadata):
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger("write_dicom_image")
 
-    # Validate image_data contains required fields
-    if not all(key in image_data for key in ["start", "width", "data"]):
-        raise ValueError("Image data must contain 'start', 'width', and 'data' fields.")
+    # Fail early on an unknown transfer syntax
+    transfer_syntax_uid(transfer_syntax)
+    offset, is_raw = _pixel_offset(image_data, logger)
 
-    # Preprocessing for negative values
-    if np.min(image_data["data"]) < 0:
-        logger.info("Adjusting negative values in data by adding 1024.")
-        image_data["data"] += 1024
+    # Reorient an in-memory volume once into a contiguous (z, y, x) uint16 buffer: each
+    # slice is rot90(slice, 3) flipped left-right, i.e. the transposed (x, y) slice.
+    # Raw or memmapped volumes are reoriented one slice at a time as they are written
+    data = image_data["data"]
+    pixel_volume = reorient_volume(data, offset) if _in_memory(image_data) else None
 
     # Create File Meta Information dataset
     file_meta = Dataset()
@@ -36,63 +174,247 @@ def write_dicom_image(image_data, output_prefix, plan_metadata):
     file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
     file_meta.ImplementationClassUID = '1.2.40.0.13.1.1'
 
-    sop_instance_uids = []
+    logger.debug(f"Image data: shape {image_data['data'].shape}, dtype {image_data['data'].dtype}")
+
+    # Series-level attributes are identical for every slice: build them once
+    dt = datetime.now()
+    template = Dataset()
+    template.Modality = 'CT'
+    template.ImageType = ['ORIGINAL', 'PRIMARY', 'AXIAL']
+
+    # Add patient and study information
+    template.PatientName = plan_metadata.get("patientName", "UNKNOWN")
+    template.PatientID = plan_metadata.get("patientID", "00000000")
+    template.StudyInstanceUID = plan_metadata.get("studyUID") or make_uid(uids, "study")
+    template.SeriesInstanceUID = plan_metadata.get("seriesUID") or make_uid(uids, "ct", "series")
+    template.FrameOfReferenceUID = plan_metadata.get("frameRefUID") or make_uid(uids, "frame_of_reference")
 
-    print ("what is image data :", image_data['data'])
+    template.SliceThickness = image_data["width"][2] * 10
+    template.PixelSpacing = [image_data["width"][0] * 10, image_data["width"][1] * 10]
+    # Rows and columns of the reoriented slices: y by x
+    template.Rows, template.Columns = data.shape[1], data.shape[0]
+    template.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    template.SamplesPerPixel = 1
+    template.PhotometricInterpretation = "MONOCHROME2"
+    template.BitsAllocated = 16
+    template.BitsStored = 16
+    template.HighBit = 15
+    template.PixelRepresentation = 0
+    template.RescaleIntercept = image_data.get("rescale_intercept", -1024) if is_raw else -1024
+    template.RescaleSlope = image_data.get("rescale_slope", 1) if is_raw else 1
 
-    # Iterate through slices
-    for i in range(image_data["data"].shape[2]):
-        logger.info(f"Processing slice {i + 1}.")
+    # Set file creation date and time
+    template.InstanceCreationDate = dt.strftime("%Y%m%d")
+    template.InstanceCreationTime = dt.strftime("%H%M%S")
 
-        # Create the DICOM dataset
-        ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\x00" * 128)
-        ds.Modality = 'CT'
-        ds.ImageType = ['ORIGINAL', 'PRIMARY', 'AXIAL']
+    num_slices = data.shape[2]
+    # RLE compresses every slice up front on a process pool; writing stays on threads
+    encoded_frames = (
+        _rle_encode_volume(data, offset, encode_workers, pixel_volume) if transfer_syntax == "rle" else None
+    )
+    sop_instance_uids = [make_uid(uids, "ct", "sop", i + 1) for i in range(num_slices)]
 
-        # Add patient and study information
-        ds.PatientName = plan_metadata.get("patientName", "UNKNOWN")
-        ds.PatientID = plan_metadata.get("patientID", "00000000")
-        ds.StudyInstanceUID = plan_metadata.get("studyUID", pydicom.uid.generate_uid())
-        ds.SeriesInstanceUID = plan_metadata.get("seriesUID", pydicom.uid.generate_uid())
-        ds.FrameOfReferenceUID = plan_metadata.get("frameRefUID", pydicom.uid.generate_uid())
+    def write_slice(i):
+        # Clone the shared header; its elements are never modified, only per-slice ones are added
+        ds = FileDataset(None, {}, file_meta=Dataset(), preamble=b"\x00" * 128)
+        ds.file_meta.update(file_meta)
+        ds.update(template)
 
         # Set image-specific metadata
-        ds.SOPInstanceUID = pydicom.uid.generate_uid()
-        sop_instance_uids.append(ds.SOPInstanceUID)
+        ds.SOPInstanceUID = sop_instance_uids[i]
         ds.InstanceNumber = i + 1
-        ds.SliceThickness = image_data["width"][2] * 10
-        ds.PixelSpacing = [image_data["width"][0] * 10, image_data["width"][1] * 10]
-        ds.Rows, ds.Columns = image_data["data"].shape[:2]
         ds.ImagePositionPatient = [
             image_data["start"][0] * 10,
             image_data["start"][1] * 10,
             (image_data["start"][2] + i * image_data["width"][2]) * 10,
         ]
-        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
-        ds.SamplesPerPixel = 1
-        ds.PhotometricInterpretation = "MONOCHROME2"
-        ds.BitsAllocated = 16
-        ds.BitsStored = 16
-        ds.HighBit = 15
-        ds.PixelRepresentation = 0
-        ds.RescaleIntercept = -1024
-        ds.RescaleSlope = 1
-
-        # Debugging metadata values
-        logger.debug(f"Slice {i + 1} metadata: {ds}")
-
-        # Apply transformations to pixel data
-        pixel_data = np.flip(np.rot90(image_data["data"][:, :, i], 3), 1)
-        ds.PixelData = pixel_data.astype(np.uint16).tobytes()
-
-        # Set file creation date and time
-        dt = datetime.now()
-        ds.InstanceCreationDate = dt.strftime("%Y%m%d")
-        ds.InstanceCreationTime = dt.strftime("%H%M%S")
+
+        # Pixel data is a zero-copy view of the reoriented slice (or its RLE encoding); slices
+        # of raw or memmapped volumes are reoriented here
+        if encoded_frames:
+            pixel_data = None
+        elif pixel_volume is not None:
+            pixel_data = memoryview(pixel_volume[i]).cast('B')
+        else:
+            pixel_data = memoryview(reorient_volume(data[:, :, i:i + 1], offset)[0]).cast('B')
+        set_pixel_data(ds, pixel_data, transfer_syntax, encoded_frames[i:i + 1] if encoded_frames else None)
 
         # Write the DICOM file
         output_file = f"{output_prefix}_{i + 1:03d}.dcm"
-        pydicom.dcmwrite(output_file, ds)
-        logger.info(f"Written slice {i + 1} to {output_file}.")
+        with open_output(output_file, target) as f:
+            pydicom.dcmwrite(f, ds)
+        logger.debug(f"Written slice {i + 1} to {output_file}.")
+
+    # Encode and write slices on a bounded pool; pixel data is only built inside each task
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(write_slice, range(num_slices)):
+                pass
+    else:
+        for i in range(num_slices):
+            write_slice(i)
 
+    logger.info(f"Written {num_slices} CT slices to {output_prefix}_*.dcm.")
     return sop_instance_uids
+
+
+def write_dicom_enhanced_image(image_data, output_file, plan_metadata, transfer_syntax="implicit",
+                               encode_workers=None, stream_pixels=True, chunk_size=CHUNK_SIZE, target=None,
+                               uids=None):
+    """
+    Write the provided image data to a single Enhanced CT (multi-frame) DICOM file.
+
+    Attributes shared by all slices go into the shared functional groups; each frame only
+    carries its position and stack index.
+
+    Args:
+        image_data (dict): Contains the image array and metadata (start, width, and data fields).
+        output_file (str): Path of the output DICOM file.
+        plan_metadata (dict): Contains DICOM header information (e.g., patient name, UID).
+        transfer_syntax (str): "implicit" (uncompressed), "rle" (RLE Lossless) or "deflate"
+                               (Deflated Explicit VR Little Endian).
+        encode_workers (int, optional): Processes for RLE encoding; defaults to the CPU count.
+        stream_pixels (bool): Write the header first and then stream the reoriented pixel data
+                              in chunks, without building the whole pixel volume. Only used
+                              with uncompressed transfer syntaxes.
+        chunk_size (int): Approximate bytes per streamed chunk.
+        target (ZipBundle or TarBundle, optional): Bundle to write into; the output path is then
+            the member name.
+        uids (ExportUIDs, optional): Derive the UIDs deterministically from the image; random
+            UIDs by default.
+
+    Returns:
+        str: SOP Instance UID of the written image.
+    """
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("write_dicom_image")
+
+    # Fail early on an unknown transfer syntax
+    transfer_syntax_uid(transfer_syntax)
+    offset, is_raw = _pixel_offset(image_data, logger)
+    stream_pixels = stream_pixels and can_stream(transfer_syntax)
+    columns, rows, num_frames = image_data["data"].shape
+
+    # Create File Meta Information dataset
+    file_meta = Dataset()
+    file_meta.FileMetaInformationVersion = b'\x00\x01'
+    file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2.1'  # Enhanced CT Image Storage
+    file_meta.MediaStorageSOPInstanceUID = make_uid(uids, "ct", "enhanced", "sop")
+    file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
+    file_meta.ImplementationClassUID = '1.2.40.0.13.1.1'
+
+    ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\x00" * 128)
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = 'CT'
+    ds.ImageType = ['ORIGINAL', 'PRIMARY', 'AXIAL', 'NONE']
+
+    # Add patient and study information
+    ds.PatientName = plan_metadata.get("patientName", "UNKNOWN")
+    ds.PatientID = plan_metadata.get("patientID", "00000000")
+    ds.StudyInstanceUID = plan_metadata.get("studyUID") or make_uid(uids, "study")
+    ds.SeriesInstanceUID = plan_metadata.get("seriesUID") or make_uid(uids, "ct", "enhanced", "series")
+    ds.FrameOfReferenceUID = plan_metadata.get("frameRefUID") or make_uid(uids, "frame_of_reference")
+    ds.PositionReferenceIndicator = ""
+    ds.InstanceNumber = 1
+
+    # Enhanced General Equipment
+    for keyword, placeholder in EQUIPMENT_PLACEHOLDERS.items():
+        setattr(ds, keyword, plan_metadata.get(keyword) or placeholder)
+
+    # Set file creation date and time
+    dt = datetime.now()
+    ds.InstanceCreationDate = ds.ContentDate = dt.strftime("%Y%m%d")
+    ds.InstanceCreationTime = ds.ContentTime = dt.strftime("%H%M%S")
+    ds.AcquisitionDateTime = dt.strftime("%Y%m%d%H%M%S")
+
+    # Image pixel description
+    ds.NumberOfFrames = num_frames
+    ds.Rows, ds.Columns = rows, columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PresentationLUTShape = "IDENTITY"
+    ds.BurnedInAnnotation = "NO"
+    ds.LossyImageCompression = "00"
+    ds.ContentQualification = "PRODUCT"
+    ds.PixelPresentation = "MONOCHROME"
+    ds.VolumetricProperties = "VOLUME"
+    ds.VolumeBasedCalculationTechnique = "NONE"
+
+    # Frames are ordered along one stack, indexed by their position in it
+    dimension_uid = make_uid(uids, "ct", "enhanced", "dimension")
+    organization = Dataset()
+    organization.DimensionOrganizationUID = dimension_uid
+    ds.DimensionOrganizationSequence = [organization]
+    index = Dataset()
+    index.DimensionOrganizationUID = dimension_uid
+    index.DimensionIndexPointer = 0x00209057  # In-Stack Position Number
+    index.FunctionalGroupPointer = 0x00209111  # Frame Content Sequence
+    ds.DimensionIndexSequence = [index]
+
+    # Shared functional groups
+    shared = Dataset()
+    measures = Dataset()
+    measures.PixelSpacing = [image_data["width"][0] * 10, image_data["width"][1] * 10]
+    measures.SliceThickness = image_data["width"][2] * 10
+    shared.PixelMeasuresSequence = [measures]
+    orientation = Dataset()
+    orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    shared.PlaneOrientationSequence = [orientation]
+    transformation = Dataset()
+    transformation.RescaleIntercept = image_data.get("rescale_intercept", -1024) if is_raw else -1024
+    transformation.RescaleSlope = image_data.get("rescale_slope", 1) if is_raw else 1
+    transformation.RescaleType = "HU"
+    shared.PixelValueTransformationSequence = [transformation]
+    frame_type = Dataset()
+    frame_type.FrameType = ['ORIGINAL', 'PRIMARY', 'AXIAL', 'NONE']
+    frame_type.PixelPresentation = ds.PixelPresentation
+    frame_type.VolumetricProperties = ds.VolumetricProperties
+    frame_type.VolumeBasedCalculationTechnique = ds.VolumeBasedCalculationTechnique
+    shared.CTImageFrameTypeSequence = [frame_type]
+    ds.SharedFunctionalGroupsSequence = [shared]
+
+    # Per-frame functional groups: position and stack index only
+    per_frame = []
+    for i in range(num_frames):
+        frame = Dataset()
+        position = Dataset()
+        position.ImagePositionPatient = [
+            image_data["start"][0] * 10,
+            image_data["start"][1] * 10,
+            (image_data["start"][2] + i * image_data["width"][2]) * 10,
+        ]
+        frame.PlanePositionSequence = [position]
+        content = Dataset()
+        content.StackID = "1"
+        content.InStackPositionNumber = i + 1
+        content.DimensionIndexValues = [i + 1]
+        frame.FrameContentSequence = [content]
+        per_frame.append(frame)
+    ds.PerFrameFunctionalGroupsSequence = per_frame
+
+    if stream_pixels:
+        # Header first, then the frames reoriented chunk by chunk straight into the file
+        ds.file_meta.TransferSyntaxUID = transfer_syntax_uid(transfer_syntax)
+        with open_output(output_file, target) as f:
+            write_streamed(
+                ds, f, reoriented_chunks(image_data["data"], offset, chunk_size), num_frames * rows * columns * 2
+            )
+    else:
+        if transfer_syntax == "rle" and not _in_memory(image_data):
+            # RLE encoded slab by slab, so a raw or memmapped volume is never copied in full
+            pixel_data, encoded_frames = None, _rle_encode_volume(image_data["data"], offset, encode_workers)
+        else:
+            # All frames in one zero-copy buffer, or RLE encoded frame by frame on a process pool
+            pixel_volume = reorient_volume(image_data["data"], offset)
+            pixel_data = memoryview(pixel_volume.reshape(-1)).cast('B')
+            encoded_frames = rle_encode_frames(list(pixel_volume), encode_workers) if transfer_syntax == "rle" else None
+        set_pixel_data(ds, pixel_data, transfer_syntax, encoded_frames)
+        with open_output(output_file, target) as f:
+            pydicom.dcmwrite(f, ds)
+    logger.info(f"Written {num_frames} CT frames to {output_file}.")
+    return ds.SOPInstanceUID
@@ -1,10 +1,12 @@
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
-from pydicom.uid import generate_uid
 import datetime
 import numpy as np
+from contour_simplify import decimate_structures
+from export_target import open_output
+from export_uids import make_uid
 
-def write_dicom_structures(structures, file_path, dicom_header=None):
+def write_dicom_structures(structures, file_path, dicom_header=None, tolerance=None, target=None, uids=None):
     """
     Writes a structure set to a DICOM RT Structure Set (RTSS) file.
 
@@ -17,6 +19,11 @@ def write_dicom_structures(structures, file_path, dicom_header=None):
         dicom_header (dict, optional): DICOM header information including:
             - patientName, patientID, patientBirthDate, patientSex, patientAge,
               classUID, studyUID, seriesUID, frameRefUID, instanceUIDs, seriesDescription.
+        tolerance (float, optional): Simplify every contour with Douglas-Peucker so no removed
+            point is farther than this many mm from the written contour. None writes all points.
+        target (ZipBundle or TarBundle, optional): Bundle to write into; the output path is then
+            the member name.
+        uids (ExportUIDs, optional): Derive the UIDs deterministically; random UIDs by default.
 
     Returns:
         str: SOPInstanceUID of the written RTSS file.
@@ -27,13 +34,22 @@ def write_dicom_structures(structures, file_path, dicom_header=None):
         date_str = now.strftime("%Y%m%d")
         time_str = now.strftime("%H%M%S")
 
+        # Decimate dense contours before writing
+        if tolerance:
+            structures, report = decimate_structures(structures, tolerance)
+            for roi in report:
+                print(
+                    f"Contours of {roi['name']}: {roi['points_before']} -> {roi['points_after']} points "
+                    f"({roi['reduction']:.1%} removed), max deviation {roi['max_deviation']:.3f} mm"
+                )
+
         # Create a FileDataset instance for the RT Structure Set
         ds = FileDataset(file_path, {}, file_meta=Dataset(), preamble=b"\0" * 128)
 
         # File Meta Information
         ds.file_meta.FileMetaInformationVersion = b"\x00\x01"
         ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.481.3"
-        ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds.file_meta.MediaStorageSOPInstanceUID = make_uid(uids, "rtstruct", "sop")
         ds.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2"  # Implicit VR Little Endian
         ds.file_meta.ImplementationClassUID = "1.2.40.0.13.1.1"
 
@@ -48,9 +64,10 @@ def write_dicom_structures(structures, file_path, dicom_header=None):
         ds.PatientSex = dicom_header.get("patientSex", "") if dicom_header else ""
 
         # Study and Series Information
-        ds.StudyInstanceUID = dicom_header.get("studyUID", generate_uid()) if dicom_header else generate_uid()
-        ds.SeriesInstanceUID = dicom_header.get("seriesUID", generate_uid()) if dicom_header else generate_uid()
-        ds.FrameOfReferenceUID = dicom_header.get("frameRefUID", generate_uid()) if dicom_header else generate_uid()
+        header = dicom_header or {}
+        ds.StudyInstanceUID = header.get("studyUID") or make_uid(uids, "study")
+        ds.SeriesInstanceUID = header.get("seriesUID") or make_uid(uids, "rtstruct", "series")
+        ds.FrameOfReferenceUID = header.get("frameRefUID") or make_uid(uids, "frame_of_reference")
         ds.SeriesDescription = dicom_header.get("seriesDescription", "Structure Set") if dicom_header else "Structure Set"
         ds.StructureSetLabel = dicom_header.get("structureLabel", "") if dicom_header else ""
         ds.StructureSetDate = date_str
@@ -121,7 +138,8 @@ def write_dicom_structures(structures, file_path, dicom_header=None):
         # Save the DICOM file
         ds.is_little_endian = True
         ds.is_implicit_VR = True
-        ds.save_as(file_path)
+        with open_output(file_path, target) as f:
+            ds.save_as(f)
 
         print(f"DICOM RT Structure Set saved successfully to {file_path}")
         return ds.SOPInstanceUID
@@ -1,17 +1,21 @@
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
-from pydicom.uid import generate_uid
 import datetime
 import numpy as np
+from export_target import open_output
+from export_uids import make_uid
 
 
-def write_dicom_tomo_plan(plan, file_path):
+def write_dicom_tomo_plan(plan, file_path, target=None, uids=None):
     """
     Writes a TomoTherapy plan to a DICOM RT Plan file.
 
     Args:
         plan (dict): Plan data containing patient and treatment information.
         file_path (str): Path to save the DICOM RT Plan file.
+        target (ZipBundle or TarBundle, optional): Bundle to write into; the output path is then
+            the member name.
+        uids (ExportUIDs, optional): Derive the UIDs deterministically; random UIDs by default.
 
     Returns:
         str: SOPInstanceUID of the written RT Plan file.
@@ -28,7 +32,7 @@ def write_dicom_tomo_plan(plan, file_path):
         # File Meta Information
         ds.file_meta.FileMetaInformationVersion = b"\x00\x01"
         ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.481.5"
-        ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds.file_meta.MediaStorageSOPInstanceUID = make_uid(uids, "rtplan", "sop")
         ds.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2"  # Implicit VR Little Endian
         ds.file_meta.ImplementationClassUID = "1.2.40.0.13.1.1"
 
@@ -43,9 +47,9 @@ def write_dicom_tomo_plan(plan, file_path):
         ds.PatientSex = plan.get("patientSex", "")
 
         # Study and Series Information
-        ds.StudyInstanceUID = plan.get("studyUID", generate_uid())
-        ds.SeriesInstanceUID = generate_uid()
-        ds.FrameOfReferenceUID = plan.get("frameRefUID", generate_uid())
+        ds.StudyInstanceUID = plan.get("studyUID") or make_uid(uids, "study")
+        ds.SeriesInstanceUID = make_uid(uids, "rtplan", "series")
+        ds.FrameOfReferenceUID = plan.get("frameRefUID") or make_uid(uids, "frame_of_reference")
         ds.StudyDate = date_str
         ds.StudyTime = time_str
         ds.SeriesDescription = plan.get("seriesDescription", "TomoTherapy Plan")
@@ -127,7 +131,8 @@ def write_dicom_tomo_plan(plan, file_path):
         # Save the DICOM file
         ds.is_little_endian = True
         ds.is_implicit_VR = True
-        ds.save_as(file_path)
+        with open_output(file_path, target) as f:
+            ds.save_as(f)
 
         print(f"DICOM RT Plan saved successfully to {file_path}")
         return ds.SOPInstanceUID